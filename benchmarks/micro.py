@@ -0,0 +1,279 @@
+"""Micro-benchmarks of the bencode, wire message codec and hashing hot paths
+
+Example:
+    python benchmarks/micro.py --json before.json
+    python benchmarks/micro.py --compare before.json --threshold 10
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "torrent_client"))
+
+from bencode.decode import bdecode
+from bencode.encode import bencode
+from peer.network import *
+from peer.peer import PeerConnection
+from peer.bitset import Bitset
+from tracker.blocks import Block, BlockManager
+from tracker.file_saver import FileSaver
+from tracker.disk import DiskPool
+from tracker.stats import TorrentStats
+from tracker.torrent import SingleFileTorrent
+from sim.swarm import synthetic_torrent
+import argparse
+import platform
+import tempfile
+import asyncio
+import atexit
+import shutil
+import timeit
+import json
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark. The decorated function does the setup and returns the callable to be timed
+
+    Args:
+        name: the benchmark name
+
+    Returns:
+        the decorator
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def torrent_dict(pieces, files=0):
+    """Build a torrent dict of a given size without content, for the codec benchmarks
+
+    Args:
+        pieces: number of pieces
+        files: number of files, single file if 0
+
+    Returns:
+        a torrent dict
+    """
+
+    info = {b"name": b"bench", b"piece length": 2 ** 18, b"pieces": os.urandom(20 * pieces)}
+    if files:
+        info[b"files"] = [{b"length": 2 ** 18, b"path": [b"dir", f"file{i}.bin".encode()]} for i in range(files)]
+    else:
+        info[b"length"] = pieces * 2 ** 18
+
+    return {b"announce": b"http://127.0.0.1:6969/announce", b"comment": b"benchmark",
+            b"info": dict(sorted(info.items()))}
+
+
+@benchmark("bdecode_small")
+def bdecode_small():
+    data = bencode(torrent_dict(16))
+    return lambda: bdecode(data)
+
+
+@benchmark("bdecode_huge")
+def bdecode_huge():
+    data = bencode(torrent_dict(4000, files=500))
+    return lambda: bdecode(data)
+
+
+@benchmark("bencode_small")
+def bencode_small():
+    value = torrent_dict(16)
+    return lambda: bencode(value)
+
+
+@benchmark("bencode_huge")
+def bencode_huge():
+    value = torrent_dict(4000, files=500)
+    return lambda: bencode(value)
+
+
+SAMPLE_MESSAGES = {
+    "keepalive": KeepAliveMessage(),
+    "unchoke": SimpleMessage(1, MESSAGE_UNCHOKE),
+    "have": HaveMessage(5, MESSAGE_HAVE, 1234),
+    "bitfield": BitfieldMessage(1 + 1250, MESSAGE_BITFIELD, b"\xff" * 1250),
+    "request": RequestMessage(12, 2 ** 14, 2 ** 14),
+    "cancel": CancelMessage(12, 2 ** 14, 2 ** 14),
+    "reject": RejectMessage(12, 2 ** 14, 2 ** 14),
+    "allowed_fast": PieceIndexMessage(MESSAGE_ALLOWED_FAST, 77),
+    "piece": PieceMessage(12, 2 ** 14, os.urandom(2 ** 14), 9 + 2 ** 14, MESSAGE_PIECE),
+    "extended": ExtendedMessage(1, bencode({b"added": os.urandom(60), b"added.f": os.urandom(10)})),
+    "handshake": HandshakeMessage(os.urandom(20), b"-BC0001-123456789012", reserved=RESERVED_FAST_EXTENSION),
+}
+
+
+def register_codec(name, msg):
+    """Register the raw, from_msg and create_peer_message benchmarks of a sample message
+
+    Args:
+        name: the message name
+        msg: a sample message object
+
+    Returns:
+        None
+    """
+
+    raw = msg.raw
+
+    benchmark(f"{name}_raw")(lambda: lambda: msg.raw)
+    benchmark(f"{name}_from_msg")(lambda: lambda: type(msg).from_msg(raw))
+    benchmark(f"create_peer_message_{name}")(lambda: lambda: PeerConnection.create_peer_message(raw))
+
+
+for message_name, sample in SAMPLE_MESSAGES.items():
+    register_codec(message_name, sample)
+
+
+@benchmark("bitfield_available_pieces")
+def bitfield_available_pieces():
+    msg = SAMPLE_MESSAGES["bitfield"]
+    return lambda: msg.available_pieces
+
+
+@benchmark("bitset_update")
+def bitset_update():
+    bitfield = SAMPLE_MESSAGES["bitfield"].bitfield
+    return lambda: Bitset().update(bitfield)
+
+
+@benchmark("file_saver_verify")
+def file_saver_verify():
+    data, torrent = synthetic_torrent(4 * 2 ** 20, piece_length=2 ** 16)
+    torrent = SingleFileTorrent.from_dict(torrent)
+    blocks = [PieceMessage(offset // torrent.piece_length, offset % torrent.piece_length,
+                           data[offset:offset + Block.BLOCK_SIZE], 9 + Block.BLOCK_SIZE, MESSAGE_PIECE)
+              for offset in range(0, len(data), Block.BLOCK_SIZE)]
+
+    directory = tempfile.mkdtemp(prefix="micro-")
+    pool = DiskPool()
+    loop = asyncio.new_event_loop()
+
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    atexit.register(pool.shutdown)
+    atexit.register(loop.close)
+
+    async def assemble():
+        saver = FileSaver(torrent, TorrentStats(), directory, pool)
+        for block in blocks:
+            await saver.append(block)
+        await saver.save()
+
+    return lambda: loop.run_until_complete(assemble())
+
+
+@benchmark("block_manager_construction")
+def block_manager_construction():
+    torrent = SingleFileTorrent.from_dict(torrent_dict(16384))
+    return lambda: BlockManager(torrent)
+
+
+def measure(func, repeat):
+    """Time a callable
+
+    Args:
+        func: the callable to be timed
+        repeat: number of timing rounds, the fastest is kept
+
+    Returns:
+        seconds per call
+    """
+
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every benchmark against a baseline
+
+    Args:
+        results: a dictionary of benchmark name to seconds per call
+        baseline: a baseline dictionary of the same form
+        threshold: percent slowdown that counts as a regression
+
+    Returns:
+        a list of the regressed benchmark names
+    """
+
+    regressions = []
+
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+
+        change = (seconds - baseline[name]) / baseline[name] * 100
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+
+        print(f"{name:40} {baseline[name] * 1e6:12.3f} -> {seconds * 1e6:12.3f} us  {change:+7.1f}%"
+              + ("  REGRESSION" if regressed else ""))
+
+    return regressions
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        an argparse namespace
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", help="substrings of the benchmarks to run, all if not given")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds per benchmark, the fastest is kept")
+    parser.add_argument("--json", help="save the results to a json file")
+    parser.add_argument("--compare", help="a json result to compare against")
+    parser.add_argument("--threshold", type=float, default=10, help="percent slowdown reported as a regression")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the micro-benchmarks
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        1 if a benchmark regressed against the baseline, else 0
+    """
+
+    args = parse_args(argv)
+    results = {}
+
+    for name, setup in BENCHMARKS.items():
+        if args.names and not any(part in name for part in args.names):
+            continue
+
+        results[name] = measure(setup(), args.repeat)
+        if not args.compare:
+            print(f"{name:40} {results[name] * 1e6:12.3f} us", flush=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
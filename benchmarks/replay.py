@@ -0,0 +1,184 @@
+"""Download benchmark replaying captured peer wire sessions over loopback, without any network
+
+Record the captures with `python torrent_client --capture DIR download ...` first.
+
+Example:
+    python benchmarks/replay.py movie.torrent captures/*.btcap --speed 4 --json result.json
+    python benchmarks/replay.py movie.torrent captures/*.btcap --speed 4 --baseline result.json
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "torrent_client"))
+
+from bencode.decode import bdecode
+from bencode.encode import bencode
+from session import Session, COMPLETED
+from sim.replay import ReplayPeer
+from sim.swarm import StandInTracker
+from throughput import summarize, report
+import multiprocessing
+import argparse
+import resource
+import tempfile
+import asyncio
+import shutil
+import json
+import time
+
+MiB = 2 ** 20
+
+
+def run_replay(conn, torrent_dict, torrent_path, captures, speed):
+    """The replay process, runs a fake peer per capture and a tracker handing them out until the benchmark
+    closes the pipe
+
+    Args:
+        conn: the pipe end used to report readiness and the replay counters
+        torrent_dict: the torrent dict of the captured download
+        torrent_path: path the torrent file pointing at the stand-in tracker is written to
+        captures: a list of capture file paths
+        speed: how many times faster than captured the messages are sent
+
+    Returns:
+        None
+    """
+
+    async def serve():
+        blocks = {}
+        peers = [ReplayPeer(path, speed, blocks) for path in captures]
+        tracker = StandInTracker([await peer.start() for peer in peers])
+        torrent_dict[b"announce"] = (await tracker.start()).encode()
+
+        with open(torrent_path, "wb") as f:
+            f.write(bencode(torrent_dict))
+        conn.send(max(peer.duration for peer in peers))
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, conn.recv)
+
+        conn.send((sum(peer.uploaded_bytes for peer in peers), sum(peer.skipped for peer in peers)))
+        for peer in peers:
+            peer.stop()
+        tracker.stop()
+
+    asyncio.run(serve())
+
+
+def run_once(args, workdir):
+    """Replay the captures to a fresh session once
+
+    Args:
+        args: the parsed arguments
+        workdir: a scratch directory
+
+    Returns:
+        a dictionary of the run measurements
+    """
+
+    with open(args.torrent, "rb") as f:
+        torrent_dict = bdecode(f.read())
+
+    torrent_path = os.path.join(workdir, "replay.torrent")
+    download_dir = os.path.join(workdir, "download")
+    shutil.rmtree(download_dir, ignore_errors=True)
+
+    conn, child_conn = multiprocessing.Pipe()
+    replay = multiprocessing.Process(target=run_replay, daemon=True,
+                                     args=(child_conn, torrent_dict, torrent_path, args.captures, args.speed))
+    replay.start()
+    duration = conn.recv()
+
+    session = Session(max_peers_per_torrent=len(args.captures), download_dir=download_dir)
+    session.start()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+
+    handle = session.add(torrent_path)
+    handle.wait(duration + args.timeout)
+    elapsed = time.monotonic() - started
+
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    stats = handle.stats
+    downloaded, verified, failed = stats.downloaded_bytes, stats.pieces_verified, stats.pieces_failed
+    completed = handle.state == COMPLETED
+    session.stop()
+
+    conn.send("stop")
+    uploaded, skipped = conn.recv()
+    replay.join()
+
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+
+    return {
+        "mb_per_s": downloaded / MiB / elapsed,
+        "elapsed_s": elapsed,
+        "completed": float(completed),
+        "downloaded_mb": downloaded / MiB,
+        "pieces_verified": verified,
+        "pieces_failed": failed,
+        "unanswered": skipped,
+        "cpu_s_per_gb": cpu / (downloaded / 2 ** 30) if downloaded else 0.0,
+        "peak_rss_mb": after.ru_maxrss / 1024,
+        "overhead": uploaded / downloaded - 1 if downloaded else 0.0,
+    }
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        an argparse namespace
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("torrent", help="the *.torrent file of the captured download")
+    parser.add_argument("captures", nargs="+", help="capture files, one fake peer is run per file")
+    parser.add_argument("--speed", type=float, default=1, help="replay this many times faster than captured")
+    parser.add_argument("--runs", type=int, default=1, help="number of runs, the median is reported")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="seconds a run may last beyond the replay before it is stopped")
+    parser.add_argument("--json", help="save the result to a json file")
+    parser.add_argument("--baseline", help="a json result to compare against")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        the process exit code
+    """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="replay-")
+
+    try:
+        result = summarize([run_once(args, workdir) for _ in range(args.runs)])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["result"]
+
+    report(result, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "result": result}, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""End-to-end download benchmark against a loopback swarm of stand-in seeders
+
+Example:
+    python benchmarks/throughput.py --size 64 --seeders 4 --latency 20 --json result.json
+    python benchmarks/throughput.py --size 64 --seeders 4 --latency 20 --baseline result.json
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "torrent_client"))
+
+from session import Session, COMPLETED
+from sim.swarm import Swarm
+from tracker.profiler import Profiler
+from tracker.buffers import BufferPool
+import multiprocessing
+import statistics
+import argparse
+import resource
+import tempfile
+import asyncio
+import shutil
+import json
+import time
+
+MiB = 2 ** 20
+
+
+def run_swarm(conn, torrent_path, size, seeders, piece_length, seeder_kwargs):
+    """The swarm process, runs the seeders and the tracker until the benchmark closes the pipe
+
+    Args:
+        conn: the pipe end used to report readiness and the uploaded bytes
+        torrent_path: path the torrent file is written to
+        size: content size in bytes
+        seeders: number of seeders
+        piece_length: the torrent piece length
+        seeder_kwargs: Seeder arguments
+
+    Returns:
+        None
+    """
+
+    async def serve():
+        swarm = Swarm(size, seeders, piece_length, **seeder_kwargs)
+        await swarm.start()
+        swarm.write_torrent(torrent_path)
+        conn.send("ready")
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, conn.recv)
+
+        conn.send(swarm.uploaded_bytes)
+        swarm.stop()
+
+    asyncio.run(serve())
+
+
+def run_once(args, workdir):
+    """Download the synthetic torrent once
+
+    Args:
+        args: the parsed arguments
+        workdir: a scratch directory
+
+    Returns:
+        a dictionary of the run measurements
+    """
+
+    seeder_kwargs = dict(latency=args.latency / 1000, bandwidth=args.bandwidth * 1024 if args.bandwidth else None,
+                         choke_interval=args.choke_interval, choke_duration=args.choke_duration, fast=args.fast)
+    torrent_path = os.path.join(workdir, "synthetic.torrent")
+    size = int(args.size * MiB)
+
+    conn, child_conn = multiprocessing.Pipe()
+    swarm = multiprocessing.Process(target=run_swarm, daemon=True,
+                                    args=(child_conn, torrent_path, size, args.seeders, args.piece_length * 1024,
+                                          seeder_kwargs))
+    swarm.start()
+    conn.recv()
+
+    profiler = Profiler(args.profile, cprofile=args.cprofile) if args.profile else None
+    session = Session(max_peers_per_torrent=args.seeders, download_dir=os.path.join(workdir, "download"),
+                      profiler=profiler, buffer_pool=BufferPool(int(args.memory_budget * MiB)))
+    session.start()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+
+    handle = session.add(torrent_path)
+    finished = handle.wait(args.timeout)
+    elapsed = time.monotonic() - started
+
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    session.stop()
+
+    conn.send("stop")
+    uploaded = conn.recv()
+    swarm.join()
+
+    if not finished or handle.state != COMPLETED:
+        raise Exception(f"download {handle.state}: {handle.error or 'timed out'}")
+
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+
+    return {
+        "mb_per_s": size / MiB / elapsed,
+        "elapsed_s": elapsed,
+        "ttfb_s": handle.tracker.time_to_first_piece,
+        "cpu_s_per_gb": cpu / (size / 2 ** 30),
+        "peak_rss_mb": after.ru_maxrss / 1024,
+        "overhead": uploaded / size - 1,
+    }
+
+
+def summarize(runs):
+    """Take the median of every measurement over the runs
+
+    Args:
+        runs: a list of run measurement dictionaries
+
+    Returns:
+        a dictionary of the median measurements
+    """
+
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def report(result, baseline=None):
+    """Print the measurements, with the relative change against a baseline when given
+
+    Args:
+        result: a dictionary of measurements
+        baseline: an optional dictionary of baseline measurements
+
+    Returns:
+        None
+    """
+
+    for key, value in result.items():
+        line = f"{key:14} {value:12.4f}"
+        if baseline and baseline.get(key):
+            line += f"  ({(value - baseline[key]) / baseline[key] * 100:+.1f}% vs baseline)"
+        print(line)
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        an argparse namespace
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=float, default=32, help="torrent size in MiB")
+    parser.add_argument("--piece-length", type=int, default=256, help="piece length in KiB")
+    parser.add_argument("--seeders", type=int, default=4, help="number of stand-in seeders")
+    parser.add_argument("--latency", type=float, default=0, help="seeder response latency in ms")
+    parser.add_argument("--bandwidth", type=float, default=None, help="upload KiB/s of each seeder connection")
+    parser.add_argument("--choke-interval", type=float, default=None, help="seconds between seeder chokes")
+    parser.add_argument("--choke-duration", type=float, default=1, help="seconds a seeder stays choked")
+    parser.add_argument("--fast", action="store_true", help="seeders advertise the fast extension")
+    parser.add_argument("--memory-budget", type=float, default=BufferPool.BUDGET / MiB,
+                        help="MiB of piece buffers above which no new piece is started")
+    parser.add_argument("--runs", type=int, default=1, help="number of runs, the median is reported")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a run is abandoned")
+    parser.add_argument("--profile", help="write loop lag and phase timings of the last run to a json file")
+    parser.add_argument("--cprofile", action="store_true", help="with --profile, also save cProfile stats")
+    parser.add_argument("--json", help="save the result to a json file")
+    parser.add_argument("--baseline", help="a json result to compare against")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        the process exit code
+    """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="throughput-")
+
+    try:
+        result = summarize([run_once(args, workdir) for _ in range(args.runs)])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["result"]
+
+    report(result, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "result": result}, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+from peer.network import *
+from peer.peer import Peer, PeerConnection
+from sim.swarm import synthetic_torrent
+from tracker.blocks import Block
+from tracker.buffers import BufferPool
+from tracker.disk import DiskPool, ALLOCATE_SPARSE
+from tracker.file_saver import FileSaver
+from tracker.stats import TorrentStats
+from tracker.torrent import SingleFileTorrent
+import asyncio
+import pytest
+
+
+def test_released_buffers_are_reused_within_the_budget():
+    pool = BufferPool(budget=3 * 2 ** 10)
+
+    first, second = pool.acquire(2 ** 10), pool.acquire(2 ** 10)
+    assert pool.in_use == 2 * 2 ** 10 and not pool.full
+
+    pool.release(first)
+    assert pool.in_use == 2 ** 10
+    assert pool.acquire(2 ** 10) is first
+
+    third = pool.acquire(2 ** 10)
+    assert pool.full
+
+    pool.release(second)
+    pool.release(third)
+    assert pool.in_use == 2 ** 10
+    assert pool.acquire(2 ** 10) in (second, third)
+
+
+def test_wait_returns_once_a_buffer_is_released():
+    async def run():
+        pool = BufferPool(budget=2 ** 10)
+        buffer = pool.acquire(2 ** 10)
+
+        timed_out = await pool.wait(0.01)
+        asyncio.get_running_loop().call_later(0.01, pool.release, buffer)
+        released = await pool.wait(1)
+
+        return timed_out, released
+
+    assert asyncio.run(run()) == (False, True)
+
+
+def test_oversized_block_doesnt_grow_the_piece_buffer(tmp_path):
+    _, torrent_dict = synthetic_torrent(2 ** 16, piece_length=2 ** 15)
+    pool = BufferPool()
+    saver = FileSaver(SingleFileTorrent.from_dict(torrent_dict), TorrentStats(), str(tmp_path), DiskPool(),
+                      ALLOCATE_SPARSE, pool)
+
+    saver.start(0)
+    block = PieceMessage(0, 2 ** 14, bytes(2 ** 14 + 1), 9 + 2 ** 14 + 1, MESSAGE_PIECE)
+
+    with pytest.raises(Exception, match="overruns"):
+        asyncio.run(saver.append(block))
+    assert pool.in_use == 2 ** 15
+
+
+def test_peer_sending_a_block_of_another_length_is_closed():
+    data, torrent_dict = synthetic_torrent(2 ** 16, piece_length=2 ** 15)
+    torrent = SingleFileTorrent.from_dict(torrent_dict)
+
+    async def serve(reader, writer):
+        await reader.readexactly(68)
+        writer.write(HandshakeMessage(torrent.info_hash, b"-SM0001-000000000000").raw)
+        writer.write(BitfieldMessage(2, MESSAGE_BITFIELD, b"\xc0").raw)
+        writer.write(SimpleMessage(1, MESSAGE_UNCHOKE).raw)
+
+        try:
+            while True:
+                length = struct.unpack(">I", await reader.readexactly(4))[0]
+                msg = PeerConnection.create_peer_message(struct.pack(">I", length) + await reader.readexactly(length))
+                if msg.message_type == MESSAGE_REQUEST:
+                    block = data[msg.begin:msg.begin + msg.length + 1]
+                    writer.write(PieceMessage(msg.index, msg.begin, block, 9 + len(block), MESSAGE_PIECE).raw)
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        peer = Peer(*server.sockets[0].getsockname()[:2], torrent)
+
+        try:
+            await peer.handshake()
+            assert peer.handshake_complete
+
+            assert await peer.request(Block(0, 0, 2 ** 14))
+            delivered = []
+            while peer.handshake_complete and not delivered:
+                delivered = await peer.receive()
+        finally:
+            peer.close()
+            server.close()
+
+        return peer, delivered
+
+    peer, delivered = asyncio.run(run())
+
+    assert delivered == []
+    assert not peer.handshake_complete
+    assert not peer.requests
@@ -0,0 +1,60 @@
+from cli import parse_args, main
+from bencode.decode import bdecode
+from tracker.blocks import PRIORITY_SKIP, PRIORITY_HIGH
+from tracker.disk import ALLOCATE_SPARSE, ALLOCATE_FULL
+import pytest
+
+
+def test_download_arguments():
+    args = parse_args(["download", "a.torrent", "magnet:?xt=urn:btih:" + "0" * 40, "--quiet",
+                       "--allocation", "full", "--dht-bootstrap", "router.example:6881", "--max-active", "2"])
+
+    assert args.command == "download"
+    assert args.sources == ["a.torrent", "magnet:?xt=urn:btih:" + "0" * 40]
+    assert args.quiet and args.allocation == ALLOCATE_FULL and args.max_active == 2
+    assert args.dht_bootstrap == ["router.example:6881"]
+
+
+def test_defaults():
+    args = parse_args(["stream", "a.torrent"])
+
+    assert (args.command, args.source, args.file, args.timeout) == ("stream", "a.torrent", None, None)
+    assert args.output == "." and args.allocation == ALLOCATE_SPARSE and args.priority == []
+    assert args.download_rate is None and args.upload_rate is None
+
+
+def test_file_priorities_are_parsed_with_the_arguments():
+    args = parse_args(["download", "a.torrent", "--priority", "1=skip", "--priority", "0=high"])
+    assert dict(args.priority) == {1: PRIORITY_SKIP, 0: PRIORITY_HIGH}
+
+
+@pytest.mark.parametrize("value", ["1=bogus", "x=skip", "=skip", "1.5=skip", "2"])
+def test_bad_file_priority_is_a_usage_error(value, capsys):
+    with pytest.raises(SystemExit) as exc:
+        parse_args(["download", "a.torrent", "--priority", value])
+
+    assert exc.value.code == 2
+    assert f"invalid file priority {value}" in capsys.readouterr().err
+
+
+def test_a_command_is_required(capsys):
+    with pytest.raises(SystemExit):
+        parse_args([])
+    assert "required" in capsys.readouterr().err
+
+
+def test_create_writes_a_torrent(tmp_path, capsys):
+    shared = tmp_path / "shared.bin"
+    shared.write_bytes(bytes(range(256)) * 1024)
+    output = tmp_path / "shared.torrent"
+
+    assert main(["create", str(shared), "http://tracker.example/announce", "-o", str(output),
+                 "--piece-length", "64", "--web-seed", "http://seed.example/", "--private"]) == 0
+
+    torrent = bdecode(output.read_bytes())
+    assert torrent[b"announce"] == b"http://tracker.example/announce"
+    assert torrent[b"url-list"] == [b"http://seed.example/"]
+    assert torrent[b"info"][b"piece length"] == 64 * 1024
+    assert torrent[b"info"][b"private"] == 1
+    assert len(torrent[b"info"][b"pieces"]) == 4 * 20
+    assert "info hash" in capsys.readouterr().out
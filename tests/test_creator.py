@@ -0,0 +1,51 @@
+from bencode.encode import bencode
+from tracker import creator
+from tracker.creator import create_torrent, write_torrent
+from tracker.torrent import MultiFileTorrent, SingleFileTorrent
+from hashlib import sha1
+import os
+
+
+def test_info_hash_is_taken_over_the_info_bytes_in_the_file():
+    # the keys of this info dictionary aren't in sorted order
+    info = b"d4:name5:a.bin6:lengthi5e12:piece lengthi16384e6:pieces20:" + bytes(20) + b"e"
+    torrent = SingleFileTorrent(b"d8:announce25:http://127.0.0.1/announce4:info" + info + b"e")
+
+    assert torrent.info_hash == sha1(info).digest()
+
+
+def test_created_torrents_are_written_with_sorted_keys(tmp_path):
+    (tmp_path / "content").mkdir()
+    (tmp_path / "content" / "b.bin").write_bytes(b"b" * 10)
+    (tmp_path / "content" / "a.bin").write_bytes(b"a" * 10)
+
+    torrent_dict = create_torrent(str(tmp_path / "content"), "http://127.0.0.1/announce", comment="test")
+    write_torrent(torrent_dict, str(tmp_path / "content.torrent"))
+    torrent = MultiFileTorrent.from_path(str(tmp_path / "content.torrent"))
+
+    assert list(torrent_dict) == sorted(torrent_dict)
+    assert list(torrent_dict[b"info"]) == sorted(torrent_dict[b"info"])
+    assert torrent.info_hash == MultiFileTorrent.from_dict(torrent_dict).info_hash
+    assert [file[b"path"] for file in torrent.files] == [[b"a.bin"], [b"b.bin"]]
+
+
+def test_pieces_crossing_file_boundaries_are_hashed_batch_by_batch(tmp_path, monkeypatch):
+    sizes = [5000, 0, 70000, 1, 30000]
+    content = os.urandom(sum(sizes))
+    (tmp_path / "content").mkdir()
+
+    position = 0
+    for i, size in enumerate(sizes):
+        (tmp_path / "content" / f"{i}.bin").write_bytes(content[position:position + size])
+        position += size
+
+    # a batch of two pieces maps only the files it covers
+    monkeypatch.setattr(creator, "BATCH_BYTES", 2 ** 16)
+    torrent_dict = create_torrent(str(tmp_path / "content"), "http://127.0.0.1/announce", piece_length=2 ** 15)
+
+    pieces = b"".join(sha1(content[offset:offset + 2 ** 15]).digest() for offset in range(0, len(content), 2 ** 15))
+    info = {b"files": [{b"length": size, b"path": [f"{i}.bin".encode()]} for i, size in enumerate(sizes)],
+            b"name": b"content", b"piece length": 2 ** 15, b"pieces": pieces}
+
+    assert torrent_dict[b"info"][b"pieces"] == pieces
+    assert MultiFileTorrent.from_dict(torrent_dict).info_hash == sha1(bencode(info)).digest()
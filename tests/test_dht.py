@@ -0,0 +1,73 @@
+from bencode.encode import bencode
+from dht.node import DHTNode
+from sim.swarm import Swarm
+from tracker.torrent import AbstractTorrent
+from tracker.tracker import Tracker
+from hashlib import sha1
+import asyncio
+import os
+
+
+async def start_nodes(count):
+    """Start DHT nodes on the loopback interface, bootstrapped from the first one"""
+
+    nodes = [DHTNode() for _ in range(count)]
+    await nodes[0].start("127.0.0.1")
+    for node in nodes[1:]:
+        await node.start("127.0.0.1", bootstrap=[nodes[0].address])
+
+    return nodes
+
+
+def test_announce_peer_then_get_peers():
+    async def run():
+        nodes = await start_nodes(6)
+        info_hash = os.urandom(20)
+
+        try:
+            before = await nodes[2].get_peers(info_hash)
+            _, accepted = await nodes[1].announce(info_hash, 6881)
+            after = await nodes[5].get_peers(info_hash)
+        finally:
+            for node in nodes:
+                node.stop()
+
+        return before, accepted, after
+
+    before, accepted, after = asyncio.run(run())
+
+    assert before == []
+    assert accepted > 0
+    assert after == [("127.0.0.1", 6881)]
+
+
+def test_download_finds_peers_through_dht_and_announces(tmp_path):
+    async def run():
+        nodes = await start_nodes(5)
+        swarm = Swarm(2 ** 16, seeders=2, piece_length=2 ** 15)
+        await swarm.start()
+
+        # the tracker server knows no peers, the seeders are only announced to the DHT
+        seeders = [seeder.address for seeder in swarm.seeders]
+        info_hash = sha1(bencode(swarm.torrent_dict[b"info"])).digest()
+        swarm.tracker.peers = []
+
+        try:
+            for i, (_, port) in enumerate(seeders):
+                await nodes[i + 1].announce(info_hash, port)
+
+            tracker = Tracker(swarm.torrent_dict, dht=nodes[0], download_dir=str(tmp_path))
+            await tracker.download()
+
+            announced = await nodes[4].get_peers(info_hash)
+        finally:
+            swarm.stop()
+            for node in nodes:
+                node.stop()
+
+        return swarm, seeders, announced
+
+    swarm, seeders, announced = asyncio.run(run())
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert sorted(announced) == sorted(seeders + [("127.0.0.1", AbstractTorrent.PORT)])
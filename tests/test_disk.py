@@ -0,0 +1,124 @@
+from sim.swarm import Swarm
+from tracker.blocks import PRIORITY_SKIP
+from tracker.disk import DiskPool, TorrentFiles, ALLOCATE_NONE, ALLOCATE_SPARSE, ALLOCATE_FULL
+from tracker.tracker import Tracker
+import asyncio
+import pytest
+import os
+
+
+def test_ranges_split_along_file_boundaries():
+    files = TorrentFiles([("a", 10), ("empty", 0), ("b", 5), ("c", 20)], DiskPool())
+
+    assert files.ranges(0, 10) == [(0, 0, 10)]
+    assert files.ranges(8, 10) == [(0, 8, 2), (2, 0, 5), (3, 0, 3)]
+    assert files.ranges(34, 1) == [(3, 19, 1)]
+
+    with pytest.raises(Exception, match="out of the torrent content"):
+        files.ranges(30, 10)
+
+
+def test_queued_writes_land_in_the_right_files(tmp_path):
+    paths = [str(tmp_path / "dir" / "a"), str(tmp_path / "b"), str(tmp_path / "c")]
+    written = []
+
+    async def run():
+        pool = DiskPool(flush_interval=0.01)
+        files = TorrentFiles(list(zip(paths, [6, 4, 6])), pool)
+        files.set_wanted([True, False, True])
+        await files.allocate(ALLOCATE_SPARSE)
+
+        # out of order and back to back, the writes are merged into a single run
+        files.write(8, b"89abcdef", lambda: written.append(8))
+        files.write(0, b"01234567", lambda: written.append(0))
+        assert pool.backlog == 16
+
+        await files.close()
+        pool.shutdown()
+        return pool
+
+    pool = asyncio.run(run())
+
+    assert open(paths[0], "rb").read() == b"012345"
+    assert not (tmp_path / "b").exists()
+    assert open(paths[2], "rb").read() == b"abcdef"
+    assert sorted(written) == [0, 8]
+    assert pool.backlog == 0
+
+
+def test_drain_waits_for_the_backlog_to_fall_under_the_budget():
+    async def run():
+        pool = DiskPool(budget=10)
+        pool.reserve(20)
+
+        drained = asyncio.create_task(pool.drain())
+        await asyncio.sleep(0.01)
+        waited = not drained.done()
+
+        pool.release(15)
+        await asyncio.wait_for(drained, 1)
+        return waited
+
+    assert asyncio.run(run())
+
+
+def test_file_skipped_after_allocation_is_not_written(tmp_path):
+    async def run():
+        # the pieces at both ends of the skipped file are shared with the wanted ones
+        swarm = Swarm(3 * 2 ** 17, seeders=2, piece_length=2 ** 15,
+                      files=[2 ** 17 + 2 ** 14, 2 ** 17, 2 ** 17 - 2 ** 14])
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path), allocation=ALLOCATE_SPARSE)
+            await tracker.allocate()
+            tracker.set_file_priorities({1: PRIORITY_SKIP})
+            await tracker.download()
+        finally:
+            swarm.stop()
+
+        return swarm
+
+    swarm = asyncio.run(run())
+    directory = tmp_path / "synthetic.bin"
+
+    assert (directory / "file0.bin").read_bytes() == swarm.data[:2 ** 17 + 2 ** 14]
+    assert (directory / "file1.bin").read_bytes() == bytes(2 ** 17)
+    assert (directory / "file2.bin").read_bytes() == swarm.data[2 ** 18 + 2 ** 14:]
+
+
+@pytest.mark.parametrize("mode", [ALLOCATE_NONE, ALLOCATE_SPARSE, ALLOCATE_FULL])
+def test_allocation_modes(tmp_path, mode):
+    path = tmp_path / "synthetic.bin"
+
+    async def run():
+        swarm = Swarm(2 ** 18, seeders=2, piece_length=2 ** 15)
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path), allocation=mode)
+            await tracker.allocate()
+            allocated = os.stat(path) if path.exists() else None
+            await tracker.download()
+        finally:
+            swarm.stop()
+
+        return swarm, allocated
+
+    swarm, allocated = asyncio.run(run())
+
+    if mode == ALLOCATE_NONE:
+        assert allocated is None
+    else:
+        assert allocated.st_size == 2 ** 18
+        # sparse files hold no blocks until written, full ones have them reserved
+        assert (allocated.st_blocks * 512 >= 2 ** 18) == (mode == ALLOCATE_FULL)
+    assert path.read_bytes() == swarm.data
+
+
+def test_unknown_allocation_mode_is_rejected(tmp_path):
+    files = TorrentFiles([(str(tmp_path / "a"), 10)], DiskPool())
+
+    with pytest.raises(Exception, match="unknown allocation mode"):
+        asyncio.run(files.allocate("eager"))
+    assert not (tmp_path / "a").exists()
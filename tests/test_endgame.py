@@ -0,0 +1,29 @@
+from sim.swarm import Swarm
+from tracker.tracker import Tracker
+import asyncio
+import time
+
+
+def test_slow_seeder_doesnt_hold_up_the_fast_ones(tmp_path):
+    size = 2 ** 19
+
+    async def run():
+        swarm = Swarm(size, seeders=3, piece_length=2 ** 15)
+        swarm.seeders[0].bandwidth = 2 ** 12
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            started = time.monotonic()
+            await tracker.download()
+            return swarm, time.monotonic() - started
+        finally:
+            swarm.stop()
+
+    swarm, elapsed = asyncio.run(run())
+
+    slow, fast = swarm.seeders[0], swarm.seeders[1:]
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert slow.cancelled_requests > 0
+    assert sum(seeder.uploaded_bytes for seeder in fast) > size / 2
+    assert elapsed < 1
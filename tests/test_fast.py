@@ -0,0 +1,46 @@
+from peer.network import *
+from peer.peer import PeerConnection
+from sim.swarm import Swarm
+from tracker.tracker import Tracker
+import asyncio
+import time
+
+
+def test_fast_messages_round_trip():
+    have_all = PeerConnection.create_peer_message(SimpleMessage(1, MESSAGE_HAVE_ALL).raw)
+    assert have_all.message_type == MESSAGE_HAVE_ALL
+
+    reject = PeerConnection.create_peer_message(RejectMessage(3, 2 ** 14, 2 ** 14).raw)
+    assert (reject.message_type, reject.index, reject.begin, reject.length) == (MESSAGE_REJECT, 3, 2 ** 14, 2 ** 14)
+
+    allowed = PeerConnection.create_peer_message(PieceIndexMessage(MESSAGE_ALLOWED_FAST, 5).raw)
+    assert (allowed.message_type, allowed.piece_index) == (MESSAGE_ALLOWED_FAST, 5)
+
+
+def test_handshake_reserved_bits():
+    handshake = HandshakeMessage(bytes(20), b"-PC0001-000000000000", reserved=RESERVED_FAST_EXTENSION)
+    parsed = HandshakeMessage.from_msg(handshake.raw)
+
+    assert parsed.supports(RESERVED_FAST_EXTENSION)
+    assert not parsed.supports(RESERVED_EXTENSION_PROTOCOL)
+
+
+def test_rejected_requests_are_retried_without_waiting_for_the_timeout(tmp_path):
+    async def run():
+        swarm = Swarm(2 ** 20, seeders=2, piece_length=2 ** 15, latency=0.01, choke_interval=0.1,
+                      choke_duration=0.05, fast=True)
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            started = time.monotonic()
+            await tracker.download()
+            return swarm, tracker, time.monotonic() - started
+        finally:
+            swarm.stop()
+
+    swarm, tracker, elapsed = asyncio.run(run())
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert all(peer.supports_fast for peer in tracker._peers)
+    assert elapsed < 5
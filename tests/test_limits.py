@@ -0,0 +1,111 @@
+from sim.swarm import Swarm, Seeder
+from tracker.limits import TokenBucket, ConnectionLimit
+from tracker.tracker import Tracker
+from cli import parse_args
+import asyncio
+import pytest
+import time
+
+
+def test_unlimited_bucket_never_delays():
+    bucket = TokenBucket(parent=TokenBucket())
+    assert not bucket.limited
+    assert bucket.reserve(2 ** 30) == 0
+
+
+def test_bucket_goes_into_debt_at_its_rate():
+    bucket = TokenBucket(1000)
+    assert bucket.limited
+    assert abs(bucket.reserve(500) - 0.5) < 0.01
+    assert abs(bucket.reserve(500) - 1.0) < 0.01
+
+
+def test_child_bytes_are_taken_from_the_parent():
+    parent = TokenBucket(1000)
+    first, second = TokenBucket(parent=parent), TokenBucket(10000, parent=parent)
+
+    first.reserve(1000)
+    assert abs(second.reserve(100) - 1.1) < 0.01
+
+
+def test_bucket_rejects_rates_that_are_not_positive():
+    for rate in (0, -1):
+        with pytest.raises(Exception, match="positive"):
+            TokenBucket(rate)
+
+    bucket = TokenBucket(1000)
+    with pytest.raises(Exception, match="positive"):
+        bucket.rate = 0
+    assert bucket.rate == 1000
+
+
+def test_cli_rates_must_be_positive(capsys):
+    args = parse_args(["download", "a.torrent", "--download-rate", "1.5", "--torrent-upload-rate", "2"])
+    assert args.download_rate == 1536 and args.torrent_upload_rate == 2048 and args.upload_rate is None
+
+    for value in ("0", "-3", "fast"):
+        with pytest.raises(SystemExit):
+            parse_args(["download", "a.torrent", "--upload-rate", value])
+        assert "--upload-rate" in capsys.readouterr().err
+
+
+def test_connection_limit():
+    limit = ConnectionLimit(1)
+    assert limit.try_acquire()
+    assert not limit.try_acquire()
+
+    limit.release()
+    assert limit.try_acquire()
+
+
+def test_torrent_download_rate_limit(tmp_path):
+    size, rate = 2 ** 18, 2 ** 19
+
+    async def run():
+        swarm = Swarm(size, seeders=2, piece_length=2 ** 15)
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            tracker.set_rate_limits(download=rate)
+
+            started = time.monotonic()
+            await tracker.download()
+            return swarm, time.monotonic() - started
+        finally:
+            swarm.stop()
+
+    swarm, elapsed = asyncio.run(run())
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert 0.8 * size / rate <= elapsed < 3 * size / rate
+
+
+def test_torrent_upload_rate_limit(tmp_path):
+    size, piece_length, rate = 2 ** 18, 2 ** 14, 2 ** 15
+    pieces = size // piece_length
+
+    async def run():
+        swarm = Swarm(size, seeders=1, piece_length=piece_length, bandwidth=2 ** 18)
+        leecher = Seeder(swarm.data, swarm.torrent_dict, pieces=range(pieces // 2, pieces))
+        await swarm.start()
+        swarm.tracker.peers.append(await leecher.start())
+
+        tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+        tracker.set_rate_limits(upload=rate)
+
+        try:
+            started = time.monotonic()
+            await tracker.download()
+            await asyncio.sleep(0.5)
+            return swarm, tracker, leecher, time.monotonic() - started
+        finally:
+            tracker.close()
+            leecher.stop()
+            swarm.stop()
+
+    swarm, tracker, leecher, elapsed = asyncio.run(run())
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert leecher.corrupt_blocks == 0
+    assert 0 < leecher.downloaded_bytes <= tracker.stats.uploaded_bytes <= rate * elapsed + piece_length
@@ -0,0 +1,112 @@
+from bencode.encode import bencode
+from sim.swarm import Swarm
+from tracker.magnet import MagnetLink, MetadataFetcher
+from tracker.tracker import Tracker
+from peer.extension import METADATA_PIECE_SIZE
+from hashlib import sha1
+import urllib.parse
+import asyncio
+import base64
+import pytest
+import os
+
+
+def test_magnet_link_parse():
+    info_hash = bytes(range(20))
+    link = MagnetLink.parse(f"magnet:?xt=urn:btih:{info_hash.hex()}&dn=file.bin"
+                            "&tr=http%3A%2F%2Ftracker.example%2Fannounce&tr=udp%3A%2F%2Fother.example%3A80")
+
+    assert link.info_hash == info_hash
+    assert link.file_name == "file.bin"
+    assert link.announce_url == "http://tracker.example/announce"
+    assert len(link.trackers) == 2
+
+    base32 = base64.b32encode(info_hash).decode().lower()
+    assert MagnetLink.parse(f"magnet:?xt=urn:btih:{base32}").info_hash == info_hash
+    assert MagnetLink.parse(f"magnet:?xt=urn:btih:{base32}").file_name == info_hash.hex()
+
+
+def test_magnet_link_parse_rejects_other_uris():
+    with pytest.raises(ValueError):
+        MagnetLink.parse("http://tracker.example/announce")
+
+    with pytest.raises(ValueError):
+        MagnetLink.parse("magnet:?dn=file.bin")
+
+    with pytest.raises(ValueError):
+        MagnetLink.parse("magnet:?xt=urn:btih:abcd")
+
+
+class MetadataPeer:
+    def __init__(self, metadata, fail=False):
+        """Initialize a stand-in peer serving the metadata pieces from memory"""
+
+        self.metadata_size = len(metadata)
+        self.requested = []
+        self._metadata = metadata
+        self._fail = fail
+
+    async def fetch_metadata_piece(self, piece):
+        self.requested.append(piece)
+        await asyncio.sleep(0)
+
+        if self._fail:
+            return None
+
+        return self._metadata[piece * METADATA_PIECE_SIZE:(piece + 1) * METADATA_PIECE_SIZE]
+
+
+def test_metadata_pieces_are_fetched_from_several_peers():
+    # 2048 piece hashes make an info dictionary of three ut_metadata pieces
+    info = {b"length": 2 ** 25, b"name": b"file.bin", b"piece length": 2 ** 14, b"pieces": os.urandom(20 * 2048)}
+    metadata = bencode(info)
+    peers = [MetadataPeer(metadata), MetadataPeer(metadata, fail=True), MetadataPeer(metadata)]
+
+    assert asyncio.run(MetadataFetcher(sha1(metadata).digest()).fetch(peers)) == info
+    assert peers[1].requested == [1]
+    assert sorted(peers[0].requested + peers[2].requested) == [0, 1, 2]
+
+    assert asyncio.run(MetadataFetcher(os.urandom(20)).fetch(peers[:1])) is None
+
+
+def test_magnet_link_downloads_metadata_then_content(tmp_path):
+    async def run():
+        swarm = Swarm(2 ** 16, seeders=2, piece_length=2 ** 15, extensions=True)
+        await swarm.start()
+
+        info_hash = sha1(bencode(swarm.torrent_dict[b"info"])).hexdigest()
+        announce = urllib.parse.quote(swarm.torrent_dict[b"announce"].decode(), safe="")
+
+        try:
+            tracker = Tracker.from_magnet(f"magnet:?xt=urn:btih:{info_hash}&dn=synthetic.bin&tr={announce}",
+                                          download_dir=str(tmp_path))
+            await tracker.download()
+        finally:
+            swarm.stop()
+
+        return swarm, tracker
+
+    swarm, tracker = asyncio.run(run())
+
+    assert tracker.time_to_metadata is not None
+    assert tracker.time_to_metadata <= tracker.time_to_first_piece
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+
+
+def test_sim_seeder_without_extensions_gives_no_metadata(tmp_path):
+    async def run():
+        swarm = Swarm(2 ** 16, seeders=1, piece_length=2 ** 14)
+        await swarm.start()
+
+        info_hash = sha1(bencode(swarm.torrent_dict[b"info"])).hexdigest()
+        announce = urllib.parse.quote(swarm.torrent_dict[b"announce"].decode(), safe="")
+
+        try:
+            tracker = Tracker.from_magnet(f"magnet:?xt=urn:btih:{info_hash}&tr={announce}",
+                                          download_dir=str(tmp_path))
+            await tracker.download()
+        finally:
+            swarm.stop()
+
+    with pytest.raises(Exception, match="metadata"):
+        asyncio.run(run())
@@ -0,0 +1,57 @@
+from metrics import MetricsServer
+from sim.swarm import Swarm, Seeder
+from tracker.buffers import BufferPool
+from tracker.disk import DiskPool
+from tracker.tracker import Tracker
+from types import SimpleNamespace
+import asyncio
+
+
+async def scrape(port):
+    """GET /metrics and return the sample lines by metric name and labels"""
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+
+    body = response.split(b"\r\n\r\n", 1)[1].decode()
+    return dict(line.rsplit(" ", 1) for line in body.splitlines() if not line.startswith("#"))
+
+
+def test_blocks_uploaded_to_a_leecher_reach_the_metrics(tmp_path):
+    size, piece_length = 2 ** 18, 2 ** 14
+    pieces = size // piece_length
+
+    async def run():
+        swarm = Swarm(size, seeders=1, piece_length=piece_length, bandwidth=2 ** 18)
+        leecher = Seeder(swarm.data, swarm.torrent_dict, pieces=range(pieces // 2, pieces))
+        await swarm.start()
+        swarm.tracker.peers.append(await leecher.start())
+
+        tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+        handle = SimpleNamespace(stats=tracker.stats, info_hash=tracker.info_hash, name="synthetic.bin",
+                                 state="downloading")
+        server = MetricsServer(SimpleNamespace(handles=[handle], disk_pool=DiskPool(), buffer_pool=BufferPool()))
+        await server.start()
+
+        try:
+            before = await scrape(server.port)
+            await tracker.download()
+            after = await scrape(server.port)
+        finally:
+            tracker.close()
+            server.stop()
+            leecher.stop()
+            swarm.stop()
+
+        return tracker, leecher, before, after
+
+    tracker, leecher, before, after = asyncio.run(run())
+
+    labels = f'info_hash="{tracker.info_hash.hex()}",name="synthetic.bin"'
+    series = f"torrent_client_torrent_uploaded_bytes_total{{{labels}}}"
+    assert before[series] == "0"
+    assert leecher.downloaded_bytes > 0 and leecher.corrupt_blocks == 0
+    assert int(after[series]) == tracker.stats.uploaded_bytes >= leecher.downloaded_bytes
+    assert after["torrent_client_uploaded_bytes_total"] == after[series]
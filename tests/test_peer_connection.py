@@ -0,0 +1,82 @@
+from peer.network import *
+from peer.peer import PeerConnection
+import asyncio
+
+
+async def start_sink(release):
+    """Start a server that reads nothing from its connections until release is set"""
+
+    closed = asyncio.Event()
+
+    async def serve(reader, writer):
+        await release.wait()
+        while await reader.read(2 ** 16):
+            pass
+        writer.close()
+        closed.set()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], closed
+
+
+async def stop_sink(server, closed, release, conn):
+    """Let the server read the connection to its end and stop it"""
+
+    release.set()
+    conn._writer.close()
+    await closed.wait()
+    server.close()
+    await server.wait_closed()
+
+
+def test_messages_sent_in_one_iteration_are_written_together():
+    async def run():
+        release = asyncio.Event()
+        server, port, closed = await start_sink(release)
+        conn = PeerConnection("127.0.0.1", port, b"\x00" * 20, "-PC0001-000000000000")
+        await conn.handshake()
+        await asyncio.sleep(0)
+
+        writes = []
+        writelines = conn._writer.writelines
+        conn._writer.writelines = lambda data: (writes.append(list(data)), writelines(data))
+
+        messages = [SimpleMessage(1, MESSAGE_INTERESTED).raw, HaveMessage(5, MESSAGE_HAVE, 3).raw,
+                    RequestMessage(3, 0, 2 ** 14).raw]
+        for message in messages:
+            await conn.send(message)
+        assert writes == []
+
+        await asyncio.sleep(0)
+        assert writes == [messages]
+        await stop_sink(server, closed, release, conn)
+
+    asyncio.run(run())
+
+
+def test_send_waits_for_the_peer_above_the_high_water_mark():
+    async def run():
+        release = asyncio.Event()
+        server, port, closed = await start_sink(release)
+        conn = PeerConnection("127.0.0.1", port, b"\x00" * 20, "-PC0001-000000000000")
+        await conn.handshake()
+
+        block = PieceMessage(0, 0, bytes(2 ** 14), 9 + 2 ** 14, MESSAGE_PIECE).raw
+        blocked = None
+
+        # the socket buffers fill up first, then the transport buffer up to the high water mark
+        for _ in range(2 ** 12):
+            task = asyncio.ensure_future(conn.send(block))
+            done, _ = await asyncio.wait([task], timeout=0.2)
+            if not done:
+                blocked = task
+                break
+
+        assert blocked is not None
+        assert conn._writer.transport.get_write_buffer_size() <= PeerConnection.HIGH_WATER_MARK + len(block)
+
+        release.set()
+        await asyncio.wait_for(blocked, timeout=5)
+        await stop_sink(server, closed, release, conn)
+
+    asyncio.run(run())
@@ -0,0 +1,97 @@
+from bencode.decode import bdecode
+from peer.extension import (PexState, decode_compact_peers, decode_compact_peers6, encode_compact_peers,
+                            encode_compact_peers6, extended_handshake, parse_extended)
+from peer.network import ExtendedMessage, EXTENDED_HANDSHAKE_ID
+from sim.swarm import Swarm
+from tracker.tracker import Tracker
+import asyncio
+
+
+def test_compact_peers_round_trip():
+    peers = [("127.0.0.1", 6881), ("10.0.0.2", 51413)]
+
+    assert decode_compact_peers(encode_compact_peers(peers)) == peers
+    assert decode_compact_peers(encode_compact_peers(peers) + b"\x01") == peers
+
+
+def test_compact_peers6_decoding():
+    peers = [("::1", 6881), ("2001:db8::2", 51413)]
+    compact = encode_compact_peers6(peers)
+
+    assert len(compact) == 36
+    assert decode_compact_peers6(compact) == peers
+    assert decode_compact_peers6(compact + b"\x01" * 17) == peers
+    assert decode_compact_peers6(encode_compact_peers6([("::ffff:10.0.0.2", 6881)])) == [("10.0.0.2", 6881)]
+
+
+def test_pex_sends_only_changes():
+    state = PexState()
+    first = bdecode(state.build([("127.0.0.1", 6881), ("::1", 6882)]))
+
+    assert decode_compact_peers(first[b"added"]) == [("127.0.0.1", 6881)]
+    assert decode_compact_peers6(first[b"added6"]) == [("::1", 6882)]
+    assert state.build([("127.0.0.1", 6881)]) is None
+
+    state._last_sent -= PexState.INTERVAL
+    assert state.build([("127.0.0.1", 6881), ("::1", 6882)]) is None
+
+    second = bdecode(state.build([("127.0.0.2", 6881)]))
+    assert decode_compact_peers(second[b"added"]) == [("127.0.0.2", 6881)]
+    assert decode_compact_peers(second[b"dropped"]) == [("127.0.0.1", 6881)]
+    assert PexState.parse(second) == [("127.0.0.2", 6881)]
+
+
+def test_extended_handshake_is_parsed():
+    name, payload, _ = parse_extended(ExtendedMessage(EXTENDED_HANDSHAKE_ID, extended_handshake()))
+
+    assert name == b"handshake"
+    assert payload[b"m"][b"ut_pex"] == 1
+
+
+def test_peer_learned_through_pex_is_connected(tmp_path):
+    async def run():
+        swarm = Swarm(2 ** 17, seeders=2, piece_length=2 ** 15, latency=0.01, extensions=True)
+        await swarm.start()
+
+        announced, exchanged = swarm.seeders
+        swarm.tracker.peers = [announced.address]
+        announced.pex_peers = [exchanged.address]
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            await tracker.download()
+        finally:
+            swarm.stop()
+
+        return swarm
+
+    swarm = asyncio.run(run())
+    announced, exchanged = swarm.seeders
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert exchanged.connections >= 1
+    assert exchanged.uploaded_bytes > 0
+
+
+def test_peers6_from_the_tracker_are_connected(tmp_path):
+    async def run():
+        swarm = Swarm(2 ** 17, seeders=2, piece_length=2 ** 15)
+        await swarm.start()
+
+        # move the seeders to the IPv6 loopback, the tracker answers with peers6 only
+        for seeder in swarm.seeders:
+            seeder.stop()
+        swarm.tracker.peers = [await seeder.start("::1") for seeder in swarm.seeders]
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            await tracker.download()
+        finally:
+            swarm.stop()
+
+        return swarm
+
+    swarm = asyncio.run(run())
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert all(seeder.uploaded_bytes > 0 for seeder in swarm.seeders)
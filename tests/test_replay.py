@@ -0,0 +1,54 @@
+from peer.capture import PeerCapture, read_capture, DIRECTION_IN
+from sim.replay import ReplayPeer
+from sim.swarm import Swarm, StandInTracker
+from tracker.tracker import Tracker
+import asyncio
+import os
+
+
+def received(directory):
+    """The messages received over every connection captured in a directory, in file name order"""
+
+    return [sorted(data for direction, _, data in read_capture(os.path.join(directory, name))[2]
+                   if direction == DIRECTION_IN)
+            for name in sorted(os.listdir(directory))]
+
+
+def test_replayed_capture_delivers_the_captured_messages(tmp_path):
+    async def run():
+        swarm = Swarm(2 ** 18, seeders=1, piece_length=2 ** 15, latency=0.01)
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path / "captured"),
+                              capture=PeerCapture(str(tmp_path / "capture")))
+            await tracker.download()
+        finally:
+            swarm.stop()
+
+        blocks = {}
+        peers = [ReplayPeer(str(tmp_path / "capture" / name), speed=10, blocks=blocks)
+                 for name in sorted(os.listdir(tmp_path / "capture"))]
+        stand_in = StandInTracker([await peer.start() for peer in peers])
+        swarm.torrent_dict[b"announce"] = (await stand_in.start()).encode()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path / "replayed"),
+                              capture=PeerCapture(str(tmp_path / "replay")))
+            await tracker.download()
+        finally:
+            for peer in peers:
+                peer.stop()
+            stand_in.stop()
+
+        return swarm, peers
+
+    swarm, peers = asyncio.run(run())
+
+    assert (tmp_path / "replayed" / "synthetic.bin").read_bytes() == swarm.data
+    assert [peer.skipped for peer in peers] == [0]
+
+    # the handshake, the bitfield, the unchoke and every block
+    captured = received(tmp_path / "capture")
+    assert len(captured) == 1 and len(captured[0]) == 3 + 2 ** 18 // 2 ** 14
+    assert received(tmp_path / "replay") == captured
@@ -0,0 +1,49 @@
+from peer.peer import PeerConnection
+from peer.score import PeerScore
+from sim.swarm import Swarm
+from tracker.tracker import Tracker
+import asyncio
+
+
+def test_peer_owing_nothing_isnt_snubbed(monkeypatch):
+    monkeypatch.setattr(PeerScore, "SNUB_TIMEOUT", 0)
+    score = PeerScore()
+    score.unchoked()
+
+    score.requested()
+    assert score.snubbed
+
+    score.idle()
+    assert not score.snubbed
+
+
+def test_requests_of_a_stalled_seeder_are_handed_to_others(tmp_path, monkeypatch):
+    size = 2 ** 19
+    monkeypatch.setattr(PeerScore, "SNUB_TIMEOUT", 0.2)
+    monkeypatch.setattr(PeerConnection, "_timeout", 0.1)
+
+    async def run():
+        swarm = Swarm(size, seeders=2, piece_length=2 ** 15, bandwidth=2 ** 18)
+        stalled = swarm.seeders[0]
+        stalled.latency = 60
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            download = asyncio.create_task(tracker.download())
+
+            while not stalled.cancelled_requests and not download.done():
+                await asyncio.sleep(0.01)
+            downloaded = tracker.stats.downloaded_bytes
+
+            await download
+            return swarm, downloaded
+        finally:
+            swarm.stop()
+
+    swarm, downloaded = asyncio.run(run())
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert swarm.seeders[0].uploaded_bytes == 0
+    assert swarm.seeders[0].cancelled_requests > 0
+    assert downloaded < size / 2
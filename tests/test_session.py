@@ -0,0 +1,80 @@
+from session import Session, QUEUED, DOWNLOADING, PAUSED, COMPLETED, REMOVED
+from sim.swarm import Swarm
+import threading
+import asyncio
+import time
+
+
+class SwarmThread:
+    """Run swarms on an event loop of their own, the session downloads from its own thread"""
+
+    def __init__(self, *swarms):
+        self.swarms = swarms
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        for swarm in self.swarms:
+            asyncio.run_coroutine_threadsafe(swarm.start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _stop(self):
+        for swarm in self.swarms:
+            swarm.stop()
+
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def wait_for(condition, timeout=10):
+    """Poll a condition until it holds"""
+
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_session_queues_pauses_resumes_and_removes(tmp_path):
+    # slow seeders keep the downloads running while the session is driven
+    swarms = [Swarm(2 ** 17, seeders=1, piece_length=2 ** 15, seed=i, name=f"torrent{i}.bin".encode(),
+                    bandwidth=2 ** 17) for i in range(3)]
+
+    with SwarmThread(*swarms):
+        for i, swarm in enumerate(swarms):
+            swarm.write_torrent(tmp_path / f"torrent{i}.torrent")
+
+        session = Session(max_active_torrents=1, download_dir=str(tmp_path / "download"))
+        session.start()
+
+        try:
+            first, second, third = [session.add(str(tmp_path / f"torrent{i}.torrent")) for i in range(3)]
+            assert [first.state, second.state, third.state] == [DOWNLOADING, QUEUED, QUEUED]
+
+            session.remove(third)
+            assert third.state == REMOVED and third.wait(0)
+            assert session.handles == [first, second]
+
+            session.pause(first)
+            assert [first.state, second.state] == [PAUSED, DOWNLOADING]
+
+            session.resume(first)
+            assert first.state == QUEUED
+
+            assert second.wait(10) and second.state == COMPLETED
+            assert first.wait(10) and first.state == COMPLETED
+        finally:
+            session.stop()
+
+    for i in range(2):
+        assert (tmp_path / "download" / f"torrent{i}.bin").read_bytes() == swarms[i].data
+    assert swarms[2].seeders[0].uploaded_bytes == 0
@@ -0,0 +1,48 @@
+from sim.swarm import Swarm
+from tracker.tracker import Tracker
+import asyncio
+
+
+def test_stream_reads_across_a_piece_boundary_while_downloading(tmp_path):
+    piece_length = 2 ** 15
+    files = [2 * piece_length + 100, 6 * piece_length - 100]
+
+    def read(stream, position, length):
+        """Read a range of the stream in a worker thread, a read may stop at a piece boundary"""
+
+        stream.seek(position)
+        data = b""
+        while len(data) < length:
+            chunk = stream.read(length - len(data))
+            assert chunk
+            data += chunk
+        return data
+
+    async def run():
+        # a slow seeder, the download is still running when the read returns
+        swarm = Swarm(sum(files), seeders=1, piece_length=piece_length, files=files, bandwidth=2 ** 18)
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            await tracker.allocate()
+            download = asyncio.create_task(tracker.download())
+
+            # the second file starts 100 bytes into piece 2, so its position 3 * piece_length - 100 starts piece 5
+            position = 3 * piece_length - 150
+            with tracker.stream(1, timeout=5) as stream:
+                data = await asyncio.get_running_loop().run_in_executor(None, read, stream, position, 100)
+                still_downloading = not download.done()
+
+            await download
+        finally:
+            swarm.stop()
+
+        return swarm, data, still_downloading, position
+
+    swarm, data, still_downloading, position = asyncio.run(run())
+
+    start = files[0] + position
+    assert (start + 50) % piece_length == 0
+    assert data == swarm.data[start:start + 100]
+    assert still_downloading
@@ -0,0 +1,66 @@
+from sim.swarm import Swarm, synthetic_torrent
+from tracker.blocks import BlockManager
+from tracker.torrent import SingleFileTorrent
+from tracker.tracker import Tracker
+from types import SimpleNamespace
+import asyncio
+import pytest
+
+
+def download(swarm, directory):
+    """Start the swarm, download its torrent into a directory and stop it"""
+
+    async def run():
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(directory))
+            await tracker.download()
+            return tracker
+        finally:
+            swarm.stop()
+
+    return asyncio.run(run())
+
+
+def test_download_from_a_web_seed_only(tmp_path):
+    swarm = Swarm(2 ** 20, seeders=0, piece_length=2 ** 15, files=[2 ** 19, 2 ** 18, 2 ** 18], web_seeds=1)
+    download(swarm, tmp_path)
+
+    content = b"".join((tmp_path / "synthetic.bin" / f"file{i}.bin").read_bytes() for i in range(3))
+    assert content == swarm.data
+    assert swarm.web_seeds[0].requests < 2 ** 20 // 2 ** 14
+
+
+def test_web_seed_ignoring_ranges_is_disabled(tmp_path):
+    swarm = Swarm(2 ** 16, seeders=1, piece_length=2 ** 15, web_seeds=1)
+    swarm.web_seeds[0].ranges = False
+    tracker = download(swarm, tmp_path)
+
+    assert (tmp_path / "synthetic.bin").read_bytes() == swarm.data
+    assert not any(seed.usable for seed in tracker._web_seeds)
+    assert swarm.seeders[0].uploaded_bytes == 2 ** 16
+
+
+def test_web_seed_without_peers_and_ranges_fails(tmp_path):
+    swarm = Swarm(2 ** 18, seeders=0, piece_length=2 ** 15, web_seeds=1)
+    swarm.web_seeds[0].ranges = False
+
+    with pytest.raises(Exception, match="no peers or web seeds left"):
+        download(swarm, tmp_path)
+
+
+def test_next_span_for_takes_contiguous_blocks_across_pieces():
+    _, torrent_dict = synthetic_torrent(2 ** 18, piece_length=2 ** 15)
+    blocks = BlockManager(SingleFileTorrent.from_dict(torrent_dict))
+    seed = SimpleNamespace(available_pieces={0, 1, 2, 5})
+
+    span = blocks.next_span_for(seed, 2 ** 16 + 2 ** 14)
+    assert [(block.index, block.begin) for block in span] == [(0, 0), (0, 2 ** 14), (1, 0), (1, 2 ** 14), (2, 0)]
+
+    span = blocks.next_span_for(seed, 2 ** 20)
+    assert [(block.index, block.begin) for block in span] == [(2, 2 ** 14)]
+
+    span = blocks.next_span_for(seed, 2 ** 20, pieces={5})
+    assert [(block.index, block.begin) for block in span] == [(5, 0), (5, 2 ** 14)]
+    assert blocks.next_span_for(seed, 2 ** 20) == []
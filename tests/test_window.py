@@ -0,0 +1,86 @@
+from peer.window import RequestWindow
+from sim.swarm import Swarm
+from tracker.blocks import Block
+from tracker.tracker import Tracker
+from types import SimpleNamespace
+import peer.window
+import asyncio
+import math
+
+
+def simulate(window, clock, bandwidth, rtt, blocks):
+    """Keep window.size requests in flight over a link of a bandwidth in bytes per second and a base RTT,
+    the blocks queue up behind each other once the link is busy
+
+    Returns:
+        the window sizes after every delivered block
+    """
+
+    in_flight = []
+    last_delivery = 0
+    sizes = []
+
+    for _ in range(blocks):
+        while len(in_flight) < window.size:
+            last_delivery = max(clock.now + rtt, last_delivery + Block.BLOCK_SIZE / bandwidth)
+            in_flight.append((last_delivery, window.sent()))
+
+        delivery, token = in_flight.pop(0)
+        clock.now = delivery
+        window.acked(token, Block.BLOCK_SIZE)
+        sizes.append(window.size)
+
+    return sizes
+
+
+def test_window_grows_to_the_bandwidth_delay_product_and_settles(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(peer.window, "time", SimpleNamespace(monotonic=lambda: clock.now))
+
+    # 64 blocks per second over a 100ms RTT, a bandwidth-delay product of 6.4 blocks
+    window = RequestWindow()
+    sizes = simulate(window, clock, 2 ** 20, 0.1, 500)
+
+    assert sizes[0] <= RequestWindow.INITIAL_SIZE
+    assert max(sizes) == window.size == math.ceil(RequestWindow.GAIN * 6.4)
+    assert window.rate == 2 ** 20
+
+
+def test_backoff_halves_the_window_down_to_the_minimum():
+    window = RequestWindow()
+    window.size = 40
+    window.rate = 2.0 ** 20
+
+    window.backoff()
+    assert window.size == 20
+    assert window.rate == 2 ** 19
+
+    for _ in range(10):
+        window.backoff()
+    assert window.size == RequestWindow.MIN_SIZE
+
+
+def test_window_of_a_distant_seeder_grows(tmp_path):
+    async def run():
+        swarm = Swarm(2 ** 21, seeders=1, piece_length=2 ** 16, latency=0.1, bandwidth=2 ** 21)
+        await swarm.start()
+
+        try:
+            tracker = Tracker(swarm.torrent_dict, download_dir=str(tmp_path))
+            download = asyncio.create_task(tracker.download())
+
+            sizes = []
+            while not download.done():
+                sizes.extend(connected.window.size for connected in tracker._peers)
+                await asyncio.sleep(0.01)
+
+            await download
+        finally:
+            swarm.stop()
+
+        return sizes
+
+    sizes = asyncio.run(run())
+
+    # 128 blocks per second over a 100ms RTT, the initial window would take 4 seconds
+    assert 2 * RequestWindow.INITIAL_SIZE < max(sizes) < RequestWindow.MAX_SIZE
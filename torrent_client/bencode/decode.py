@@ -18,6 +18,48 @@ def bdecode(data):
         return _parse_bstr(data)[1]
 
 
+def bdecode_partial(data):
+    """Bdecodes the python data at the start of a buffer, which may be followed by other data
+
+    Args:
+        data: bencoded data optionally followed by raw bytes
+
+    Returns:
+        a tuple consisting of (decoded data, leftover data)
+    """
+
+    leftover, value = _decode_internal(data)
+    return value, leftover
+
+
+def bdecode_dict_value(data, key):
+    """Find the bencoded value of a key of a bencoded dictionary, exactly as it appears in the data
+
+    Args:
+        data: a bencoded dict
+        key: the key whose value is wanted
+
+    Returns:
+        the raw bencoded value, None if the dict has no such key
+    """
+
+    if data[0] != ord('d'):
+        return None
+
+    data = data[1:]
+
+    while data[0] != ord('e'):
+        data, found = _decode_internal(data)
+        leftover, _ = _decode_internal(data)
+
+        if found == key:
+            return data[:len(data) - len(leftover)]
+
+        data = leftover
+
+    return None
+
+
 def _decode_internal(data):
     """Internal bdecoding function
 
@@ -19,7 +19,7 @@ def bencode(data):
 
 
 def _encode_dict(data):
-    """Bencodes a python dict
+    """Bencodes a python dict, keeping the order of its keys
 
     Args:
         data: a python dictionary to be encoded
@@ -0,0 +1,366 @@
+from session import Session, COMPLETED, FAILED
+from tracker.stats import RateSampler, format_bytes, format_eta
+from tracker.profiler import Profiler
+from tracker.disk import DiskPool, ALLOCATION_MODES, ALLOCATE_SPARSE
+from tracker.buffers import BufferPool
+from tracker.blocks import PRIORITY_NAMES
+from tracker.creator import create_torrent, write_torrent
+from tracker.torrent import AbstractTorrent
+import argparse
+import time
+import sys
+
+POLL_INTERVAL = 1
+STREAM_CHUNK = 2 ** 20
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        an argparse namespace
+    """
+
+    parser = argparse.ArgumentParser(prog="torrent_client", description="Headless BitTorrent client")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-o", "--output", default=".", help="directory the torrents are saved in")
+    common.add_argument("--max-active", type=int, default=8, help="maximal number of torrents downloading at once")
+    common.add_argument("--max-connections", type=int, default=500,
+                        help="maximal number of peer connections across all torrents")
+    common.add_argument("--max-peers", type=int, default=50, help="maximal number of peer connections per torrent")
+    common.add_argument("--download-rate", type=kib_to_bytes, default=None, metavar="KIB/S",
+                        help="global download limit, unlimited if not given")
+    common.add_argument("--upload-rate", type=kib_to_bytes, default=None, metavar="KIB/S",
+                        help="global upload limit, unlimited if not given")
+    common.add_argument("--torrent-download-rate", type=kib_to_bytes, default=None, metavar="KIB/S",
+                        help="download limit of each torrent, unlimited if not given")
+    common.add_argument("--torrent-upload-rate", type=kib_to_bytes, default=None, metavar="KIB/S",
+                        help="upload limit of each torrent, unlimited if not given")
+    common.add_argument("--allocation", choices=ALLOCATION_MODES, default=ALLOCATE_SPARSE,
+                        help="create the files sized up front, sparse or fully allocated, or as pieces arrive")
+    common.add_argument("--disk-budget", type=float, default=DiskPool.BUDGET / 2 ** 20, metavar="MIB",
+                        help="bytes waiting for the disk above which downloading pauses")
+    common.add_argument("--memory-budget", type=float, default=BufferPool.BUDGET / 2 ** 20, metavar="MIB",
+                        help="memory holding pieces until they are written, above which no new piece is started")
+    common.add_argument("--fsync-interval", type=float, default=None, metavar="SECONDS",
+                        help="seconds between fsync calls while writing, only on completion if not given")
+    common.add_argument("--dht-port", type=int, default=None, help="udp port of a DHT node, no DHT if not given")
+    common.add_argument("--dht-bootstrap", action="append", default=[], metavar="HOST:PORT",
+                        help="a DHT bootstrap node, may be repeated")
+    common.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics, disabled if not given")
+    common.add_argument("--capture", metavar="DIR",
+                        help="record every peer connection to a capture file in DIR, see sim/replay.py")
+    common.add_argument("--profile", metavar="PATH",
+                        help="write loop lag and phase timings to a json file, refreshed every 10 seconds")
+    common.add_argument("--cprofile", action="store_true", help="with --profile, also save cProfile stats")
+    common.add_argument("--tracemalloc", type=int, default=0, metavar="FRAMES",
+                        help="with --profile, trace allocations keeping this many frames")
+    common.add_argument("--priority", action="append", type=parse_priority, default=[], metavar="INDEX=LEVEL",
+                        help="priority of a file of a multi-file torrent, one of " + ", ".join(PRIORITY_NAMES) +
+                             ", may be repeated")
+
+    download = commands.add_parser("download", parents=[common], help="download torrents and exit when they finish")
+    download.add_argument("sources", nargs="+", help="*.torrent file paths or magnet uris")
+    download.add_argument("--quiet", action="store_true", help="only print the final statistics")
+
+    stream = commands.add_parser("stream", parents=[common],
+                                 help="write a torrent to stdout while it downloads, fetching the read position first")
+    stream.add_argument("source", help="a *.torrent file path or a magnet uri")
+    stream.add_argument("--file", type=int, default=None, metavar="INDEX",
+                        help="index of the file to stream from a multi-file torrent, the whole content if not given")
+    stream.add_argument("--timeout", type=float, default=None,
+                        help="seconds to wait for a piece before giving up, forever if not given")
+
+    create = commands.add_parser("create", help="create a *.torrent file from a file or a directory")
+    create.add_argument("path", help="the file or directory to share")
+    create.add_argument("announce", help="the tracker announce url")
+    create.add_argument("-o", "--output", default=None,
+                        help="the *.torrent file path, the shared name with a .torrent suffix if not given")
+    create.add_argument("--piece-length", type=int, default=None, metavar="KIB",
+                        help="piece length in KiB, a multiple of 16, picked from the content size if not given")
+    create.add_argument("--web-seed", action="append", default=[], metavar="URL",
+                        help="a web seed url, may be repeated")
+    create.add_argument("--comment", default=None, help="a comment stored in the torrent")
+    create.add_argument("--private", action="store_true", help="only find peers through the tracker")
+    create.add_argument("--workers", type=int, default=None, help="hashing threads, the number of CPUs by default")
+
+    return parser.parse_args(argv)
+
+
+def parse_address(address):
+    """Parse a host:port string
+
+    Args:
+        address: a string such as 'router.bittorrent.com:6881'
+
+    Returns:
+        a (host, port) tuple
+    """
+
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def parse_priority(value):
+    """Parse an INDEX=LEVEL file priority, used as an argparse type
+
+    Args:
+        value: a string such as '2=skip'
+
+    Returns:
+        an (index, priority) tuple
+    """
+
+    index, _, level = value.partition("=")
+    if not index.isdigit() or level not in PRIORITY_NAMES:
+        raise argparse.ArgumentTypeError(f"invalid file priority {value}")
+
+    return int(index), PRIORITY_NAMES[level]
+
+
+def kib_to_bytes(value):
+    """Parse a rate limit given in KiB/s, used as an argparse type
+
+    Args:
+        value: KiB per second, a positive number
+
+    Returns:
+        bytes per second
+    """
+
+    try:
+        rate = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate {value}")
+
+    if not rate > 0:
+        raise argparse.ArgumentTypeError(f"rate must be positive, got {value}")
+
+    return max(1, int(rate * 1024))
+
+
+def format_seconds(seconds):
+    """Format a duration measured by a tracker
+
+    Args:
+        seconds: a duration in seconds or None if it was never reached
+
+    Returns:
+        a string such as '0.123 s' or '-'
+    """
+
+    return "-" if seconds is None else f"{seconds:.3f} s"
+
+
+def progress_line(handle, sampler):
+    """Build the progress line of a torrent
+
+    Args:
+        handle: a torrent handle
+        sampler: the RateSampler of the handle
+
+    Returns:
+        a one line progress summary
+    """
+
+    stats = handle.stats
+    return (f"{handle.name}: {handle.state} {stats.progress * 100:5.1f}% "
+            f"{format_bytes(stats.downloaded_bytes)}/{format_bytes(stats.total_bytes)} "
+            f"{format_bytes(sampler.down_rate)}/s {stats.peers} peers ETA {format_eta(sampler.eta)}")
+
+
+def final_report(handle, elapsed):
+    """Build the final statistics of a torrent
+
+    Args:
+        handle: a finished torrent handle
+        elapsed: seconds since the torrent was added
+
+    Returns:
+        a multi line summary
+    """
+
+    tracker = handle.tracker
+    size = handle.stats.total_bytes
+    lines = [
+        f"{handle.name}: {handle.state}" + (f" ({handle.error})" if handle.error else ""),
+        f"  size                     {format_bytes(size)}",
+        f"  elapsed                  {elapsed:.3f} s",
+        f"  average speed            {format_bytes(size / elapsed if elapsed else 0)}/s",
+        f"  time to first handshake  {format_seconds(tracker.time_to_first_handshake)}",
+        f"  time to metadata         {format_seconds(tracker.time_to_metadata)}",
+        f"  time to first piece      {format_seconds(tracker.time_to_first_piece)}",
+    ]
+
+    return "\n".join(lines)
+
+
+def create_session(args):
+    """Create and start a session configured by the common arguments
+
+    Args:
+        args: the parsed arguments
+
+    Returns:
+        a started session
+    """
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile, cprofile=args.cprofile, tracemalloc_frames=args.tracemalloc)
+
+    session = Session(max_active_torrents=args.max_active, max_connections=args.max_connections,
+                      max_peers_per_torrent=args.max_peers, dht_port=args.dht_port,
+                      dht_bootstrap=[parse_address(address) for address in args.dht_bootstrap],
+                      download_dir=args.output, profiler=profiler,
+                      download_rate=args.download_rate, upload_rate=args.upload_rate,
+                      disk_pool=DiskPool(budget=int(args.disk_budget * 2 ** 20), fsync_interval=args.fsync_interval),
+                      allocation=args.allocation, buffer_pool=BufferPool(int(args.memory_budget * 2 ** 20)),
+                      metrics_port=args.metrics_port, capture_dir=args.capture,
+                      torrent_download_rate=args.torrent_download_rate,
+                      torrent_upload_rate=args.torrent_upload_rate)
+    session.start()
+
+    return session
+
+
+def download(args):
+    """Download the given torrents, printing progress until every one of them finished
+
+    Args:
+        args: the parsed 'download' arguments
+
+    Returns:
+        0 if every torrent completed, else 1
+    """
+
+    session = create_session(args)
+    started = time.monotonic()
+    finished = {}
+
+    try:
+        handles = [session.add(source, dict(args.priority)) for source in args.sources]
+        samplers = {handle: RateSampler(handle.stats) for handle in handles}
+
+        for handle in handles:
+            handle.add_done_callback(lambda h: finished.setdefault(h, time.monotonic() - started))
+            if handle.wait(0):
+                finished.setdefault(handle, time.monotonic() - started)
+
+        while len(finished) < len(handles):
+            time.sleep(POLL_INTERVAL)
+
+            for handle in handles:
+                samplers[handle].sample()
+                if not args.quiet and handle not in finished:
+                    print(progress_line(handle, samplers[handle]), flush=True)
+    except KeyboardInterrupt:
+        return 1
+    finally:
+        session.stop()
+
+    for handle in handles:
+        print(final_report(handle, finished[handle]))
+
+    return 0 if all(handle.state == COMPLETED for handle in handles) else 1
+
+
+def stream(args):
+    """Write a torrent or one of its files to stdout in order while it downloads
+
+    Args:
+        args: the parsed 'stream' arguments
+
+    Returns:
+        0 if the whole stream was written, else 1
+    """
+
+    session = create_session(args)
+
+    try:
+        handle = session.add(args.source, dict(args.priority))
+
+        while not handle.tracker.has_metadata:
+            if handle.wait(POLL_INTERVAL):
+                break
+
+        if handle.state == FAILED:
+            print(f"{handle.name}: {handle.error}", file=sys.stderr)
+            return 1
+
+        with handle.stream(args.file, args.timeout) as f:
+            while True:
+                data = f.read(STREAM_CHUNK)
+                if not data:
+                    break
+                sys.stdout.buffer.write(data)
+
+        sys.stdout.buffer.flush()
+    except (KeyboardInterrupt, BrokenPipeError, TimeoutError):
+        return 1
+    finally:
+        session.stop()
+
+    return 0
+
+
+def create(args):
+    """Hash a file or a directory and save its torrent
+
+    Args:
+        args: the parsed 'create' arguments
+
+    Returns:
+        0
+    """
+
+    started = time.monotonic()
+    torrent_dict = create_torrent(args.path, args.announce,
+                                  piece_length=args.piece_length * 1024 if args.piece_length else None,
+                                  url_list=args.web_seed, comment=args.comment, private=args.private,
+                                  workers=args.workers)
+    elapsed = time.monotonic() - started
+
+    output = args.output or torrent_dict[b"info"][b"name"].decode() + ".torrent"
+    write_torrent(torrent_dict, output)
+
+    info = torrent_dict[b"info"]
+    size = info.get(b"length") or sum(file[b"length"] for file in info[b"files"])
+    print(f"{output}: {format_bytes(size)} in {len(info[b'pieces']) // 20} pieces of "
+          f"{format_bytes(info[b'piece length'])}, hashed in {elapsed:.3f} s "
+          f"({format_bytes(size / elapsed if elapsed else 0)}/s)")
+    print(f"  info hash {AbstractTorrent.from_dict(torrent_dict).info_hash.hex()}")
+
+    return 0
+
+
+def main(argv=None):
+    """Run the headless client
+
+    Args:
+        argv: optional list of arguments, sys.argv[1:] by default
+
+    Returns:
+        the process exit code
+    """
+
+    args = parse_args(argv)
+
+    if args.command == "download":
+        return download(args)
+    elif args.command == "stream":
+        return stream(args)
+    elif args.command == "create":
+        return create(args)
+
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+from bencode.decode import bdecode
+from bencode.encode import bencode
+from peer.extension import encode_compact_peers, decode_compact_peers
+from .routing import Node, RoutingTable, distance
+from hashlib import sha1
+import asyncio
+import os
+import time
+
+
+class DHTNode(asyncio.DatagramProtocol):
+    ALPHA = 8
+    TIMEOUT = 2
+    TOKEN_LIFETIME = 5 * 60
+    MAX_STORED_PEERS = 100
+
+    def __init__(self, node_id=None, cache_path=None):
+        """Initialize a mainline DHT (BEP 5) node
+
+        Args:
+            node_id: optional 20-byte node id, random or taken from the cache if not given
+            cache_path: optional path of a file the routing table is saved to and warm started from
+        """
+
+        self._cache_path = cache_path
+        cached_id, self._cached_nodes = self._load_cache()
+
+        self.node_id = node_id or cached_id or os.urandom(20)
+        self.table = RoutingTable(self.node_id)
+
+        self._transport = None
+        self._pending = {}
+        self._next_transaction = 0
+        self._stored_peers = {}
+        self._secrets = [os.urandom(8), os.urandom(8)]
+        self._secret_rotated = time.monotonic()
+
+    async def start(self, host="0.0.0.0", port=0, bootstrap=()):
+        """Bind the udp socket and populate the routing table from the bootstrap and cached nodes
+
+        Args:
+            host: local address to bind
+            port: local udp port, 0 for any
+            bootstrap: a list of (host, port) tuples of known nodes
+
+        Returns:
+            None
+        """
+
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+
+        addresses = list(bootstrap) + [node.address for node in self._cached_nodes]
+        if addresses:
+            await self.bootstrap(addresses)
+
+    def stop(self):
+        """Save the routing table to the cache and close the socket
+
+        Returns:
+            None
+        """
+
+        self.save_cache()
+
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+
+    @property
+    def address(self):
+        """The (ip, port) tuple the node is bound to"""
+        return self._transport.get_extra_info("sockname")[:2]
+
+    async def bootstrap(self, addresses):
+        """Ask known addresses for the nodes closest to us, then run a lookup of our own id
+
+        Args:
+            addresses: a list of (host, port) tuples
+
+        Returns:
+            None
+        """
+
+        responses = await asyncio.gather(*[self._query(address, b"find_node", {b"target": self.node_id})
+                                           for address in addresses])
+
+        for response in responses:
+            if response is not None:
+                self._add_nodes(response)
+
+        await self.find_node(self.node_id)
+
+    async def find_node(self, target):
+        """Iteratively look up the nodes closest to a target id
+
+        Args:
+            target: 20-byte target id
+
+        Returns:
+            a list of the closest node objects
+        """
+
+        nodes, _, _ = await self._lookup(target, b"find_node", {b"target": target})
+        return nodes
+
+    async def get_peers(self, info_hash):
+        """Iteratively look up peers of a torrent
+
+        Args:
+            info_hash: 20-byte SHA1 hash of the torrent info dictionary
+
+        Returns:
+            a list of (ip, port) tuples
+        """
+
+        _, peers, _ = await self._lookup(info_hash, b"get_peers", {b"info_hash": info_hash})
+        return peers
+
+    async def announce(self, info_hash, port):
+        """Announce that we are downloading a torrent to the nodes closest to its info hash
+
+        Args:
+            info_hash: 20-byte SHA1 hash of the torrent info dictionary
+            port: the tcp port peers can connect to
+
+        Returns:
+            a tuple consisting of (peers found during the lookup, number of nodes that accepted the announce)
+        """
+
+        _, peers, tokens = await self._lookup(info_hash, b"get_peers", {b"info_hash": info_hash})
+
+        responses = await asyncio.gather(*[
+            self._query(node.address, b"announce_peer", {b"info_hash": info_hash, b"port": port, b"token": token})
+            for node, token in tokens
+        ])
+
+        return peers, len([response for response in responses if response is not None])
+
+    async def _lookup(self, target, method, args):
+        """Run an iterative Kademlia lookup, querying up to ALPHA of the closest unqueried nodes at a time
+
+        Args:
+            target: 20-byte target id
+            method: b"find_node" or b"get_peers"
+            args: the query arguments
+
+        Returns:
+            a tuple consisting of (closest nodes, peers found, list of (node, token) of the closest responders)
+        """
+
+        shortlist = {node.node_id: node for node in self.table.closest(target, RoutingTable.K)}
+        queried = set()
+        responded = {}
+        peers = []
+
+        while True:
+            closest = sorted(shortlist.values(), key=lambda node: distance(node.node_id, target))[:RoutingTable.K]
+            candidates = [node for node in closest if node.node_id not in queried][:DHTNode.ALPHA]
+            if not candidates:
+                break
+
+            queried.update(node.node_id for node in candidates)
+            responses = await asyncio.gather(*[self._query(node.address, method, args) for node in candidates])
+
+            for node, response in zip(candidates, responses):
+                if response is None:
+                    shortlist.pop(node.node_id, None)
+                    self.table.remove(node.node_id)
+                    continue
+
+                responded[node.node_id] = (node, response.get(b"token"))
+
+                for found in self._add_nodes(response):
+                    shortlist.setdefault(found.node_id, found)
+
+                values = response.get(b"values")
+                if isinstance(values, list):
+                    for value in values:
+                        if isinstance(value, bytes):
+                            peers.extend(peer for peer in decode_compact_peers(value) if peer not in peers)
+
+        closest = sorted(shortlist.values(), key=lambda node: distance(node.node_id, target))[:RoutingTable.K]
+        tokens = [responded[node.node_id] for node in closest
+                  if node.node_id in responded and isinstance(responded[node.node_id][1], bytes)]
+
+        return closest, peers, tokens
+
+    def _add_nodes(self, response):
+        """Add the nodes a response carries to the routing table
+
+        Args:
+            response: a decoded response arguments dictionary
+
+        Returns:
+            a list of the node objects found in the response
+        """
+
+        nodes = response.get(b"nodes")
+        if not isinstance(nodes, bytes):
+            return []
+
+        found = Node.decode_compact(nodes)
+        for node in found:
+            if node.node_id != self.node_id:
+                self.table.add(node)
+
+        return found
+
+    async def _query(self, address, method, args):
+        """Send a KRPC query and wait for its response
+
+        Args:
+            address: a (host, port) tuple
+            method: the query method name
+            args: the query arguments without the node id
+
+        Returns:
+            the response arguments dictionary, None on error or timeout
+        """
+
+        if self._transport is None:
+            return None
+
+        transaction = self._next_transaction.to_bytes(2, "big")
+        self._next_transaction = (self._next_transaction + 1) % 2 ** 16
+
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[transaction] = fut
+
+        query_args = dict(args)
+        query_args[b"id"] = self.node_id
+        self._send({b"a": dict(sorted(query_args.items())), b"q": method, b"t": transaction, b"y": b"q"}, address)
+
+        try:
+            return await asyncio.wait_for(fut, timeout=DHTNode.TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._pending.pop(transaction, None)
+
+    def _send(self, message, address):
+        """Send a bencoded KRPC message
+
+        Args:
+            message: the message dictionary
+            address: a (host, port) tuple
+
+        Returns:
+            None
+        """
+
+        if self._transport is not None:
+            self._transport.sendto(bencode(message), address)
+
+    def connection_made(self, transport):
+        """Keep the datagram transport once the socket is bound"""
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        """Dispatch an incoming KRPC message
+
+        Args:
+            data: the raw datagram
+            addr: the sender (ip, port) tuple
+
+        Returns:
+            None
+        """
+
+        try:
+            message = bdecode(data)
+        except Exception:
+            return
+
+        if not isinstance(message, dict) or not isinstance(message.get(b"t"), bytes):
+            return
+
+        kind = message.get(b"y")
+
+        if kind == b"q":
+            self._handle_query(message, addr)
+        elif kind in (b"r", b"e"):
+            fut = self._pending.get(message[b"t"])
+            if fut is None or fut.done():
+                return
+
+            response = message.get(b"r")
+            if kind == b"r" and isinstance(response, dict) and isinstance(response.get(b"id"), bytes):
+                self.table.add(Node(response[b"id"], addr[0], addr[1]))
+                fut.set_result(response)
+            else:
+                fut.set_result(None)
+
+    def _handle_query(self, message, addr):
+        """Answer a KRPC query
+
+        Args:
+            message: the decoded query message
+            addr: the sender (ip, port) tuple
+
+        Returns:
+            None
+        """
+
+        args = message.get(b"a")
+        method = message.get(b"q")
+
+        if not isinstance(args, dict) or not isinstance(args.get(b"id"), bytes) or len(args[b"id"]) != 20:
+            self._send({b"e": [203, b"Protocol Error"], b"t": message[b"t"], b"y": b"e"}, addr)
+            return
+
+        self.table.add(Node(args[b"id"], addr[0], addr[1]))
+        response = {b"id": self.node_id}
+
+        if method == b"ping":
+            pass
+        elif method == b"find_node" and isinstance(args.get(b"target"), bytes):
+            response[b"nodes"] = self._compact_closest(args[b"target"])
+        elif method == b"get_peers" and isinstance(args.get(b"info_hash"), bytes):
+            response[b"token"] = self._token(addr[0])
+
+            peers = self._stored_peers.get(args[b"info_hash"])
+            if peers:
+                response[b"values"] = [encode_compact_peers([peer]) for peer in peers]
+            else:
+                response[b"nodes"] = self._compact_closest(args[b"info_hash"])
+        elif method == b"announce_peer" and isinstance(args.get(b"info_hash"), bytes):
+            if not self._valid_token(args.get(b"token"), addr[0]):
+                self._send({b"e": [203, b"Bad Token"], b"t": message[b"t"], b"y": b"e"}, addr)
+                return
+
+            port = addr[1] if args.get(b"implied_port") else args.get(b"port")
+            if not isinstance(port, int) or not 0 < port < 2 ** 16:
+                self._send({b"e": [203, b"Bad Port"], b"t": message[b"t"], b"y": b"e"}, addr)
+                return
+
+            peers = self._stored_peers.setdefault(args[b"info_hash"], [])
+            if (addr[0], port) not in peers:
+                peers.append((addr[0], port))
+                del peers[:-DHTNode.MAX_STORED_PEERS]
+        else:
+            self._send({b"e": [204, b"Method Unknown"], b"t": message[b"t"], b"y": b"e"}, addr)
+            return
+
+        self._send({b"r": dict(sorted(response.items())), b"t": message[b"t"], b"y": b"r"}, addr)
+
+    def _compact_closest(self, target):
+        """Compact node info of the nodes closest to a target
+
+        Args:
+            target: 20-byte target id
+
+        Returns:
+            the compact nodes string
+        """
+
+        return b"".join(node.compact for node in self.table.closest(target, RoutingTable.K))
+
+    def _token(self, ip, secret=None):
+        """Create the announce token handed to a querying address
+
+        Args:
+            ip: the querying ip address
+            secret: the secret to derive the token from, the current one by default
+
+        Returns:
+            an 8-byte token
+        """
+
+        if time.monotonic() - self._secret_rotated > DHTNode.TOKEN_LIFETIME:
+            self._secrets = [os.urandom(8), self._secrets[0]]
+            self._secret_rotated = time.monotonic()
+
+        return sha1((secret or self._secrets[0]) + ip.encode()).digest()[:8]
+
+    def _valid_token(self, token, ip):
+        """Check an announce token against the current and previous secrets
+
+        Args:
+            token: the token received in announce_peer
+            ip: the announcing ip address
+
+        Returns:
+            True if the token was handed to this address recently, else False
+        """
+
+        return any(token == self._token(ip, secret) for secret in self._secrets)
+
+    def _load_cache(self):
+        """Load the node id and nodes saved by a previous run
+
+        Returns:
+            a tuple consisting of (node id or None, list of node objects)
+        """
+
+        if not self._cache_path or not os.path.exists(self._cache_path):
+            return None, []
+
+        try:
+            with open(self._cache_path, "rb") as f:
+                cache = bdecode(f.read())
+
+            return cache[b"id"], Node.decode_compact(cache[b"nodes"])
+        except Exception:
+            return None, []
+
+    def save_cache(self):
+        """Save the node id and routing table nodes for a warm start
+
+        Returns:
+            None
+        """
+
+        if not self._cache_path:
+            return
+
+        nodes = b"".join(node.compact for node in self.table.nodes())
+
+        with open(self._cache_path, "wb") as f:
+            f.write(bencode({b"id": self.node_id, b"nodes": nodes}))
@@ -0,0 +1,153 @@
+import ipaddress
+import struct
+import time
+
+
+class Node:
+    def __init__(self, node_id, ip, port):
+        """Initialize a DHT node entry
+
+        Args:
+            node_id: 20-byte node id
+            ip: node ip address
+            port: node udp port
+        """
+
+        self.node_id = node_id
+        self.ip = ip
+        self.port = port
+        self.last_seen = time.monotonic()
+
+    @property
+    def address(self):
+        """A (ip, port) tuple of the node"""
+        return self.ip, self.port
+
+    @property
+    def compact(self):
+        """The node in the 26 bytes compact node info format"""
+        return self.node_id + ipaddress.IPv4Address(self.ip).packed + struct.pack(">H", self.port)
+
+    @staticmethod
+    def decode_compact(bstr):
+        """Decode a compact node info string
+
+        Args:
+            bstr: 26 bytes per node, 20 for the id, 4 for the address and 2 for the port
+
+        Returns:
+            a list of node objects
+        """
+
+        nodes = []
+        for offset in range(0, len(bstr) - len(bstr) % 26, 26):
+            ip = str(ipaddress.IPv4Address(bstr[offset + 20:offset + 24]))
+            port = struct.unpack_from(">H", bstr, offset + 24)[0]
+
+            if port:
+                nodes.append(Node(bstr[offset:offset + 20], ip, port))
+
+        return nodes
+
+
+def distance(a, b):
+    """XOR distance between two 20-byte ids
+
+    Args:
+        a: 20-byte id
+        b: 20-byte id
+
+    Returns:
+        the distance as an integer
+    """
+
+    return int.from_bytes(a, "big") ^ int.from_bytes(b, "big")
+
+
+class RoutingTable:
+    K = 8
+    STALE_AFTER = 15 * 60
+
+    def __init__(self, node_id):
+        """Initialize a Kademlia routing table with a k-bucket per distance bit length
+
+        Args:
+            node_id: the 20-byte id of the local node
+        """
+
+        self.node_id = node_id
+        self._buckets = [[] for _ in range(160)]
+
+    def __len__(self):
+        """The number of nodes in the table"""
+        return sum(len(bucket) for bucket in self._buckets)
+
+    def add(self, node):
+        """Add a node or refresh it if already present. A full bucket only replaces nodes that went stale
+
+        Args:
+            node: a node object
+
+        Returns:
+            True if the node is in the table, else False
+        """
+
+        dist = distance(self.node_id, node.node_id)
+        if not dist:
+            return False
+
+        bucket = self._buckets[dist.bit_length() - 1]
+
+        for i, existing in enumerate(bucket):
+            if existing.node_id == node.node_id:
+                existing.ip, existing.port = node.ip, node.port
+                existing.last_seen = time.monotonic()
+                bucket.append(bucket.pop(i))
+                return True
+
+        if len(bucket) >= RoutingTable.K:
+            if time.monotonic() - bucket[0].last_seen < RoutingTable.STALE_AFTER:
+                return False
+            bucket.pop(0)
+
+        bucket.append(node)
+        return True
+
+    def remove(self, node_id):
+        """Remove a node from the table
+
+        Args:
+            node_id: 20-byte id of the node
+
+        Returns:
+            None
+        """
+
+        dist = distance(self.node_id, node_id)
+        if not dist:
+            return
+
+        bucket = self._buckets[dist.bit_length() - 1]
+        bucket[:] = [node for node in bucket if node.node_id != node_id]
+
+    def closest(self, target, count=K):
+        """Get the nodes closest to a target id
+
+        Args:
+            target: 20-byte target id
+            count: maximal number of nodes to return
+
+        Returns:
+            a list of node objects sorted by distance to the target
+        """
+
+        return sorted(self.nodes(), key=lambda node: distance(node.node_id, target))[:count]
+
+    def nodes(self):
+        """Get all the nodes in the table
+
+        Returns:
+            a list of node objects
+        """
+
+        return [node for bucket in self._buckets for node in bucket]
@@ -1,5 +1,6 @@
 from .download_bar import DownloadProgressBar
 from .scroll_frame import VerticalScrolledFrame
+from session import Session
 import tkinter as tk
 from tkinter import filedialog
 import os
@@ -9,6 +10,9 @@ HEIGHT = 500
 
 TITLE = 'Torrent Client'
 
+# how often the download bars are refreshed from the session stats
+POLL_INTERVAL_MS = 150
+
 
 class App(tk.Tk):
     def __init__(self, *args, **kwargs):
@@ -25,10 +29,15 @@ class App(tk.Tk):
         self.geometry(f"{WIDTH}x{HEIGHT}")
         self.config(background="pale turquoise")
 
+        self.session = Session()
+        self.session.start()
+        self._download_bars = []
+
         self.scroll_frame = VerticalScrolledFrame(self)
         self.scroll_frame.grid(column=1, row=3)
 
         self.place_widgets()
+        self.after(POLL_INTERVAL_MS, self.refresh_downloads)
 
     def place_widgets(self):
         """Place tkinter widgets
@@ -68,6 +77,17 @@ class App(tk.Tk):
                                                filetypes=(("Torrent files", "*.torrent"), ("all files", "*.*")))
 
         if file_path:
-            download_bar = DownloadProgressBar(self.scroll_frame.interior, file_path)
+            download_bar = DownloadProgressBar(self.scroll_frame.interior, file_path, self.session)
             download_bar.pack()
             download_bar.start()
+            self._download_bars.append(download_bar)
+
+    def refresh_downloads(self):
+        """Refresh every download bar from its stats and reschedule itself on the tk event queue
+
+        Returns:
+            None
+        """
+
+        self._download_bars = [bar for bar in self._download_bars if bar.refresh()]
+        self.after(POLL_INTERVAL_MS, self.refresh_downloads)
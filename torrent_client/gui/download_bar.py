@@ -1,43 +1,70 @@
+from tracker.stats import RateSampler, format_bytes, format_eta
+import threading
 import tkinter as tk
 from tkinter import ttk
-import threading
-import asyncio
-from tracker.tracker import Tracker
 
 
 class DownloadProgressBar:
-    def __init__(self, parent, file_path):
+    def __init__(self, parent, file_path, session):
         """Initialize a download progress bar
 
         Args:
             parent: parent widget to place the bar on
             file_path: file path to the *.torrent file to be downloaded
+            session: the session running the downloads
         """
 
         self._title = tk.Label(parent, text=file_path.split('/')[-1], font=("Verdana", 10), fg="turquoise3")
 
         self._progress_bar = ttk.Progressbar(parent, orient=tk.HORIZONTAL, mode='determinate')
+        self._info = tk.Label(parent, font=("Verdana", 8), fg="turquoise4")
         self._file_path = file_path
-        self._job = threading.Thread(target=self._download_job)
+        self._session = session
+        self._handle = None
+        self._sampler = None
+        self._error = None
+        self._adding = None
         self._packed = False
 
     def start(self):
-        """Start the download thread
+        """Add the torrent to the session on a separate thread, so the tk thread doesn't block while
+        the files are allocated. refresh() picks the torrent handle up once it is added
+
+        Returns:
+            None
+        """
+
+        self._info["text"] = "allocating files"
+        self._adding = threading.Thread(target=self._add, name="add", daemon=True)
+        self._adding.start()
+
+    def _add(self):
+        """Add the torrent to the session, runs on the thread started by start()
 
         Returns:
             None
         """
 
-        self._job.start()
+        try:
+            handle = self._session.add(self._file_path)
+        except Exception as e:
+            self._error = e
+            return
+
+        self._sampler = RateSampler(handle.stats)
+        self._handle = handle
 
     def join(self):
-        """Join the download thread
+        """Wait for the download to finish
 
         Returns:
             None
         """
 
-        self._job.join()
+        self._adding.join()
+
+        if self._handle is not None:
+            self._handle.wait()
 
     def pack(self, *args, **kwargs):
         """Pack bar to the parent window
@@ -46,35 +73,61 @@ class DownloadProgressBar:
             None
         """
 
-        if not self._job.is_alive():
+        if self._handle is None:
             self._packed = True
 
             self._title.pack()
             self._progress_bar.pack(*args, **kwargs)
+            self._info.pack()
 
-    def _download_job(self):
-        """The downloaded job to be run in a separate thread. Runs the download async event loop
+    def refresh(self):
+        """Update the bar from the download stats, must be called from the tk thread
 
         Returns:
-            None
+            True while the download is running, False once it finished and the bar was removed,
+            or once it failed and the bar shows the error
         """
 
-        loop = asyncio.new_event_loop()
+        if self._error is not None:
+            self._show_error(self._error)
+            return False
+
+        if self._handle is None:
+            return True
+
+        stats = self._handle.stats
+        self._sampler.sample()
+
+        self._progress_bar["value"] = int(stats.progress * 100)
+        self._info["text"] = (f"{format_bytes(self._sampler.down_rate)}/s down  "
+                              f"{format_bytes(self._sampler.up_rate)}/s up  "
+                              f"{stats.peers} peers  ETA {format_eta(self._sampler.eta)}")
+
+        if not self._handle.wait(0):
+            return True
 
-        loop.run_until_complete(self._async_download())
+        if self._handle.error is not None:
+            self._show_error(self._handle.error)
+            return False
+
+        print(f"[+] downloaded {self._handle.name}")
 
-        loop.close()
         if self._packed:
             self._progress_bar.pack_forget()
             self._title.pack_forget()
+            self._info.pack_forget()
+
+        return False
 
-    async def _async_download(self):
-        """Preform an asynchronous download of the .torrent file
+    def _show_error(self, error):
+        """Replace the stats of the bar with the error the download failed with
+
+        Args:
+            error: the exception
 
         Returns:
             None
         """
 
-        tracker = Tracker.from_path(self._file_path, self._progress_bar)
-        await tracker.download()
-        print(f"[+] downloaded {tracker.torrent_name}")
+        self._info["text"] = f"failed: {error}"
+        self._info["fg"] = "red3"
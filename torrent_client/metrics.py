@@ -0,0 +1,197 @@
+import asyncio
+import time
+
+# prefix of every exported metric name
+PREFIX = "torrent_client"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (name, type, help, function reading the value from a TorrentStats object) of the per torrent metrics,
+# the additive ones are also exported summed over the session
+TORRENT_METRICS = [
+    ("size_bytes", "gauge", "Bytes of the wanted pieces", lambda stats: stats.total_bytes),
+    ("downloaded_bytes", "gauge", "Bytes downloaded, failed pieces are taken off again",
+     lambda stats: stats.downloaded_bytes),
+    ("uploaded_bytes_total", "counter", "Bytes uploaded to peers", lambda stats: stats.uploaded_bytes),
+    ("pieces_verified_total", "counter", "Pieces whose hash matched", lambda stats: stats.pieces_verified),
+    ("pieces_failed_total", "counter", "Pieces whose hash didn't match", lambda stats: stats.pieces_failed),
+    ("peers", "gauge", "Handshaked peer connections", lambda stats: stats.peers),
+    ("hashed_bytes_total", "counter", "Bytes of pieces hashed", lambda stats: stats.hashed_bytes),
+    ("hash_seconds_total", "counter", "Seconds spent hashing pieces", lambda stats: stats.hash_seconds),
+]
+ANNOUNCE_METRIC = ("announce_seconds", "gauge", "Duration of the last tracker announce")
+
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text format
+
+    Args:
+        value: the label value
+
+    Returns:
+        the escaped value, to be put between double quotes
+    """
+
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_family(name, kind, description, samples):
+    """Format a metric family in the Prometheus text format
+
+    Args:
+        name: the metric name without PREFIX
+        kind: 'counter' or 'gauge'
+        description: the help text
+        samples: a list of (labels dict, value) tuples
+
+    Returns:
+        a list of lines
+    """
+
+    name = f"{PREFIX}_{name}"
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+
+    for labels, value in samples:
+        if labels:
+            pairs = ",".join(f"{key}=\"{escape_label(str(label))}\"" for key, label in labels.items())
+            lines.append(f"{name}{{{pairs}}} {value}")
+        else:
+            lines.append(f"{name} {value}")
+
+    return lines
+
+
+class MetricsServer:
+    READ_TIMEOUT = 5
+    MAX_HEADERS = 100
+
+    def __init__(self, session, host="127.0.0.1", port=0):
+        """Initialize an HTTP endpoint exposing the session stats in the Prometheus text format on GET /metrics.
+        Values are read from the stats objects when a scrape comes in, nothing is collected in between
+
+        Args:
+            session: the Session whose torrents are exported
+            host: the address to listen on
+            port: the tcp port to listen on, 0 to pick a free one
+        """
+
+        self.host = host
+        self.port = port
+
+        self._session = session
+        self._server = None
+
+    async def start(self):
+        """Start listening. Must be awaited on the session loop
+
+        Returns:
+            None
+        """
+
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        """Stop listening
+
+        Returns:
+            None
+        """
+
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def render(self):
+        """Read the stats of the session and its torrents
+
+        Returns:
+            the metrics in the Prometheus text format
+        """
+
+        lag = await self._loop_lag()
+        handles = self._session.handles
+        lines = []
+
+        for name, kind, description, read in TORRENT_METRICS:
+            lines += format_family(f"torrent_{name}", kind, description,
+                                   [(self._labels(handle), read(handle.stats)) for handle in handles])
+            lines += format_family(name, kind, f"{description}, summed over the torrents",
+                                   [({}, sum(read(handle.stats) for handle in handles))])
+
+        name, kind, description = ANNOUNCE_METRIC
+        lines += format_family(f"torrent_{name}", kind, description,
+                               [(self._labels(handle), handle.stats.announce_seconds) for handle in handles
+                                if handle.stats.announce_seconds is not None])
+
+        states = {}
+        for handle in handles:
+            states[handle.state] = states.get(handle.state, 0) + 1
+
+        lines += format_family("torrents", "gauge", "Torrents in the session by state",
+                               [({"state": state}, count) for state, count in sorted(states.items())])
+        lines += format_family("loop_lag_seconds", "gauge", "Delay of a callback scheduled on the session loop",
+                               [({}, lag)])
+        lines += format_family("disk_queue_bytes", "gauge", "Bytes queued or being written to disk",
+                               [({}, self._session.disk_pool.backlog)])
+        lines += format_family("piece_buffer_bytes", "gauge", "Bytes of piece buffers in use",
+                               [({}, self._session.buffer_pool.in_use)])
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(handle):
+        """The labels identifying a torrent
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            a labels dict
+        """
+
+        return {"info_hash": handle.info_hash.hex(), "name": handle.name}
+
+    @staticmethod
+    async def _loop_lag():
+        """Measure how long a callback scheduled now waits for the loop
+
+        Returns:
+            the delay in seconds
+        """
+
+        started = time.monotonic()
+        await asyncio.sleep(0)
+        return time.monotonic() - started
+
+    async def _serve(self, reader, writer):
+        """Answer a single HTTP request and close the connection
+
+        Args:
+            reader: the connection stream reader
+            writer: the connection stream writer
+
+        Returns:
+            None
+        """
+
+        try:
+            request = await asyncio.wait_for(reader.readline(), MetricsServer.READ_TIMEOUT)
+            for _ in range(MetricsServer.MAX_HEADERS):
+                line = await asyncio.wait_for(reader.readline(), MetricsServer.READ_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, (await self.render()).encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
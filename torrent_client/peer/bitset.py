@@ -0,0 +1,91 @@
+class Bitset:
+    def __init__(self, bitfield=b""):
+        """Initialize a set of piece indexes backed by a bitfield
+
+        Args:
+            bitfield: raw bitfield bytes, the high bit of the first byte being piece 0
+        """
+
+        self._bits = bytearray(bitfield)
+        self._all = False
+
+    def __contains__(self, index):
+        """Check if a piece index is in the set
+
+        Args:
+            index: zero-based piece index
+
+        Returns:
+            True if the piece is present, else False
+        """
+
+        if self._all:
+            return True
+
+        byte = index >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (0x80 >> (index & 7)))
+
+    def __bool__(self):
+        """True if any piece is present"""
+        return self._all or any(self._bits)
+
+    def add(self, index):
+        """Add a piece index to the set
+
+        Args:
+            index: zero-based piece index
+
+        Returns:
+            None
+        """
+
+        byte = index >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte + 1 - len(self._bits)))
+
+        self._bits[byte] |= 0x80 >> (index & 7)
+
+    def update(self, bitfield):
+        """Add all the pieces present in a raw bitfield
+
+        Args:
+            bitfield: raw bitfield bytes
+
+        Returns:
+            None
+        """
+
+        if not any(self._bits):
+            self._bits = bytearray(bitfield)
+            return
+
+        if len(bitfield) > len(self._bits):
+            self._bits.extend(bytes(len(bitfield) - len(self._bits)))
+
+        for i, byte in enumerate(bitfield):
+            if byte:
+                self._bits[i] |= byte
+
+    def set_all(self):
+        """Mark every piece as present without knowing the piece count
+
+        Returns:
+            None
+        """
+
+        self._all = True
+
+    def clear(self):
+        """Remove every piece from the set
+
+        Returns:
+            None
+        """
+
+        self._all = False
+        self._bits = bytearray()
+
+    @property
+    def has_all(self):
+        """True if the set was filled by set_all"""
+        return self._all
@@ -0,0 +1,144 @@
+import itertools
+import struct
+import time
+import os
+'''
+Capture files of peer wire sessions
+
+A capture starts with a header: the magic, the format version, the info hash and the length of the remote
+address, followed by the address as "ip:port". Every framed message then takes a record: the direction,
+the microseconds since the previous record, the message length and the raw message bytes
+'''
+
+CAPTURE_MAGIC = b"BTCAP"
+CAPTURE_VERSION = 1
+CAPTURE_SUFFIX = ".btcap"
+
+HEADER = struct.Struct(">5sB20sH")
+RECORD = struct.Struct(">BII")
+
+# record directions
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+
+MAX_DELAY = 2 ** 32 - 1
+
+
+class CaptureWriter:
+    def __init__(self, path, info_hash, address):
+        """Open a capture file of a single connection and write its header
+
+        Args:
+            path: the capture file path
+            info_hash: 20-byte SHA1 hash of the info dictionary
+            address: the (ip, port) tuple of the remote peer
+        """
+
+        self.path = path
+        self.records = 0
+
+        encoded = f"{address[0]}:{address[1]}".encode()
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, info_hash, len(encoded)) + encoded)
+        self._last = time.monotonic()
+
+    def record(self, direction, data):
+        """Append a framed message
+
+        Args:
+            direction: DIRECTION_IN for a received message, DIRECTION_OUT for a sent one
+            data: the raw message bytes
+
+        Returns:
+            None
+        """
+
+        if self._file is None:
+            return
+
+        now = time.monotonic()
+        delay = min(MAX_DELAY, round((now - self._last) * 1e6))
+        self._last = now
+
+        self._file.write(RECORD.pack(direction, delay, len(data)))
+        self._file.write(data)
+        self.records += 1
+
+    def close(self):
+        """Flush and close the capture file
+
+        Returns:
+            None
+        """
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class PeerCapture:
+    def __init__(self, directory):
+        """Initialize the capture of every peer connection into a directory, one file per connection
+
+        Args:
+            directory: the directory the capture files are written to, created if missing
+        """
+
+        self.directory = directory
+        self._counter = itertools.count()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, info_hash, address):
+        """Start the capture of a new connection
+
+        Args:
+            info_hash: 20-byte SHA1 hash of the info dictionary
+            address: the (ip, port) tuple of the remote peer
+
+        Returns:
+            a CaptureWriter object
+        """
+
+        name = f"{info_hash.hex()[:16]}-{next(self._counter):05d}-{address[0].replace(':', '_')}-{address[1]}"
+        return CaptureWriter(os.path.join(self.directory, name + CAPTURE_SUFFIX), info_hash, address)
+
+
+def read_capture(path):
+    """Read a capture file
+
+    Args:
+        path: the capture file path
+
+    Returns:
+        a tuple consisting of (info hash, (ip, port) tuple, list of (direction, seconds since the connection
+        was opened, raw message bytes) tuples)
+    """
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise Exception(f"{path} is not a capture file")
+
+    magic, version, info_hash, address_length = HEADER.unpack_from(data)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise Exception(f"{path} is not a version {CAPTURE_VERSION} capture file")
+
+    offset = HEADER.size + address_length
+    ip, port = data[HEADER.size:offset].decode().rsplit(":", 1)
+
+    records = []
+    at = 0.0
+    while offset + RECORD.size <= len(data):
+        direction, delay, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+
+        if offset + length > len(data):
+            break
+
+        at += delay / 1e6
+        records.append((direction, at, data[offset:offset + length]))
+        offset += length
+
+    return info_hash, (ip, int(port)), records
@@ -0,0 +1,258 @@
+from bencode.decode import bdecode_partial
+from bencode.encode import bencode
+from .network import EXTENDED_HANDSHAKE_ID
+import ipaddress
+import socket
+import struct
+import time
+'''
+Extension protocol (BEP 10) helpers
+'''
+
+# extension message ids this client assigns in its extended handshake
+LOCAL_EXTENSIONS = {
+    b"ut_pex": 1,
+    b"ut_metadata": 2,
+}
+
+# ut_metadata (BEP 9) message types
+METADATA_REQUEST = 0
+METADATA_DATA = 1
+METADATA_REJECT = 2
+METADATA_PIECE_SIZE = 2 ** 14
+
+CLIENT_VERSION = b"PC 0001"
+
+# compact peer entries, address and port
+COMPACT_PEER = struct.Struct(">4sH")
+COMPACT_PEER6 = struct.Struct(">16sH")
+
+
+def extended_handshake():
+    """Build the extended handshake payload advertising the supported extensions
+
+    Returns:
+        the bencoded handshake dictionary
+    """
+
+    return bencode({
+        b"m": dict(sorted(LOCAL_EXTENSIONS.items())),
+        b"v": CLIENT_VERSION,
+    })
+
+
+def parse_extended(msg):
+    """Resolve the extension an incoming extended message belongs to and decode its dictionary
+
+    Args:
+        msg: an ExtendedMessage object
+
+    Returns:
+        a tuple consisting of (extension name or b"handshake", decoded dict, raw data following the dict),
+        (None, {}, b"") if unknown or malformed
+    """
+
+    if msg.extended_id == EXTENDED_HANDSHAKE_ID:
+        name = b"handshake"
+    else:
+        name = next((ext for ext, ext_id in LOCAL_EXTENSIONS.items() if ext_id == msg.extended_id), None)
+
+    if name is None or not msg.payload:
+        return None, {}, b""
+
+    try:
+        payload, data = bdecode_partial(msg.payload)
+    except Exception:
+        return None, {}, b""
+
+    if not isinstance(payload, dict):
+        return None, {}, b""
+
+    return name, payload, data
+
+
+def metadata_request(piece):
+    """Build a ut_metadata request payload
+
+    Args:
+        piece: zero-based index of the 16 KiB metadata piece
+
+    Returns:
+        the bencoded request dictionary
+    """
+
+    return bencode({b"msg_type": METADATA_REQUEST, b"piece": piece})
+
+
+def normalize_address(address):
+    """Bring a peer address to the form used to deduplicate peers: IPv4-mapped IPv6 addresses
+    become IPv4 and IPv6 addresses are compressed. Host names are kept as they are
+
+    Args:
+        address: an (ip, port) tuple
+
+    Returns:
+        the normalized (ip, port) tuple
+    """
+
+    ip, port = address
+
+    try:
+        parsed = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip, port
+
+    if parsed.version == 6 and parsed.ipv4_mapped is not None:
+        parsed = parsed.ipv4_mapped
+
+    return str(parsed), port
+
+
+def ip_version(ip):
+    """The version of an ip address
+
+    Args:
+        ip: an ip address string
+
+    Returns:
+        4 or 6, None for a host name
+    """
+
+    try:
+        return ipaddress.ip_address(ip).version
+    except ValueError:
+        return None
+
+
+def encode_compact_peers(addresses):
+    """Encode IPv4 peer addresses in the compact 6 bytes per peer format
+
+    Args:
+        addresses: a list of (ip, port) tuples
+
+    Returns:
+        the compact peers string
+    """
+
+    return b"".join(COMPACT_PEER.pack(socket.inet_pton(socket.AF_INET, ip), port) for ip, port in addresses)
+
+
+def encode_compact_peers6(addresses):
+    """Encode IPv6 peer addresses in the compact 18 bytes per peer format
+
+    Args:
+        addresses: a list of (ip, port) tuples
+
+    Returns:
+        the compact peers6 string
+    """
+
+    return b"".join(COMPACT_PEER6.pack(socket.inet_pton(socket.AF_INET6, ip), port) for ip, port in addresses)
+
+
+def decode_compact_peers(bstr):
+    """Decode a compact IPv4 peers string, a trailing partial entry is ignored
+
+    Args:
+        bstr: 6 bytes per peer, 4 for the address and 2 for the port
+
+    Returns:
+        a list of (ip, port) tuples
+    """
+
+    end = len(bstr) - len(bstr) % COMPACT_PEER.size
+    return [(socket.inet_ntop(socket.AF_INET, ip), port)
+            for ip, port in COMPACT_PEER.iter_unpack(memoryview(bstr)[:end])]
+
+
+def decode_compact_peers6(bstr):
+    """Decode a compact IPv6 peers string, IPv4-mapped addresses are returned as IPv4
+
+    Args:
+        bstr: 18 bytes per peer, 16 for the address and 2 for the port
+
+    Returns:
+        a list of (ip, port) tuples
+    """
+
+    end = len(bstr) - len(bstr) % COMPACT_PEER6.size
+    return [normalize_address((socket.inet_ntop(socket.AF_INET6, ip), port))
+            for ip, port in COMPACT_PEER6.iter_unpack(memoryview(bstr)[:end])]
+
+
+class PexState:
+    INTERVAL = 60
+    MAX_PEERS = 50
+
+    def __init__(self):
+        """Initialize the peer exchange state kept for a single connection"""
+
+        self._sent = set()
+        self._last_sent = None
+
+    def build(self, connected):
+        """Build a ut_pex message with the connection changes since the last one, if the rate limit allows it
+
+        Args:
+            connected: a list of (ip, port) tuples of the currently connected peers
+
+        Returns:
+            the bencoded ut_pex payload, None if it is too early or there's nothing new
+        """
+
+        now = time.monotonic()
+        if self._last_sent is not None and now - self._last_sent < PexState.INTERVAL:
+            return None
+
+        current = {normalize_address(address) for address in connected}
+        current = {address for address in current if ip_version(address[0]) is not None}
+
+        added = sorted(current - self._sent)[:PexState.MAX_PEERS]
+        dropped = sorted(self._sent - current)[:PexState.MAX_PEERS]
+
+        if not added and not dropped:
+            return None
+
+        self._last_sent = now
+        self._sent = (self._sent - set(dropped)) | set(added)
+
+        added4 = [address for address in added if ip_version(address[0]) == 4]
+        added6 = [address for address in added if ip_version(address[0]) == 6]
+        dropped4 = [address for address in dropped if ip_version(address[0]) == 4]
+        dropped6 = [address for address in dropped if ip_version(address[0]) == 6]
+
+        payload = {
+            b"added": encode_compact_peers(added4),
+            b"added.f": bytes(len(added4)),
+            b"dropped": encode_compact_peers(dropped4),
+        }
+
+        if added6 or dropped6:
+            payload[b"added6"] = encode_compact_peers6(added6)
+            payload[b"added6.f"] = bytes(len(added6))
+            payload[b"dropped6"] = encode_compact_peers6(dropped6)
+
+        return bencode(payload)
+
+    @staticmethod
+    def parse(payload):
+        """Extract the added IPv4 and IPv6 peers from a decoded ut_pex message
+
+        Args:
+            payload: the decoded ut_pex dictionary
+
+        Returns:
+            a list of (ip, port) tuples
+        """
+
+        peers = []
+
+        added = payload.get(b"added", b"")
+        if isinstance(added, bytes):
+            peers.extend(decode_compact_peers(added))
+
+        added6 = payload.get(b"added6", b"")
+        if isinstance(added6, bytes):
+            peers.extend(decode_compact_peers6(added6))
+
+        return peers
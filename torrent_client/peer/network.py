@@ -1,5 +1,4 @@
 import struct
-from bitstring import BitArray
 '''
 Common network constants
 '''
@@ -18,8 +17,32 @@ MESSAGE_PIECE = 7
 MESSAGE_CANCEL = 8
 MESSAGE_PORT = 9
 
+# fast extension (BEP 6) peer messages
+MESSAGE_SUGGEST = 13
+MESSAGE_HAVE_ALL = 14
+MESSAGE_HAVE_NONE = 15
+MESSAGE_REJECT = 16
+MESSAGE_ALLOWED_FAST = 17
+
+# extension protocol (BEP 10) peer message
+MESSAGE_EXTENDED = 20
+EXTENDED_HANDSHAKE_ID = 0
+
+# reserved handshake bits, as a big-endian integer of the 8 reserved bytes
+RESERVED_FAST_EXTENSION = 0x04
+RESERVED_EXTENSION_PROTOCOL = 0x100000
+
 HANDSHAKE_PROTOCOL_STR = b'BitTorrent protocol'
 
+# precompiled message encoders
+LENGTH_PREFIX = struct.Struct(">I")
+MESSAGE_HEADER = struct.Struct(">IB")
+PIECE_INDEX_MESSAGE = struct.Struct(">IBI")
+PIECE_HEADER = struct.Struct(">IBII")
+REQUEST_MESSAGE = struct.Struct(">IBIII")
+EXTENDED_HEADER = struct.Struct(">IBB")
+RESERVED_BYTES = struct.Struct(">Q")
+
 '''
 Classes for types of Peer messages
 '''
@@ -62,12 +85,12 @@ class SimpleMessage(AbstractPeerMessage):
     @property
     def raw(self):
         """raw message bytes"""
-        return struct.pack(">I", self.len_prefix) + chr(self.message_type).encode()
+        return MESSAGE_HEADER.pack(self.len_prefix, self.message_type)
 
     @classmethod
     def from_msg(cls, msg):
         """create a class instance from the raw message"""
-        return cls(struct.unpack(">I", msg[:4])[0], msg[4])
+        return cls(*MESSAGE_HEADER.unpack_from(msg))
 
 
 class HaveMessage(AbstractPeerMessage):
@@ -89,12 +112,12 @@ class HaveMessage(AbstractPeerMessage):
     @property
     def raw(self):
         """raw message bytes"""
-        return struct.pack(">I", self.len_prefix) + chr(self.message_type).encode() + struct.pack(">I", self.piece_index)
+        return PIECE_INDEX_MESSAGE.pack(self.len_prefix, self.message_type, self.piece_index)
 
     @classmethod
     def from_msg(cls, msg):
         """create a class instance from the raw message"""
-        return cls(struct.unpack(">I", msg[:4])[0], msg[4], struct.unpack(">I", msg[5:9])[0])
+        return cls(*PIECE_INDEX_MESSAGE.unpack_from(msg))
 
 
 class BitfieldMessage(AbstractPeerMessage):
@@ -111,20 +134,25 @@ class BitfieldMessage(AbstractPeerMessage):
             raise Exception("Incorrect 'Bitfield' message")
         super().__init__(len_prefix, message_type)
 
-        self._bitfield = bitfield
-        bit_arr = BitArray(self._bitfield)
+        self.bitfield = bitfield
+
+    @property
+    def available_pieces(self):
+        """list of the piece indexes that are present"""
+        from bitstring import BitArray
 
-        self.available_pieces = [i for i in range(len(bit_arr)) if bit_arr[i]]
+        bit_arr = BitArray(self.bitfield)
+        return [i for i in range(len(bit_arr)) if bit_arr[i]]
 
     @property
     def raw(self):
         """raw message bytes"""
-        return struct.pack(">I", self.len_prefix) + chr(self.message_type).encode() + self._bitfield
+        return MESSAGE_HEADER.pack(self.len_prefix, self.message_type) + self.bitfield
 
     @classmethod
     def from_msg(cls, msg):
         """create a class instance from the raw message"""
-        return cls(struct.unpack(">I", msg[:4])[0], msg[4], msg[5:])
+        return cls(*MESSAGE_HEADER.unpack_from(msg), msg[5:])
 
 
 class KeepAliveMessage(AbstractPeerMessage):
@@ -141,12 +169,12 @@ class KeepAliveMessage(AbstractPeerMessage):
     @property
     def raw(self):
         """raw message bytes"""
-        return struct.pack(">I", self.len_prefix)
+        return LENGTH_PREFIX.pack(self.len_prefix)
 
     @classmethod
     def from_msg(cls, msg):
         """create a class instance from the raw message"""
-        return cls(struct.unpack(">I", msg)[0], MESSAGE_KEEPALIVE)
+        return cls(LENGTH_PREFIX.unpack_from(msg)[0], MESSAGE_KEEPALIVE)
 
 
 class PieceMessage(AbstractPeerMessage):
@@ -170,23 +198,23 @@ class PieceMessage(AbstractPeerMessage):
     @property
     def raw(self):
         """raw message bytes"""
-        return struct.pack('>IbII' + str(self.len_prefix - 9) + 's', self.len_prefix, self.message_type, self.index, self.begin, self.block)
+        return PIECE_HEADER.pack(self.len_prefix, self.message_type, self.index, self.begin) + self.block
 
     @classmethod
     def from_msg(cls, msg):
         """create a class instance from the raw message"""
-        length = struct.unpack('>I', msg[:4])[0]
-        parts = struct.unpack('>IbII' + str(length - 9) + 's', msg[:length + 4])
-        return cls(parts[2], parts[3], parts[4], len_prefix=parts[0], message_type=parts[1])
+        len_prefix, message_type, index, begin = PIECE_HEADER.unpack_from(msg)
+        return cls(index, begin, msg[13:len_prefix + 4], len_prefix=len_prefix, message_type=message_type)
 
 
 class HandshakeMessage(AbstractPeerMessage):
-    def __init__(self, info_hash, peer_id, len_prefix=19, message_type=MESSAGE_HANDSHAKE):
+    def __init__(self, info_hash, peer_id, reserved=0, len_prefix=19, message_type=MESSAGE_HANDSHAKE):
         """Initialize a 'handshake' message
 
         Args:
             info_hash: 20-byte SHA1 hash of the info key in the metainfo file
             peer_id: 20-byte string used as a unique ID for the client
+            reserved: the 8 reserved bytes as an integer, advertising supported extensions
             len_prefix: message length prefix according to the protocol
             message_type: a constant value mostly specified by the protocol
         """
@@ -195,6 +223,7 @@ class HandshakeMessage(AbstractPeerMessage):
 
         self.info_hash = info_hash
         self.peer_id = peer_id
+        self.reserved = reserved
 
     @property
     def raw(self):
@@ -202,15 +231,27 @@ class HandshakeMessage(AbstractPeerMessage):
         return b''.join([
             chr(self.len_prefix).encode(),
             b'BitTorrent protocol',
-            (chr(0) * 8).encode(),
+            RESERVED_BYTES.pack(self.reserved),
             self.info_hash,
             self.peer_id
         ])
 
+    def supports(self, extension):
+        """Check whether the handshake advertises an extension
+
+        Args:
+            extension: one of the RESERVED_* bit masks
+
+        Returns:
+            True if the extension bits are set, else False
+        """
+
+        return self.reserved & extension == extension
+
     @classmethod
     def from_msg(cls, msg):
         """create a class instance from the raw message"""
-        return cls(msg[28:48], msg[48:], len_prefix=msg[0])
+        return cls(msg[28:48], msg[48:], reserved=RESERVED_BYTES.unpack_from(msg, 20)[0], len_prefix=msg[0])
 
 
 class RequestMessage(AbstractPeerMessage):
@@ -234,14 +275,128 @@ class RequestMessage(AbstractPeerMessage):
     @property
     def raw(self):
         """raw message bytes"""
-        return struct.pack('>IbIII',
-                           self.len_prefix,
-                           self.message_type,
-                           self.index,
-                           self.begin,
-                           self.length)
+        return REQUEST_MESSAGE.pack(self.len_prefix, self.message_type, self.index, self.begin, self.length)
+
+    @classmethod
+    def from_msg(cls, msg):
+        """create a class instance from the raw message"""
+        len_prefix, message_type, index, begin, length = REQUEST_MESSAGE.unpack_from(msg)
+        return cls(index, begin, length, len_prefix=len_prefix, message_type=message_type)
+
+
+class CancelMessage(RequestMessage):
+    def __init__(self, index, begin, length, len_prefix=13, message_type=MESSAGE_CANCEL):
+        """Initialize a message cancelling a previously sent block request
+
+        Args:
+            index: integer specifying the zero-based piece index
+            begin: integer specifying the zero-based byte offset within the piece
+            length: integer specifying the requested length.
+            len_prefix: message length prefix according to the protocol
+            message_type: a constant value mostly specified by the protocol
+        """
+
+        if message_type != MESSAGE_CANCEL:
+            raise Exception("Incorrect 'Cancel' message")
+
+        super().__init__(index, begin, length, len_prefix, message_type)
+
+
+class RejectMessage(RequestMessage):
+    def __init__(self, index, begin, length, len_prefix=13, message_type=MESSAGE_REJECT):
+        """Initialize a fast extension message rejecting a block request
+
+        Args:
+            index: integer specifying the zero-based piece index
+            begin: integer specifying the zero-based byte offset within the piece
+            length: integer specifying the requested length.
+            len_prefix: message length prefix according to the protocol
+            message_type: a constant value mostly specified by the protocol
+        """
+
+        if message_type != MESSAGE_REJECT:
+            raise Exception("Incorrect 'Reject Request' message")
+
+        super().__init__(index, begin, length, len_prefix, message_type)
+
+
+class PieceIndexMessage(AbstractPeerMessage):
+    def __init__(self, message_type, piece_index, len_prefix=5):
+        """Initialize a fast extension message carrying a single piece index ('allowed fast' or 'suggest piece')
+
+        Args:
+            message_type: a constant value mostly specified by the protocol
+            piece_index: the zero-based piece index
+            len_prefix: message length prefix according to the protocol
+        """
+
+        if message_type not in (MESSAGE_ALLOWED_FAST, MESSAGE_SUGGEST):
+            raise Exception("Incorrect piece index message")
+
+        super().__init__(len_prefix, message_type)
+        self.piece_index = piece_index
+
+    @property
+    def raw(self):
+        """raw message bytes"""
+        return PIECE_INDEX_MESSAGE.pack(self.len_prefix, self.message_type, self.piece_index)
+
+    @classmethod
+    def from_msg(cls, msg):
+        """create a class instance from the raw message"""
+        len_prefix, message_type, piece_index = PIECE_INDEX_MESSAGE.unpack_from(msg)
+        return cls(message_type, piece_index, len_prefix=len_prefix)
+
+
+class ExtendedMessage(AbstractPeerMessage):
+    def __init__(self, extended_id, payload, len_prefix=None, message_type=MESSAGE_EXTENDED):
+        """Initialize an extension protocol message
+
+        Args:
+            extended_id: 0 for the extended handshake, else the id the receiver assigned to the extension
+            payload: the message payload, a bencoded dictionary optionally followed by raw data
+            len_prefix: message length prefix according to the protocol
+            message_type: a constant value mostly specified by the protocol
+        """
+
+        if message_type != MESSAGE_EXTENDED:
+            raise Exception("Incorrect 'Extended' message")
+
+        super().__init__(len_prefix if len_prefix is not None else len(payload) + 2, message_type)
+        self.extended_id = extended_id
+        self.payload = payload
+
+    @property
+    def raw(self):
+        """raw message bytes"""
+        return EXTENDED_HEADER.pack(self.len_prefix, self.message_type, self.extended_id) + self.payload
+
+    @classmethod
+    def from_msg(cls, msg):
+        """create a class instance from the raw message"""
+        len_prefix, message_type, extended_id = EXTENDED_HEADER.unpack_from(msg)
+        return cls(extended_id, msg[6:], len_prefix=len_prefix, message_type=message_type)
+
+
+class UnknownMessage(AbstractPeerMessage):
+    def __init__(self, len_prefix, message_type, payload):
+        """Initialize a message of a type this client doesn't handle, so it can be skipped
+
+        Args:
+            len_prefix: message length prefix according to the protocol
+            message_type: the message id as received
+            payload: the message payload following the id
+        """
+
+        super().__init__(len_prefix, message_type)
+        self.payload = payload
+
+    @property
+    def raw(self):
+        """raw message bytes"""
+        return MESSAGE_HEADER.pack(self.len_prefix, self.message_type) + self.payload
 
     @classmethod
     def from_msg(cls, msg):
         """create a class instance from the raw message"""
-        return cls(*struct.unpack('>IbIII', msg))
+        return cls(*MESSAGE_HEADER.unpack_from(msg), msg[5:])
@@ -1,75 +1,304 @@
 from .network import *
+from .bitset import Bitset
+from .score import PeerScore
+from .window import RequestWindow
+from .capture import DIRECTION_IN, DIRECTION_OUT
+from tracker.profiler import NULL_PROFILER
+from .extension import (PexState, extended_handshake, parse_extended, metadata_request,
+                        METADATA_DATA, METADATA_REJECT)
 import asyncio
+import time
 
 
 class Peer:
-    def __init__(self, ip, port, torrent):
+    REQUEST_TIMEOUT = 10
+    # largest block a peer may request from us
+    MAX_REQUEST = 2 ** 17
+
+    def __init__(self, ip, port, torrent, on_peers=None, profiler=None, download_limit=None, upload_limit=None,
+                 capture=None, stats=None, read_block=None):
         """Initialize a peer class
 
         Args:
             ip: peer ip address
             port: peer port number
             torrent: torrent class representing the metainfo file
+            on_peers: optional callback taking a list of (ip, port) tuples learned through peer exchange
+            profiler: an optional Profiler timing the handshake and recv phases
+            download_limit: an optional TokenBucket block requests are throttled by
+            upload_limit: an optional TokenBucket outgoing messages are throttled by
+            capture: an optional PeerCapture the connection messages are recorded by
+            stats: an optional TorrentStats the uploaded block bytes are counted in
+            read_block: an optional coroutine function taking (index, begin, length) and returning the block bytes,
+                None if the block can't be uploaded. When given, the peer is unchoked once interested
+                and its requests are answered with the blocks read
         """
 
-        self.available_pieces = []
+        self.ip = ip
+        self.port = port
+        self.available_pieces = Bitset()
+        self.allowed_fast = set()
         self.handshake_complete = False
+        self.supports_fast = False
+        self.supports_extensions = False
+        self.extensions = {}
+        self.metadata_size = None
+        self.score = PeerScore()
+        self.window = RequestWindow()
+        self.requests = {}
 
         self._is_interested = False
         self._is_choking = True
         self._am_interested = False
         self._am_choking = True
+        self._progress = None
+        self._on_peers = on_peers
+        self._pex = PexState()
+        self._metadata_pieces = {}
+        self._metadata_rejected = set()
+        self._profiler = profiler or NULL_PROFILER
+        self._download_limit = download_limit
+        self._throttled = None
+        self._read_block = read_block
+        self._incoming = []
+        self._haves = []
+        self._uploader = None
+
+        self._conn = PeerConnection(ip, port, torrent.info_hash, torrent.peer_id, profiler=self._profiler,
+                                    upload_limit=upload_limit, capture=capture, stats=stats)
+
+    @property
+    def peer_id(self):
+        """The peer id the remote peer sent in its handshake, None before the handshake"""
+        return self._conn.remote_peer_id
+
+    async def handshake(self, bitfield=b""):
+        """Performs a handshake and sets self.handshake_complete accordingly
 
-        self._conn = PeerConnection(ip, port, torrent.info_hash, torrent.peer_id)
-
-    async def handshake(self):
-        """Performs a handshake and sets self.handshake_complete accordingly"""
+        Args:
+            bitfield: raw bitfield of the pieces we can upload, announced if any is set
+        """
 
         try:
-            await self._conn.handshake()
+            with self._profiler.phase("handshake"):
+                await self._conn.handshake()
+                messages = await self._conn.recv()
+
+            self.supports_fast = self._conn.supports(RESERVED_FAST_EXTENSION)
+            if any(bitfield):
+                await self._conn.send(BitfieldMessage(len(bitfield) + 1, MESSAGE_BITFIELD, bytes(bitfield)).raw)
+            elif self.supports_fast:
+                await self._conn.send(SimpleMessage(1, MESSAGE_HAVE_NONE).raw)
 
-            messages = await self._conn.recv()
             self._handle_messages(messages)
+
+            self.supports_extensions = self._conn.supports(RESERVED_EXTENSION_PROTOCOL)
+            if self.supports_extensions:
+                await self._conn.send(ExtendedMessage(EXTENDED_HANDSHAKE_ID, extended_handshake()).raw)
+
             self.handshake_complete = True
+            if self._haves:
+                self._wake_uploader()
 
         except Exception:
             self.handshake_complete = False
 
-    async def download(self, block):
-        """Download a specified block
+    async def request(self, block):
+        """Send a request for a block, declaring interest first if needed
 
         Args:
             block: a block object specifying a piece block to download
 
         Returns:
-            downloaded block, non if failed
+            True if the request was sent, False if the peer chokes us, the connection failed
+            or the block was cancelled while the request waited for the download limit
         """
 
-        downloaded = None
-
         try:
             if not self._am_interested:
                 await self._conn.send(SimpleMessage(1, MESSAGE_INTERESTED).raw)
                 self._am_interested = True
 
+            if self._is_choking and block.index not in self.allowed_fast:
+                return False
+
+            if self._download_limit is not None:
+                self._throttled = (block.index, block.begin)
+                await self._download_limit.consume(block.length)
+
+                if self._throttled is None:
+                    return False
+                self._throttled = None
+
+            await self._conn.send(RequestMessage(block.index, block.begin, block.length).raw)
+        except Exception:
+            return False
+
+        if not self.requests:
+            self._progress = time.monotonic()
+
+        self.requests[(block.index, block.begin)] = (self.window.sent(), block.length)
+        self.score.requested()
+
+        return True
+
+    async def receive(self):
+        """Wait for the next messages and settle the outstanding requests. Delivered blocks are returned,
+        rejected requests and, without the fast extension, requests dropped by a choke are forgotten,
+        and every request is forgotten once nothing arrived for REQUEST_TIMEOUT seconds.
+        A failed connection, or one delivering a block of another length than requested, is closed,
+        so handshake_complete turns False
+
+        Returns:
+            a list of the 'piece' messages answering outstanding requests
+        """
+
+        try:
             messages = await self._conn.recv()
-            self._handle_messages(messages)
+        except Exception:
+            self.requests.clear()
+            self.score.idle()
+            self.close()
+            return []
+
+        delivered = []
+        for msg in messages:
+            if msg.message_type != MESSAGE_PIECE:
+                continue
+
+            request = self.requests.pop((msg.index, msg.begin), None)
+            if request is None:
+                continue
 
-            if self._am_interested and (not self._is_choking):
-                await self._conn.send(RequestMessage(block.index, block.begin, block.length).raw)
+            token, length = request
+            if len(msg.block) != length:
+                self.requests.clear()
+                self.score.idle()
+                self.close()
+                return delivered
+
+            self.window.acked(token, len(msg.block))
+            self.score.delivered(len(msg.block))
+            self._progress = time.monotonic()
+            delivered.append(msg)
+
+        self._handle_messages(messages)
+
+        if self.requests and time.monotonic() - self._progress > Peer.REQUEST_TIMEOUT:
+            self.requests.clear()
+            self.window.backoff()
+            self.score.timed_out()
+
+        if not self.requests:
+            self.score.idle()
+
+        return delivered
+
+    async def fetch_metadata_piece(self, piece):
+        """Download a 16 KiB piece of the info dictionary through ut_metadata
+
+        Args:
+            piece: zero-based index of the metadata piece
+
+        Returns:
+            the piece data, None if failed or rejected
+        """
+
+        if b"ut_metadata" not in self.extensions:
+            return None
+
+        self._metadata_pieces.pop(piece, None)
+        self._metadata_rejected.discard(piece)
+
+        try:
+            await self._conn.send(ExtendedMessage(self.extensions[b"ut_metadata"], metadata_request(piece)).raw)
+            messages = await self._conn.recv()
+
+            while messages:
+                self._handle_messages(messages)
+
+                if piece in self._metadata_pieces or piece in self._metadata_rejected:
+                    break
                 messages = await self._conn.recv()
+        except Exception:
+            return None
+
+        return self._metadata_pieces.pop(piece, None)
+
+    def have(self, index):
+        """Announce a piece that can be uploaded now, once the handshake completed
+
+        Args:
+            index: the piece index
+
+        Returns:
+            None
+        """
+
+        if self._read_block is None:
+            return
+
+        self._haves.append(index)
+        if self.handshake_complete:
+            self._wake_uploader()
+
+    def close(self):
+        """Close the connection to the peer
+
+        Returns:
+            None
+        """
+
+        self.handshake_complete = False
+        self._conn.close()
+
+        if self._uploader is not None:
+            self._uploader.cancel()
 
-                while messages:
-                    piece_msg = [msg for msg in messages if (msg.message_type == MESSAGE_PIECE and (msg.index == block.index and msg.begin == block.begin))]
-                    if piece_msg:
-                        downloaded = piece_msg[0]
+    async def send_pex(self, connected):
+        """Tell the peer about the peers we are connected to, at most once per PexState.INTERVAL
 
-                    self._handle_messages(messages)
-                    messages = await self._conn.recv()
+        Args:
+            connected: a list of (ip, port) tuples of the currently connected peers
+
+        Returns:
+            None
+        """
+
+        if b"ut_pex" not in self.extensions:
+            return
+
+        payload = self._pex.build([address for address in connected if address != (self.ip, self.port)])
+        if payload is None:
+            return
+
+        try:
+            await self._conn.send(ExtendedMessage(self.extensions[b"ut_pex"], payload).raw)
         except Exception:
-            downloaded = None
+            pass
+
+    async def cancel(self, block):
+        """Cancel a pending request for a block, used in endgame once another peer delivered it
 
-        return downloaded
+        Args:
+            block: the block object whose request should be cancelled
+
+        Returns:
+            None
+        """
+
+        if self._throttled == (block.index, block.begin):
+            self._throttled = None
+            return
+
+        self.requests.pop((block.index, block.begin), None)
+        if not self.requests:
+            self.score.idle()
+
+        try:
+            await self._conn.send(CancelMessage(block.index, block.begin, block.length).raw)
+        except Exception:
+            pass
 
     def _handle_messages(self, messages):
         """Handle a list of Message objects
@@ -83,23 +312,122 @@ class Peer:
 
         for msg in messages:
             if msg.message_type == MESSAGE_BITFIELD:
-                self.available_pieces.extend(messages[0].available_pieces)
+                self.available_pieces.update(msg.bitfield)
             elif msg.message_type == MESSAGE_INTERESTED:
                 self._is_interested = True
+                self._wake_uploader()
+            elif msg.message_type == MESSAGE_REQUEST:
+                if self._read_block is not None:
+                    self._incoming.append((msg.index, msg.begin, msg.length))
+                    self._wake_uploader()
+            elif msg.message_type == MESSAGE_CANCEL:
+                if (msg.index, msg.begin, msg.length) in self._incoming:
+                    self._incoming.remove((msg.index, msg.begin, msg.length))
             elif msg.message_type == MESSAGE_UNINTERESTED:
                 self._is_interested = False
             elif msg.message_type == MESSAGE_CHOKE:
                 self._is_choking = True
+                self.score.choked()
+                if not self.supports_fast:
+                    self.requests.clear()
             elif msg.message_type == MESSAGE_UNCHOKE:
                 self._is_choking = False
+                self.score.unchoked()
             elif msg.message_type == MESSAGE_HAVE:
-                self.available_pieces.append(msg.piece_index)
+                self.available_pieces.add(msg.piece_index)
+            elif msg.message_type == MESSAGE_HAVE_ALL:
+                self.available_pieces.set_all()
+            elif msg.message_type == MESSAGE_HAVE_NONE:
+                self.available_pieces.clear()
+            elif msg.message_type == MESSAGE_ALLOWED_FAST:
+                self.allowed_fast.add(msg.piece_index)
+            elif msg.message_type == MESSAGE_REJECT:
+                if self.requests.pop((msg.index, msg.begin), None) is not None:
+                    self.window.backoff()
+            elif msg.message_type == MESSAGE_EXTENDED:
+                self._handle_extended(msg)
+
+    def _wake_uploader(self):
+        """Start the upload task unless it is running or there is no way to read blocks
+
+        Returns:
+            None
+        """
+
+        if self._read_block is not None and self._uploader is None:
+            self._uploader = asyncio.create_task(self._upload())
+
+    async def _upload(self):
+        """Send the queued 'have' messages, unchoke the peer once it is interested and answer its requests
+        in order with the blocks read, rejecting the ones that can't be served when the fast extension is on.
+        Outgoing blocks are throttled by the upload limit of the connection
+
+        Returns:
+            None
+        """
+
+        try:
+            while self._haves or self._incoming or (self._am_choking and self._is_interested):
+                if self._haves:
+                    await self._conn.send(HaveMessage(5, MESSAGE_HAVE, self._haves.pop(0)).raw)
+                    continue
+
+                if self._am_choking and self._is_interested:
+                    await self._conn.send(SimpleMessage(1, MESSAGE_UNCHOKE).raw)
+                    self._am_choking = False
+                    continue
+
+                index, begin, length = self._incoming.pop(0)
+
+                block = None
+                if not self._am_choking and 0 < length <= Peer.MAX_REQUEST:
+                    block = await self._read_block(index, begin, length)
+
+                if block is not None:
+                    await self._conn.send(PieceMessage(index, begin, block, 9 + len(block), MESSAGE_PIECE).raw)
+                elif self.supports_fast:
+                    await self._conn.send(RejectMessage(index, begin, length).raw)
+        except Exception:
+            self._incoming.clear()
+        finally:
+            self._uploader = None
+
+    def _handle_extended(self, msg):
+        """Handle an extension protocol message
+
+        Args:
+            msg: an ExtendedMessage object
+
+        Returns:
+            None
+        """
+
+        name, payload, data = parse_extended(msg)
+
+        if name == b"handshake" and isinstance(payload.get(b"m"), dict):
+            self.extensions = {ext: ext_id for ext, ext_id in payload[b"m"].items() if ext_id}
+
+            if isinstance(payload.get(b"metadata_size"), int) and payload[b"metadata_size"] > 0:
+                self.metadata_size = payload[b"metadata_size"]
+        elif name == b"ut_metadata" and isinstance(payload.get(b"piece"), int):
+            if payload.get(b"msg_type") == METADATA_DATA:
+                self._metadata_pieces[payload[b"piece"]] = data
+            elif payload.get(b"msg_type") == METADATA_REJECT:
+                self._metadata_rejected.add(payload[b"piece"])
+        elif name == b"ut_pex" and self._on_peers:
+            added = PexState.parse(payload)
+            if added:
+                self._on_peers(added)
 
 
 class PeerConnection:
     _timeout = 1
+    READ_SIZE = 2 ** 16
+    HAPPY_EYEBALLS_DELAY = 0.25
+    HIGH_WATER_MARK = 2 ** 18
+    DRAIN_TIMEOUT = 30
 
-    def __init__(self, ip, port, info_hash, peer_id):
+    def __init__(self, ip, port, info_hash, peer_id, profiler=None, upload_limit=None, capture=None, stats=None):
         """Initialize a peer connection class
 
         Args:
@@ -107,6 +435,10 @@ class PeerConnection:
             port: peer port
             info_hash: 20-byte SHA1 hash of the info key in the metainfo file
             peer_id: 20-byte string used as a unique ID for the client
+            profiler: an optional Profiler timing the recv phase
+            upload_limit: an optional TokenBucket outgoing messages are throttled by
+            capture: an optional PeerCapture recording the sent and received messages with their timing
+            stats: an optional TorrentStats the block bytes of sent 'piece' messages are added to
         """
 
         self._ip = ip
@@ -115,6 +447,16 @@ class PeerConnection:
         self._peer_id = peer_id
         self._reader = None
         self._writer = None
+        self._remote_handshake = None
+        self._buffer = b""
+        self._outbound = []
+        self._outbound_size = 0
+        self._flush_scheduled = False
+        self._profiler = profiler or NULL_PROFILER
+        self._upload_limit = upload_limit
+        self._capture = capture
+        self._recorder = None
+        self._stats = stats
 
     async def handshake(self):
         """Open a connection to another peer,
@@ -125,12 +467,34 @@ class PeerConnection:
         """
 
         self._reader, self._writer = await asyncio.open_connection(
-            self._ip, self._port
+            self._ip, self._port, happy_eyeballs_delay=PeerConnection.HAPPY_EYEBALLS_DELAY
         )
+        self._writer.transport.set_write_buffer_limits(high=PeerConnection.HIGH_WATER_MARK)
+
+        if self._capture is not None:
+            self._recorder = self._capture.open(self._info_hash, (self._ip, self._port))
 
-        handshake = HandshakeMessage(self._info_hash, self._peer_id.encode())
+        handshake = HandshakeMessage(self._info_hash, self._peer_id.encode(),
+                                     reserved=RESERVED_FAST_EXTENSION | RESERVED_EXTENSION_PROTOCOL)
         await self.send(handshake.raw)
 
+    @property
+    def remote_peer_id(self):
+        """The peer id of the remote handshake, None before it arrived"""
+        return self._remote_handshake.peer_id if self._remote_handshake is not None else None
+
+    def supports(self, extension):
+        """Check whether an extension was negotiated, i.e. both sides set its reserved bits
+
+        Args:
+            extension: one of the RESERVED_* bit masks
+
+        Returns:
+            True if both handshakes advertise the extension, else False
+        """
+
+        return self._remote_handshake is not None and self._remote_handshake.supports(extension)
+
     async def recv(self):
         """Receive messages from the associated peer
 
@@ -139,48 +503,74 @@ class PeerConnection:
         """
 
         messages = []
-        data = b""
+        started = time.perf_counter()
 
         while True:
-            fut = self._reader.read(1024)
+            fut = self._reader.read(PeerConnection.READ_SIZE)
             try:
-                data += await asyncio.wait_for(fut, timeout=PeerConnection._timeout)
+                data = await asyncio.wait_for(fut, timeout=PeerConnection._timeout)
 
             except asyncio.TimeoutError as e:
+                self._profiler.record("recv_timeout", time.perf_counter() - started)
                 return messages
 
             if not data:
+                if not messages:
+                    raise ConnectionError(f"peer at {self._ip}:{self._port} closed the connection")
                 break
 
-            if data.startswith(b'\x13BitTorrent protocol'):
-                if len(data) < 68:
-                    continue
-                else:
-                    msg = self.create_peer_message(data[:68])
+            self._buffer += data
+            messages.extend(self._parse_buffer())
 
-                    if not self._validate_handshake(msg):
-                        raise Exception(f"peer at {self._ip}:{self._port} handshake failed")
-                    data = data[len(msg.raw):]
+            if messages:
+                break
 
-            if len(data) < 4:
-                continue
+        self._profiler.record("recv", time.perf_counter() - started)
+        return messages
 
-            len_field = struct.unpack(">I", data[:4])[0]
-            if len(data) - 4 < len_field:
-                continue
+    def _parse_buffer(self):
+        """Parse every complete message in the receive buffer, leaving a partial message for the next read
 
-            msg = self.create_peer_message(data[:len_field + 4])
-            data = data[len_field + 4:]
+        Returns:
+            a list of Message objects parsed
+        """
 
-            messages.append(msg)
+        messages = []
 
-            if not data:
+        if self._buffer.startswith(b'\x13BitTorrent protocol'):
+            if len(self._buffer) < 68:
+                return messages
+
+            msg = self.create_peer_message(self._buffer[:68])
+
+            if not self._validate_handshake(msg):
+                raise Exception(f"peer at {self._ip}:{self._port} handshake failed")
+
+            self._remote_handshake = msg
+            if self._recorder is not None:
+                self._recorder.record(DIRECTION_IN, self._buffer[:68])
+            self._buffer = self._buffer[68:]
+
+        offset = 0
+        while len(self._buffer) - offset >= 4:
+            len_field = LENGTH_PREFIX.unpack_from(self._buffer, offset)[0]
+            if len(self._buffer) - offset - 4 < len_field:
                 break
 
+            raw = self._buffer[offset:offset + len_field + 4]
+            if self._recorder is not None:
+                self._recorder.record(DIRECTION_IN, raw)
+
+            messages.append(self.create_peer_message(raw))
+            offset += len_field + 4
+
+        self._buffer = self._buffer[offset:]
+
         return messages
 
     async def send(self, data):
-        """Send data to the associated peer
+        """Queue data to the associated peer. Messages sent during the same loop iteration are
+        written together, and the call waits for the peer to read once HIGH_WATER_MARK bytes are pending
 
         Args:
             data: raw data to be sent
@@ -189,7 +579,42 @@ class PeerConnection:
             None
         """
 
-        self._writer.write(data)
+        if self._writer is None:
+            raise ConnectionError(f"peer at {self._ip}:{self._port} is not connected")
+
+        if self._upload_limit is not None:
+            await self._upload_limit.consume(len(data))
+
+        if self._recorder is not None:
+            self._recorder.record(DIRECTION_OUT, data)
+
+        if self._stats is not None and len(data) > PIECE_HEADER.size and data[4] == MESSAGE_PIECE:
+            self._stats.uploaded_bytes += len(data) - PIECE_HEADER.size
+
+        self._outbound.append(data)
+        self._outbound_size += len(data)
+
+        if self._outbound_size + self._writer.transport.get_write_buffer_size() > PeerConnection.HIGH_WATER_MARK:
+            self._flush()
+            await asyncio.wait_for(self._writer.drain(), timeout=PeerConnection.DRAIN_TIMEOUT)
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        """Write the queued messages with a single writelines call
+
+        Returns:
+            None
+        """
+
+        self._flush_scheduled = False
+
+        if self._outbound and self._writer is not None:
+            self._writer.writelines(self._outbound)
+
+        self._outbound = []
+        self._outbound_size = 0
 
     def _validate_handshake(self, handshake):
         """Validate a handshake
@@ -227,10 +652,22 @@ class PeerConnection:
             return BitfieldMessage.from_msg(msg)
         elif msg[4] == MESSAGE_PIECE:
             return PieceMessage.from_msg(msg)
+        elif msg[4] == MESSAGE_REQUEST:
+            return RequestMessage.from_msg(msg)
+        elif msg[4] == MESSAGE_CANCEL:
+            return CancelMessage.from_msg(msg)
+        elif msg[4] == MESSAGE_REJECT:
+            return RejectMessage.from_msg(msg)
+        elif msg[4] in (MESSAGE_ALLOWED_FAST, MESSAGE_SUGGEST):
+            return PieceIndexMessage.from_msg(msg)
+        elif msg[4] == MESSAGE_EXTENDED:
+            return ExtendedMessage.from_msg(msg)
         elif len(msg) == 5:
             return SimpleMessage.from_msg(msg)
+        else:
+            return UnknownMessage.from_msg(msg)
 
-    def __del__(self):
+    def close(self):
         """Close peer connection
 
         Returns:
@@ -238,4 +675,21 @@ class PeerConnection:
         """
 
         if self._writer:
+            self._flush()
             self._writer.close()
+            self._writer = None
+
+        if self._recorder is not None:
+            self._recorder.close()
+
+    def __del__(self):
+        """Close peer connection
+
+        Returns:
+            None
+        """
+
+        try:
+            self.close()
+        except RuntimeError:
+            pass
@@ -0,0 +1,146 @@
+import time
+
+
+class PeerScore:
+    SNUB_TIMEOUT = 30
+    HASH_FAILURE_WEIGHT = 4
+    SMOOTHING = 0.5
+
+    def __init__(self):
+        """Initialize the score of a peer, measuring its delivery rate, timeouts, hash failures and time spent
+        choking us. Counters decay at every sample(), so a peer can recover from a bad period
+        """
+
+        now = time.monotonic()
+
+        self.created = now
+        self.rate = 0.0
+        self.timeouts = 0.0
+        self.hash_failures = 0.0
+        self.choked_fraction = 1.0
+
+        self._bytes = 0
+        self._choked_time = 0.0
+        self._sampled = now
+        self._choked_since = now
+        self._unchoked_since = None
+        self._waiting_since = None
+
+    def requested(self):
+        """Record a sent request, a peer that is unchoked and owes us data may become snubbed
+
+        Returns:
+            None
+        """
+
+        if self._waiting_since is None:
+            self._waiting_since = time.monotonic()
+
+    def delivered(self, size):
+        """Record a delivered block, the peer may become snubbed again from now on if it owes us more
+
+        Args:
+            size: the block size in bytes
+
+        Returns:
+            None
+        """
+
+        self._bytes += size
+        self._waiting_since = time.monotonic()
+
+    def idle(self):
+        """Record that no request is outstanding anymore, a peer that owes us nothing isn't snubbing us
+
+        Returns:
+            None
+        """
+
+        self._waiting_since = None
+
+    def timed_out(self):
+        """Record a request the peer didn't answer in time
+
+        Returns:
+            None
+        """
+
+        self.timeouts += 1
+
+    def hash_failed(self):
+        """Record a block of a piece whose hash didn't match
+
+        Returns:
+            None
+        """
+
+        self.hash_failures += 1
+
+    def choked(self):
+        """Record a 'choke' message
+
+        Returns:
+            None
+        """
+
+        if self._choked_since is None:
+            self._choked_since = time.monotonic()
+            self._unchoked_since = None
+
+    def unchoked(self):
+        """Record an 'unchoke' message
+
+        Returns:
+            None
+        """
+
+        if self._choked_since is not None:
+            now = time.monotonic()
+            self._choked_time += now - max(self._choked_since, self._sampled)
+            self._choked_since = None
+            self._unchoked_since = now
+
+    @property
+    def age(self):
+        """Seconds since the peer was scored first"""
+        return time.monotonic() - self.created
+
+    @property
+    def snubbed(self):
+        """True if the peer is unchoked and hasn't delivered anything we asked for in SNUB_TIMEOUT seconds"""
+        if self._unchoked_since is None or self._waiting_since is None:
+            return False
+
+        return time.monotonic() - max(self._unchoked_since, self._waiting_since) > PeerScore.SNUB_TIMEOUT
+
+    @property
+    def value(self):
+        """The score, the delivery rate while unchoked reduced by timeouts and hash failures. Higher is better"""
+        penalty = 1 + self.timeouts + PeerScore.HASH_FAILURE_WEIGHT * self.hash_failures
+        return self.rate * (1 - self.choked_fraction) / penalty
+
+    def sample(self):
+        """Update the smoothed rate and choke fraction over the time since the last sample and decay the counters
+
+        Returns:
+            None
+        """
+
+        now = time.monotonic()
+        elapsed = now - self._sampled
+        if elapsed <= 0:
+            return
+
+        choked = self._choked_time
+        if self._choked_since is not None:
+            choked += now - max(self._choked_since, self._sampled)
+
+        smoothing = PeerScore.SMOOTHING
+        self.rate = smoothing * self.rate + (1 - smoothing) * self._bytes / elapsed
+        self.choked_fraction = smoothing * self.choked_fraction + (1 - smoothing) * min(1.0, choked / elapsed)
+        self.timeouts *= smoothing
+        self.hash_failures *= smoothing
+
+        self._bytes = 0
+        self._choked_time = 0.0
+        self._sampled = now
@@ -0,0 +1,80 @@
+from tracker.blocks import Block
+from collections import deque
+import math
+import time
+
+
+class RequestWindow:
+    MIN_SIZE = 2
+    MAX_SIZE = 128
+    INITIAL_SIZE = 4
+    GAIN = 2
+    SAMPLES = 64
+    MIN_RTT_LIFETIME = 10
+
+    def __init__(self):
+        """Initialize the outstanding request window of a peer. Every delivered block gives an RTT sample and
+        a delivery rate sample, the bytes delivered while the block was in flight over its RTT. The window
+        covers GAIN times the bandwidth-delay product, the highest recent rate times the smallest RTT of the
+        last MIN_RTT_LIFETIME seconds, so it keeps growing while a deeper queue still raises the rate and
+        settles once requests only queue up
+        """
+
+        self.size = RequestWindow.INITIAL_SIZE
+        self.rate = 0.0
+        self.min_rtt = None
+        self.delivered = 0
+
+        self._min_rtt_at = None
+        self._rates = deque(maxlen=RequestWindow.SAMPLES)
+
+    def sent(self):
+        """Record a sent request
+
+        Returns:
+            a token to be handed to acked() once the block arrives
+        """
+
+        return time.monotonic(), self.delivered
+
+    def acked(self, token, size):
+        """Take the RTT and delivery rate samples of a delivered block and resize the window
+
+        Args:
+            token: the token sent() returned for the request
+            size: the block size in bytes
+
+        Returns:
+            None
+        """
+
+        sent_at, delivered_at = token
+        self.delivered += size
+
+        now = time.monotonic()
+        rtt = now - sent_at
+        if rtt <= 0:
+            return
+
+        if self.min_rtt is None or rtt <= self.min_rtt or now - self._min_rtt_at > RequestWindow.MIN_RTT_LIFETIME:
+            self.min_rtt = rtt
+            self._min_rtt_at = now
+
+        self._rates.append((self.delivered - delivered_at) / rtt)
+        self.rate = max(self._rates)
+
+        bdp = self.rate * self.min_rtt
+        self.size = max(RequestWindow.MIN_SIZE,
+                        min(RequestWindow.MAX_SIZE, math.ceil(RequestWindow.GAIN * bdp / Block.BLOCK_SIZE)))
+
+    def backoff(self):
+        """Halve the window and forget the rate samples after a timeout or a rejected request
+
+        Returns:
+            None
+        """
+
+        self.size = max(RequestWindow.MIN_SIZE, self.size // 2)
+        self.rate /= 2
+        self._rates.clear()
+        self._rates.append(self.rate)
@@ -0,0 +1,495 @@
+from tracker.tracker import Tracker
+from tracker.limits import ConnectionLimit, TokenBucket
+from tracker.disk import DiskPool, ALLOCATE_SPARSE
+from tracker.buffers import BufferPool
+from peer.capture import PeerCapture
+import threading
+import asyncio
+
+# torrent states
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+PAUSED = "paused"
+COMPLETED = "completed"
+FAILED = "failed"
+REMOVED = "removed"
+
+
+class TorrentHandle:
+    def __init__(self, tracker):
+        """Initialize a handle to a torrent managed by a session
+
+        Args:
+            tracker: the tracker object downloading the torrent
+        """
+
+        self.tracker = tracker
+        self.state = QUEUED
+        self.error = None
+
+        self._finished = threading.Event()
+        self._callbacks = []
+        self._task = None
+
+    @property
+    def name(self):
+        """The torrent name"""
+        return self.tracker.torrent_name
+
+    @property
+    def info_hash(self):
+        """The 20-byte SHA1 hash of the info dictionary"""
+        return self.tracker.info_hash
+
+    @property
+    def stats(self):
+        """The TorrentStats counters of the download, safe to poll from any thread"""
+        return self.tracker.stats
+
+    def stream(self, file_index=None, timeout=None):
+        """Open a blocking file object over the torrent content, see Tracker.stream.
+        Its reads must not be done on the session thread
+
+        Args:
+            file_index: index of the file to read in a multi-file torrent, None for the whole content
+            timeout: optional seconds a read waits for a piece before raising TimeoutError
+
+        Returns:
+            a TorrentStream object
+        """
+
+        return self.tracker.stream(file_index, timeout)
+
+    def add_done_callback(self, callback):
+        """Register a callback called with the handle once the torrent completes, fails or is removed.
+        The callback runs on the session thread
+
+        Args:
+            callback: a function taking the handle
+
+        Returns:
+            None
+        """
+
+        self._callbacks.append(callback)
+
+    def wait(self, timeout=None):
+        """Block until the torrent completes, fails or is removed
+
+        Args:
+            timeout: optional timeout in seconds
+
+        Returns:
+            True if the torrent finished, False on timeout
+        """
+
+        return self._finished.wait(timeout)
+
+    def _finish(self, state, error=None):
+        """Set a final state and notify the waiters
+
+        Args:
+            state: COMPLETED, FAILED or REMOVED
+            error: the exception a failed download raised
+
+        Returns:
+            None
+        """
+
+        self.state = state
+        self.error = error
+        self._finished.set()
+
+        for callback in self._callbacks:
+            callback(self)
+
+
+class Session:
+    def __init__(self, max_active_torrents=8, max_connections=500, max_peers_per_torrent=Tracker.MAX_PEERS,
+                 dht_port=None, dht_bootstrap=(), dht_cache=None, download_dir=".",
+                 profiler=None, download_rate=None, upload_rate=None, disk_pool=None, allocation=ALLOCATE_SPARSE,
+                 buffer_pool=None, metrics_port=None, capture_dir=None, torrent_download_rate=None,
+                 torrent_upload_rate=None):
+        """Initialize a session running every torrent on a single event loop in a background thread
+
+        Args:
+            max_active_torrents: maximal number of torrents downloading at once, the rest are queued
+            max_connections: maximal number of peer connections across all torrents
+            max_peers_per_torrent: maximal number of peer connections of a single torrent
+            dht_port: udp port of a DHT node shared by the torrents, None to run without DHT
+            dht_bootstrap: a list of (host, port) tuples of DHT bootstrap nodes
+            dht_cache: optional path of the DHT routing table cache
+            download_dir: the directory torrents are saved in
+            profiler: an optional Profiler of the session loop, shared by the torrents
+            download_rate: global download limit in bytes per second, None for unlimited
+            upload_rate: global upload limit in bytes per second, None for unlimited
+            disk_pool: the DiskPool writing the torrents, a default one if not given
+            allocation: the file allocation mode of new torrents, one of the tracker.disk.ALLOCATE_* modes
+            buffer_pool: the BufferPool holding the pieces being downloaded, a default one if not given
+            metrics_port: tcp port of a Prometheus metrics endpoint on localhost, None to run without it
+            capture_dir: directory every peer connection is recorded to for sim.replay, None to not record
+            torrent_download_rate: download limit of each added torrent in bytes per second, None for unlimited
+            torrent_upload_rate: upload limit of each added torrent in bytes per second, None for unlimited
+        """
+
+        self.max_active_torrents = max_active_torrents
+        self.max_peers_per_torrent = max_peers_per_torrent
+        self.download_dir = download_dir
+
+        self.download_limit = TokenBucket(download_rate)
+        self.upload_limit = TokenBucket(upload_rate)
+        self.torrent_download_rate = torrent_download_rate
+        self.torrent_upload_rate = torrent_upload_rate
+        self.disk_pool = disk_pool or DiskPool()
+        self.allocation = allocation
+        self.buffer_pool = buffer_pool or BufferPool()
+        self.capture = PeerCapture(capture_dir) if capture_dir is not None else None
+
+        self._connections = ConnectionLimit(max_connections)
+        self._dht_port = dht_port
+        self._dht_bootstrap = dht_bootstrap
+        self._dht_cache = dht_cache
+        self._dht = None
+        self._metrics_port = metrics_port
+        self.metrics = None
+        self._profiler = profiler
+        self._handles = []
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+
+    def start(self):
+        """Start the session thread, the DHT node and the metrics endpoint
+
+        Returns:
+            None
+        """
+
+        self._thread.start()
+
+        if self._profiler is not None:
+            self._call(self._profiler.start())
+
+        if self._dht_port is not None:
+            self._call(self._start_dht())
+
+        if self._metrics_port is not None:
+            self._call(self._start_metrics())
+
+    def stop(self):
+        """Pause every torrent, stop the DHT node and the session thread
+
+        Returns:
+            None
+        """
+
+        self._call(self._shutdown())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self.disk_pool.shutdown()
+
+    @property
+    def handles(self):
+        """The handles of the torrents in the session"""
+        return list(self._handles)
+
+    def add(self, source, file_priorities=None):
+        """Add a torrent to the session, it starts as soon as an active torrent slot is free
+
+        Args:
+            source: a *.torrent file path or a magnet uri
+            file_priorities: an optional dict mapping file indexes to tracker.blocks.PRIORITY_* values
+
+        Returns:
+            a torrent handle
+        """
+
+        return self._call(self._add(source, file_priorities))
+
+    def set_file_priorities(self, handle, priorities):
+        """Change the file priorities of a torrent, see Tracker.set_file_priorities
+
+        Args:
+            handle: a torrent handle
+            priorities: a dict mapping file indexes to tracker.blocks.PRIORITY_* values
+
+        Returns:
+            None
+        """
+
+        self._call(self._set_file_priorities(handle, priorities))
+
+    def set_rate_limits(self, handle, download, upload):
+        """Change the bandwidth limits of a torrent, see Tracker.set_rate_limits
+
+        Args:
+            handle: a torrent handle
+            download: download limit in bytes per second, None for unlimited
+            upload: upload limit in bytes per second, None for unlimited
+
+        Returns:
+            None
+        """
+
+        self._call(self._set_rate_limits(handle, download, upload))
+
+    def pause(self, handle):
+        """Stop downloading a torrent and close its connections, keeping the downloaded data
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            None
+        """
+
+        self._call(self._pause(handle))
+
+    def resume(self, handle):
+        """Queue a paused torrent again
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            None
+        """
+
+        self._call(self._resume(handle))
+
+    def remove(self, handle):
+        """Stop a torrent and remove it from the session
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            None
+        """
+
+        self._call(self._remove(handle))
+
+    def _call(self, coro):
+        """Run a coroutine on the session loop and wait for its result. Must not be called from the session thread
+
+        Args:
+            coro: the coroutine to be run
+
+        Returns:
+            the coroutine result
+        """
+
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _run_loop(self):
+        """The session thread, runs the event loop until stopped
+
+        Returns:
+            None
+        """
+
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _start_dht(self):
+        """Start the shared DHT node
+
+        Returns:
+            None
+        """
+
+        from dht.node import DHTNode
+
+        self._dht = DHTNode(cache_path=self._dht_cache)
+        await self._dht.start(port=self._dht_port, bootstrap=self._dht_bootstrap)
+
+    async def _start_metrics(self):
+        """Start the metrics endpoint
+
+        Returns:
+            None
+        """
+
+        from metrics import MetricsServer
+
+        self.metrics = MetricsServer(self, port=self._metrics_port)
+        await self.metrics.start()
+
+    async def _shutdown(self):
+        """Pause every torrent and stop the DHT node and the metrics endpoint
+
+        Returns:
+            None
+        """
+
+        for handle in self._handles:
+            await self._pause(handle)
+
+        if self._dht is not None:
+            self._dht.stop()
+
+        if self.metrics is not None:
+            self.metrics.stop()
+
+        if self._profiler is not None:
+            self._profiler.stop()
+
+    async def _add(self, source, file_priorities=None):
+        """Create the tracker of a new torrent and schedule it
+
+        Args:
+            source: a *.torrent file path or a magnet uri
+            file_priorities: an optional dict mapping file indexes to priorities
+
+        Returns:
+            a torrent handle
+        """
+
+        kwargs = dict(dht=self._dht, max_peers=self.max_peers_per_torrent, connections=self._connections,
+                      download_dir=self.download_dir, profiler=self._profiler,
+                      download_limit=self.download_limit, upload_limit=self.upload_limit, disk_pool=self.disk_pool,
+                      allocation=self.allocation, buffer_pool=self.buffer_pool, capture=self.capture)
+
+        if source.startswith("magnet:"):
+            tracker = Tracker.from_magnet(source, **kwargs)
+        else:
+            tracker = Tracker.from_path(source, **kwargs)
+
+        if file_priorities:
+            tracker.set_file_priorities(file_priorities)
+        tracker.set_rate_limits(self.torrent_download_rate, self.torrent_upload_rate)
+
+        await tracker.allocate()
+
+        handle = TorrentHandle(tracker)
+        self._handles.append(handle)
+        self._schedule()
+
+        return handle
+
+    async def _set_file_priorities(self, handle, priorities):
+        """Change the file priorities of a torrent and create the files that became wanted
+
+        Args:
+            handle: a torrent handle
+            priorities: a dict mapping file indexes to priorities
+
+        Returns:
+            None
+        """
+
+        handle.tracker.set_file_priorities(priorities)
+        await handle.tracker.allocate()
+
+    async def _set_rate_limits(self, handle, download, upload):
+        """Change the bandwidth limits of a torrent on the session loop
+
+        Args:
+            handle: a torrent handle
+            download: download limit in bytes per second, None for unlimited
+            upload: upload limit in bytes per second, None for unlimited
+
+        Returns:
+            None
+        """
+
+        handle.tracker.set_rate_limits(download, upload)
+
+    async def _pause(self, handle):
+        """Stop a downloading or queued torrent
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            None
+        """
+
+        if handle.state == DOWNLOADING:
+            handle._task.cancel()
+
+            try:
+                await handle._task
+            except asyncio.CancelledError:
+                pass
+
+            handle.tracker.close()
+            handle.state = PAUSED
+            self._schedule()
+        elif handle.state == QUEUED:
+            handle.state = PAUSED
+
+    async def _resume(self, handle):
+        """Queue a paused torrent again
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            None
+        """
+
+        if handle.state == PAUSED:
+            handle.state = QUEUED
+            self._schedule()
+
+    async def _remove(self, handle):
+        """Stop a torrent and remove it from the session
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            None
+        """
+
+        if handle not in self._handles:
+            return
+
+        await self._pause(handle)
+        self._handles.remove(handle)
+
+        if handle.state not in (COMPLETED, FAILED):
+            handle._finish(REMOVED)
+
+    def _schedule(self):
+        """Start queued torrents while active torrent slots are free
+
+        Returns:
+            None
+        """
+
+        active = len([handle for handle in self._handles if handle.state == DOWNLOADING])
+
+        for handle in self._handles:
+            if active >= self.max_active_torrents:
+                break
+
+            if handle.state == QUEUED:
+                handle.state = DOWNLOADING
+                handle._task = self._loop.create_task(self._download(handle))
+                active += 1
+
+    async def _download(self, handle):
+        """Run a torrent download and record how it ended
+
+        Args:
+            handle: a torrent handle
+
+        Returns:
+            None
+        """
+
+        try:
+            await handle.tracker.download()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            handle.tracker.close()
+            handle._finish(FAILED, e)
+        else:
+            handle.tracker.close()
+            handle._finish(COMPLETED)
+
+        self._schedule()
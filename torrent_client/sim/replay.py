@@ -0,0 +1,177 @@
+from peer.network import *
+from peer.peer import PeerConnection
+from peer.capture import read_capture, DIRECTION_IN
+from collections import deque
+import asyncio
+import time
+
+
+class ReplayPeer:
+    REQUEST_WAIT = 1
+
+    def __init__(self, path, speed=1.0, blocks=None):
+        """Initialize a fake peer replaying the messages a remote peer sent in a captured session, on the
+        loopback interface. Messages are sent at their captured times divided by speed. 'piece' messages
+        answer the oldest outstanding request whose block the capture holds, since a changed scheduler asks
+        for other blocks than the captured client did. They are sent at their captured time or once such
+        a request arrives, whichever is later, and skipped once the client stopped requesting for
+        REQUEST_WAIT seconds
+
+        Args:
+            path: the capture file path
+            speed: how many times faster than captured the messages are sent
+            blocks: an optional dict mapping (index, begin) tuples to raw 'piece' messages, shared by the peers
+                of a replay so a peer answers requests for blocks another captured peer delivered
+        """
+
+        self.speed = speed
+        self.info_hash, self.captured_address, records = read_capture(path)
+        self.uploaded_bytes = 0
+        self.skipped = 0
+        self.connections = 0
+
+        self._records = [(at, data) for direction, at, data in records if direction == DIRECTION_IN]
+        self._blocks = blocks if blocks is not None else {}
+        for _, data in self._records:
+            if len(data) > 4 and data[4] == MESSAGE_PIECE:
+                piece = PieceMessage.from_msg(data)
+                self._blocks[(piece.index, piece.begin)] = data
+
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening
+
+        Args:
+            host: local address to bind
+            port: local tcp port, 0 for any
+
+        Returns:
+            the (ip, port) tuple the peer listens on
+        """
+
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self.address
+
+    def stop(self):
+        """Stop listening
+
+        Returns:
+            None
+        """
+
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    @property
+    def address(self):
+        """The (ip, port) tuple the peer listens on"""
+        return self._server.sockets[0].getsockname()[:2]
+
+    @property
+    def duration(self):
+        """Seconds the replay of a connection takes"""
+        return self._records[-1][0] / self.speed if self._records else 0.0
+
+    async def _serve(self, reader, writer):
+        """Replay the capture to a connecting client, then close the connection
+
+        Args:
+            reader: the connection stream reader
+            writer: the connection stream writer
+
+        Returns:
+            None
+        """
+
+        self.connections += 1
+        requests = deque()
+        requested = asyncio.Event()
+        listener = None
+        idle = False
+
+        try:
+            handshake = HandshakeMessage.from_msg(await reader.readexactly(68))
+            if handshake.info_hash != self.info_hash:
+                return
+
+            listener = asyncio.create_task(self._listen(reader, requests, requested))
+            started = time.monotonic()
+
+            for at, data in self._records:
+                delay = started + at / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                if len(data) > 4 and data[4] == MESSAGE_PIECE:
+                    data = self._answer(requests)
+                    while data is None and not (idle and not requested.is_set()):
+                        requested.clear()
+                        try:
+                            await asyncio.wait_for(requested.wait(), ReplayPeer.REQUEST_WAIT)
+                        except asyncio.TimeoutError:
+                            idle = True
+                            break
+
+                        idle = False
+                        data = self._answer(requests)
+
+                    if data is None:
+                        self.skipped += 1
+                        continue
+
+                writer.write(data)
+                self.uploaded_bytes += len(data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if listener is not None:
+                listener.cancel()
+            writer.close()
+
+    def _answer(self, requests):
+        """Take the oldest outstanding request the capture holds the block of
+
+        Args:
+            requests: a deque of (index, begin) tuples the client requested
+
+        Returns:
+            the raw 'piece' message, None if no outstanding request can be answered
+        """
+
+        for i, key in enumerate(requests):
+            if key in self._blocks:
+                del requests[i]
+                return self._blocks[key]
+
+        return None
+
+    @staticmethod
+    async def _listen(reader, requests, requested):
+        """Read the client messages and keep track of its outstanding requests
+
+        Args:
+            reader: the connection stream reader
+            requests: a deque of (index, begin) tuples updated in place
+            requested: an event set whenever a request arrives
+
+        Returns:
+            None
+        """
+
+        try:
+            while True:
+                length = struct.unpack(">I", await reader.readexactly(4))[0]
+                if not length:
+                    continue
+
+                msg = PeerConnection.create_peer_message(struct.pack(">I", length) + await reader.readexactly(length))
+                if msg.message_type == MESSAGE_REQUEST:
+                    requests.append((msg.index, msg.begin))
+                    requested.set()
+                elif msg.message_type == MESSAGE_CANCEL and (msg.index, msg.begin) in requests:
+                    requests.remove((msg.index, msg.begin))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
@@ -0,0 +1,639 @@
+from bencode.decode import bdecode_partial
+from bencode.encode import bencode
+from peer.network import *
+from peer.peer import PeerConnection
+from peer.extension import (encode_compact_peers, encode_compact_peers6, ip_version, METADATA_REQUEST,
+                            METADATA_DATA, METADATA_REJECT, METADATA_PIECE_SIZE)
+from hashlib import sha1
+import urllib.parse
+import asyncio
+import random
+import time
+import os
+
+
+def synthetic_torrent(size, piece_length=2 ** 18, name=b"synthetic.bin", files=None, seed=0):
+    """Create random content and the torrent dict describing it
+
+    Args:
+        size: total content size in bytes
+        piece_length: the torrent piece length
+        name: the torrent name
+        files: optional list of file sizes that sum to size, a multi-file torrent is created if given
+        seed: seed of the random content, the same seed gives the same torrent
+
+    Returns:
+        a tuple consisting of (content bytes, torrent dict)
+    """
+
+    data = random.Random(seed).randbytes(size)
+    pieces = b"".join(sha1(data[i:i + piece_length]).digest() for i in range(0, size, piece_length))
+
+    info = {b"name": name, b"piece length": piece_length, b"pieces": pieces}
+    if files:
+        if sum(files) != size:
+            raise Exception("file sizes don't add up to the torrent size")
+        info[b"files"] = [{b"length": length, b"path": [f"file{i}.bin".encode()]} for i, length in enumerate(files)]
+    else:
+        info[b"length"] = size
+
+    return data, {b"announce": b"http://127.0.0.1/announce", b"info": dict(sorted(info.items()))}
+
+
+class Seeder:
+    # extension message ids the seeder assigns in its extended handshake
+    EXTENSIONS = {
+        b"ut_metadata": 1,
+        b"ut_pex": 2,
+    }
+
+    def __init__(self, data, torrent_dict, latency=0, bandwidth=None, choke_interval=None, choke_duration=1,
+                 fast=False, extensions=False, pieces=None):
+        """Initialize a stand-in seeder speaking the peer wire protocol on the loopback interface
+
+        Args:
+            data: the complete torrent content
+            torrent_dict: the torrent dict of the content
+            latency: seconds between receiving a request and sending the piece
+            bandwidth: upload bytes per second of each connection, None for unlimited
+            choke_interval: seconds between chokes of every connection, None to never choke
+            choke_duration: seconds a connection stays choked
+            fast: advertise the fast extension, answering with 'have all' and rejecting dropped requests
+            extensions: advertise the extension protocol, serving the info dictionary through ut_metadata and
+                sending pex_peers through ut_pex
+            pieces: optional indexes of the pieces the seeder has, every piece by default. The missing pieces
+                are requested from the connected peers once they announce them
+        """
+
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.choke_interval = choke_interval
+        self.choke_duration = choke_duration
+        self.fast = fast
+        self.extensions = extensions
+        self.pex_peers = []
+
+        self.uploaded_bytes = 0
+        self.cancelled_requests = 0
+        self.downloaded_bytes = 0
+        self.corrupt_blocks = 0
+        self.connections = 0
+
+        self._data = data
+        self._info = torrent_dict[b"info"]
+        self.pieces = set(range(self.piece_count) if pieces is None else pieces)
+        self._received = {}
+        self._metadata = bencode(self._info)
+        self._info_hash = sha1(self._metadata).digest()
+        self._peer_id = b"-SM0001-" + os.urandom(6).hex().encode()
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening
+
+        Args:
+            host: local address to bind
+            port: local tcp port, 0 for any
+
+        Returns:
+            the (ip, port) tuple the seeder listens on
+        """
+
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self.address
+
+    def stop(self):
+        """Stop listening
+
+        Returns:
+            None
+        """
+
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    @property
+    def address(self):
+        """The (ip, port) tuple the seeder listens on"""
+        return self._server.sockets[0].getsockname()[:2]
+
+    @property
+    def piece_count(self):
+        """Number of pieces in the torrent"""
+        return len(self._info[b"pieces"]) // 20
+
+    async def _serve(self, reader, writer):
+        """Serve a single downloading peer
+
+        Args:
+            reader: the connection stream reader
+            writer: the connection stream writer
+
+        Returns:
+            None
+        """
+
+        self.connections += 1
+        state = {"choked": True, "choke_round": False, "requests": asyncio.Queue(), "cancelled": set(),
+                 "extensions": {}, "remote": set(), "unchoked": False, "interested": False, "requested": set()}
+        tasks = []
+
+        try:
+            handshake = HandshakeMessage.from_msg(await reader.readexactly(68))
+            if handshake.info_hash != self._info_hash:
+                return
+
+            reserved = (RESERVED_FAST_EXTENSION if self.fast else 0) | \
+                       (RESERVED_EXTENSION_PROTOCOL if self.extensions else 0)
+            writer.write(HandshakeMessage(self._info_hash, self._peer_id, reserved=reserved).raw)
+
+            if self.extensions and handshake.supports(RESERVED_EXTENSION_PROTOCOL):
+                payload = bencode({b"m": dict(sorted(Seeder.EXTENSIONS.items())),
+                                   b"metadata_size": len(self._metadata)})
+                writer.write(ExtendedMessage(EXTENDED_HANDSHAKE_ID, payload).raw)
+
+            if self.fast and handshake.supports(RESERVED_FAST_EXTENSION) and len(self.pieces) == self.piece_count:
+                writer.write(SimpleMessage(1, MESSAGE_HAVE_ALL).raw)
+            else:
+                bitfield = bytearray((self.piece_count + 7) // 8)
+                for i in self.pieces:
+                    bitfield[i >> 3] |= 0x80 >> (i & 7)
+                writer.write(BitfieldMessage(len(bitfield) + 1, MESSAGE_BITFIELD, bytes(bitfield)).raw)
+
+            tasks.append(asyncio.create_task(self._upload(writer, state)))
+            if self.choke_interval:
+                tasks.append(asyncio.create_task(self._choke_periodically(writer, state)))
+
+            while True:
+                length = struct.unpack(">I", await reader.readexactly(4))[0]
+                if not length:
+                    continue
+
+                msg = PeerConnection.create_peer_message(struct.pack(">I", length) + await reader.readexactly(length))
+                self._handle(msg, writer, state)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    def _handle(self, msg, writer, state):
+        """Handle a message of the downloading peer
+
+        Args:
+            msg: a peer message object
+            writer: the connection stream writer
+            state: the connection state dictionary
+
+        Returns:
+            None
+        """
+
+        if msg.message_type == MESSAGE_INTERESTED and state["choked"] and not state["choke_round"]:
+            state["choked"] = False
+            writer.write(SimpleMessage(1, MESSAGE_UNCHOKE).raw)
+        elif msg.message_type == MESSAGE_REQUEST:
+            if state["choked"] or msg.index not in self.pieces:
+                self._reject(msg, writer)
+            else:
+                state["requests"].put_nowait((time.monotonic() + self.latency, msg))
+        elif msg.message_type == MESSAGE_CANCEL:
+            self.cancelled_requests += 1
+            state["cancelled"].add((msg.index, msg.begin))
+        elif msg.message_type == MESSAGE_EXTENDED and self.extensions:
+            self._handle_extended(msg, writer, state)
+        elif msg.message_type in (MESSAGE_BITFIELD, MESSAGE_HAVE, MESSAGE_HAVE_ALL, MESSAGE_UNCHOKE, MESSAGE_CHOKE,
+                                  MESSAGE_PIECE, MESSAGE_REJECT):
+            self._leech(msg, writer, state)
+
+    def _leech(self, msg, writer, state):
+        """Track the pieces the downloading peer announces, request the missing ones from it once it unchokes
+        and keep the blocks it sends, counting the ones that don't match the content
+
+        Args:
+            msg: a peer message object
+            writer: the connection stream writer
+            state: the connection state dictionary
+
+        Returns:
+            None
+        """
+
+        piece_length = self._info[b"piece length"]
+
+        if msg.message_type == MESSAGE_PIECE:
+            start = msg.index * piece_length + msg.begin
+            if msg.block != self._data[start:start + len(msg.block)]:
+                self.corrupt_blocks += 1
+                return
+
+            self.downloaded_bytes += len(msg.block)
+            received = self._received.setdefault(msg.index, set())
+            received.add(msg.begin)
+            if len(received) * 2 ** 14 >= min(piece_length, len(self._data) - msg.index * piece_length):
+                self.pieces.add(msg.index)
+            return
+
+        if msg.message_type == MESSAGE_BITFIELD:
+            state["remote"].update(i for i in range(self.piece_count) if msg.bitfield[i >> 3] & (0x80 >> (i & 7)))
+        elif msg.message_type == MESSAGE_HAVE:
+            state["remote"].add(msg.piece_index)
+        elif msg.message_type == MESSAGE_HAVE_ALL:
+            state["remote"].update(range(self.piece_count))
+        elif msg.message_type in (MESSAGE_UNCHOKE, MESSAGE_CHOKE):
+            state["unchoked"] = msg.message_type == MESSAGE_UNCHOKE
+        elif msg.message_type == MESSAGE_REJECT:
+            state["requested"].discard(msg.index)
+
+        wanted = sorted(state["remote"] - self.pieces - state["requested"])
+        if wanted and not state["interested"]:
+            state["interested"] = True
+            writer.write(SimpleMessage(1, MESSAGE_INTERESTED).raw)
+
+        if not state["unchoked"]:
+            return
+
+        for index in wanted:
+            state["requested"].add(index)
+            size = min(piece_length, len(self._data) - index * piece_length)
+            for begin in range(0, size, 2 ** 14):
+                writer.write(RequestMessage(index, begin, min(2 ** 14, size - begin)).raw)
+
+    def _handle_extended(self, msg, writer, state):
+        """Handle an extension protocol message: answer the extended handshake with the pex peers and
+        metadata requests with the info dictionary pieces
+
+        Args:
+            msg: an ExtendedMessage object
+            writer: the connection stream writer
+            state: the connection state dictionary
+
+        Returns:
+            None
+        """
+
+        try:
+            payload, _ = bdecode_partial(msg.payload)
+        except Exception:
+            return
+
+        if not isinstance(payload, dict):
+            return
+
+        remote = state["extensions"]
+        if msg.extended_id == EXTENDED_HANDSHAKE_ID and isinstance(payload.get(b"m"), dict):
+            remote.update((ext, ext_id) for ext, ext_id in payload[b"m"].items() if ext_id)
+
+            peers = [address for address in self.pex_peers if ip_version(address[0]) == 4]
+            if peers and b"ut_pex" in remote:
+                pex = bencode({b"added": encode_compact_peers(peers), b"added.f": bytes(len(peers)),
+                               b"dropped": b""})
+                writer.write(ExtendedMessage(remote[b"ut_pex"], pex).raw)
+        elif msg.extended_id == Seeder.EXTENSIONS[b"ut_metadata"] and b"ut_metadata" in remote:
+            if payload.get(b"msg_type") != METADATA_REQUEST or not isinstance(payload.get(b"piece"), int):
+                return
+
+            piece = payload[b"piece"]
+            data = self._metadata[piece * METADATA_PIECE_SIZE:(piece + 1) * METADATA_PIECE_SIZE]
+            if piece < 0 or not data:
+                reply = bencode({b"msg_type": METADATA_REJECT, b"piece": piece})
+            else:
+                reply = bencode({b"msg_type": METADATA_DATA, b"piece": piece,
+                                 b"total_size": len(self._metadata)}) + data
+            writer.write(ExtendedMessage(remote[b"ut_metadata"], reply).raw)
+
+    def _reject(self, request, writer):
+        """Reject a request that won't be served, when the fast extension is on
+
+        Args:
+            request: the dropped RequestMessage
+            writer: the connection stream writer
+
+        Returns:
+            None
+        """
+
+        if self.fast:
+            writer.write(RejectMessage(request.index, request.begin, request.length).raw)
+
+    async def _upload(self, writer, state):
+        """Send the requested blocks once their latency passed, paced to the bandwidth
+
+        Args:
+            writer: the connection stream writer
+            state: the connection state dictionary
+
+        Returns:
+            None
+        """
+
+        piece_length = self._info[b"piece length"]
+        cancelled = state["cancelled"]
+
+        while True:
+            ready, request = await state["requests"].get()
+
+            delay = ready - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            key = (request.index, request.begin)
+            if key in cancelled:
+                cancelled.discard(key)
+                continue
+            if state["choked"]:
+                self._reject(request, writer)
+                continue
+
+            start = request.index * piece_length + request.begin
+            block = self._data[start:start + request.length]
+            writer.write(PieceMessage(request.index, request.begin, block, 9 + len(block), MESSAGE_PIECE).raw)
+            self.uploaded_bytes += len(block)
+
+            if self.bandwidth:
+                await asyncio.sleep(len(block) / self.bandwidth)
+            await writer.drain()
+
+    async def _choke_periodically(self, writer, state):
+        """Choke the connection every choke_interval seconds for choke_duration seconds, dropping its requests
+
+        Args:
+            writer: the connection stream writer
+            state: the connection state dictionary
+
+        Returns:
+            None
+        """
+
+        while True:
+            await asyncio.sleep(self.choke_interval)
+
+            state["choked"] = True
+            state["choke_round"] = True
+            writer.write(SimpleMessage(1, MESSAGE_CHOKE).raw)
+
+            while not state["requests"].empty():
+                self._reject(state["requests"].get_nowait()[1], writer)
+
+            await asyncio.sleep(self.choke_duration)
+
+            state["choked"] = False
+            state["choke_round"] = False
+            writer.write(SimpleMessage(1, MESSAGE_UNCHOKE).raw)
+
+
+class StandInTracker:
+    INTERVAL = 60
+
+    def __init__(self, peers=()):
+        """Initialize a stand-in HTTP tracker answering every announce with a fixed peer list
+
+        Args:
+            peers: a list of (ip, port) tuples handed to the announcing clients
+        """
+
+        self.peers = list(peers)
+        self.announces = 0
+
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening
+
+        Args:
+            host: local address to bind
+            port: local tcp port, 0 for any
+
+        Returns:
+            the announce url
+        """
+
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self.announce_url
+
+    def stop(self):
+        """Stop listening
+
+        Returns:
+            None
+        """
+
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    @property
+    def announce_url(self):
+        """The announce url clients are pointed at"""
+        ip, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{ip}:{port}/announce"
+
+    async def _serve(self, reader, writer):
+        """Answer a single announce request
+
+        Args:
+            reader: the connection stream reader
+            writer: the connection stream writer
+
+        Returns:
+            None
+        """
+
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            path = request.split(b" ")[1].decode()
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+
+            self.announces += 1
+            response = {b"interval": StandInTracker.INTERVAL}
+            if query.get("compact") == ["0"]:
+                response[b"peers"] = [{b"ip": ip.encode(), b"port": port} for ip, port in self.peers]
+            else:
+                response[b"peers"] = encode_compact_peers([peer for peer in self.peers if ip_version(peer[0]) == 4])
+                peers6 = [peer for peer in self.peers if ip_version(peer[0]) == 6]
+                if peers6:
+                    response[b"peers6"] = encode_compact_peers6(peers6)
+
+            body = bencode(response)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nConnection: close\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+
+class StandInWebSeed:
+    def __init__(self, data, torrent_dict, latency=0, ranges=True):
+        """Initialize a stand-in HTTP server serving the torrent files with range requests, as a BEP 19 web seed
+
+        Args:
+            data: the complete torrent content
+            torrent_dict: the torrent dict of the content
+            latency: seconds between receiving a request and answering it
+            ranges: answer range requests, else send the whole file like a server without range support
+        """
+
+        self.latency = latency
+        self.ranges = ranges
+        self.uploaded_bytes = 0
+        self.requests = 0
+
+        info = torrent_dict[b"info"]
+        name = info[b"name"].decode()
+        self._files = {}
+
+        if b"files" in info:
+            offset = 0
+            for file in info[b"files"]:
+                path = "/".join([name] + [p.decode() for p in file[b"path"]])
+                self._files["/" + path] = (offset, file[b"length"])
+                offset += file[b"length"]
+        else:
+            self._files["/" + name] = (0, len(data))
+
+        self._data = data
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening
+
+        Args:
+            host: local address to bind
+            port: local tcp port, 0 for any
+
+        Returns:
+            the web seed url, the root the torrent name is appended to
+        """
+
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self.url
+
+    def stop(self):
+        """Stop listening
+
+        Returns:
+            None
+        """
+
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    @property
+    def url(self):
+        """The url listed in the 'url-list' of the torrent"""
+        ip, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{ip}:{port}/"
+
+    async def _serve(self, reader, writer):
+        """Answer the GET requests of a keep-alive connection
+
+        Args:
+            reader: the connection stream reader
+            writer: the connection stream writer
+
+        Returns:
+            None
+        """
+
+        try:
+            while True:
+                request = (await reader.readuntil(b"\r\n\r\n")).decode()
+                lines = request.split("\r\n")
+                path = urllib.parse.unquote(lines[0].split(" ")[1])
+                headers = dict(line.lower().split(": ", 1) for line in lines[1:] if ": " in line)
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                if path not in self._files:
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                    continue
+
+                offset, length = self._files[path]
+                start, end = 0, length - 1
+                ranged = "range" in headers and self.ranges
+                if ranged:
+                    start, end = (int(value) for value in headers["range"][len("bytes="):].split("-"))
+
+                body = self._data[offset + start:offset + min(end, length - 1) + 1]
+                status = b"206 Partial Content" if ranged else b"200 OK"
+                writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: " + str(len(body)).encode() +
+                             b"\r\n\r\n" + body)
+                self.uploaded_bytes += len(body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+class Swarm:
+    def __init__(self, size, seeders=4, piece_length=2 ** 18, files=None, seed=0, web_seeds=0, name=b"synthetic.bin",
+                 **seeder_kwargs):
+        """Initialize a loopback swarm of stand-in seeders sharing a synthetic torrent behind a stand-in tracker
+
+        Args:
+            size: total content size in bytes
+            seeders: number of seeders
+            piece_length: the torrent piece length
+            files: optional list of file sizes for a multi-file torrent
+            seed: seed of the random content
+            web_seeds: number of stand-in web seeds listed in the 'url-list' of the torrent
+            name: the torrent name
+            **seeder_kwargs: Seeder arguments such as latency, bandwidth, choke_interval and fast
+        """
+
+        self.data, self.torrent_dict = synthetic_torrent(size, piece_length, name, files, seed)
+        self.seeders = [Seeder(self.data, self.torrent_dict, **seeder_kwargs) for _ in range(seeders)]
+        self.web_seeds = [StandInWebSeed(self.data, self.torrent_dict) for _ in range(web_seeds)]
+        self.tracker = StandInTracker()
+
+    async def start(self):
+        """Start the seeders, the web seeds and the tracker and point the torrent at them
+
+        Returns:
+            None
+        """
+
+        self.tracker.peers = [await seeder.start() for seeder in self.seeders]
+        self.torrent_dict[b"announce"] = (await self.tracker.start()).encode()
+
+        if self.web_seeds:
+            self.torrent_dict[b"url-list"] = [(await web_seed.start()).encode() for web_seed in self.web_seeds]
+
+    def stop(self):
+        """Stop the seeders and the tracker
+
+        Returns:
+            None
+        """
+
+        for seeder in self.seeders:
+            seeder.stop()
+        for web_seed in self.web_seeds:
+            web_seed.stop()
+        self.tracker.stop()
+
+    @property
+    def uploaded_bytes(self):
+        """Total bytes the seeders and the web seeds uploaded"""
+        return sum(seeder.uploaded_bytes for seeder in self.seeders + self.web_seeds)
+
+    def write_torrent(self, path):
+        """Save the torrent file, start() must be called first so it announces to the stand-in tracker
+
+        Args:
+            path: the *.torrent file path
+
+        Returns:
+            None
+        """
+
+        with open(path, "wb") as f:
+            f.write(bencode(self.torrent_dict))
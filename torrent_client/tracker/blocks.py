@@ -1,3 +1,37 @@
+# file and piece priorities
+PRIORITY_SKIP = 0
+PRIORITY_LOW = 1
+PRIORITY_NORMAL = 2
+PRIORITY_HIGH = 3
+PRIORITY_NAMES = {"skip": PRIORITY_SKIP, "low": PRIORITY_LOW, "normal": PRIORITY_NORMAL, "high": PRIORITY_HIGH}
+
+
+def piece_priorities(file_lengths, piece_length, file_priorities):
+    """Map file priorities to piece priorities. A piece shared by several files gets the highest of their priorities,
+    so a boundary piece of a skipped file is still downloaded for the wanted file next to it
+
+    Args:
+        file_lengths: the file lengths in torrent order
+        piece_length: the torrent piece length
+        file_priorities: a priority per file
+
+    Returns:
+        a list of priorities, one per piece
+    """
+
+    priorities = [PRIORITY_SKIP] * -(-sum(file_lengths) // piece_length)
+    offset = 0
+
+    for length, priority in zip(file_lengths, file_priorities):
+        if length:
+            for piece in range(offset // piece_length, (offset + length - 1) // piece_length + 1):
+                priorities[piece] = max(priorities[piece], priority)
+
+        offset += length
+
+    return priorities
+
+
 class Block:
     BLOCK_SIZE = 2 ** 14
 
@@ -16,6 +50,10 @@ class Block:
 
 
 class BlockManager:
+    STREAM_WINDOW = 16
+    URGENT_PIECES = 2
+    MAX_URGENT_REQUESTS = 3
+
     def __init__(self, torrent):
         """Initialize a block manager
 
@@ -30,6 +68,10 @@ class BlockManager:
             raise Exception("invalid piece length")
 
         self._blocks = []
+        self._requested = {}
+        self._skipped = []
+        self._priorities = None
+        self.deadline = None
 
         for offset in range(0, self.file_size, Block.BLOCK_SIZE):
             block = Block(offset // self.piece_length,
@@ -69,11 +111,44 @@ class BlockManager:
             None
         """
 
-        if block not in self._blocks:
-            self._blocks.append(block)
-        else:
+        if block in self._blocks:
             raise Exception("block already exists")
 
+        if self._priorities is None:
+            self._blocks.append(block)
+            return
+
+        priority = self._priorities[block.index]
+        if priority == PRIORITY_SKIP:
+            self._skipped.append(block)
+            return
+
+        for i, pending in enumerate(self._blocks):
+            if self._priorities[pending.index] < priority:
+                self._blocks.insert(i, block)
+                return
+
+        self._blocks.append(block)
+
+    def set_priorities(self, priorities):
+        """Set the piece priorities. Pending blocks are handed out by decreasing priority
+        and blocks of skipped pieces are set aside until their piece is wanted again
+
+        Args:
+            priorities: a list of PRIORITY_* values, one per piece
+
+        Returns:
+            None
+        """
+
+        blocks = self._blocks + self._skipped
+        blocks.sort(key=lambda block: (block.index, block.begin))
+
+        self._priorities = list(priorities)
+        self._skipped = [block for block in blocks if self._priorities[block.index] == PRIORITY_SKIP]
+        self._blocks = sorted((block for block in blocks if self._priorities[block.index] != PRIORITY_SKIP),
+                              key=lambda block: -self._priorities[block.index])
+
     def extend_blocks(self, blocks):
         """Add multiple blocks to the blocks to be downloaded
 
@@ -87,11 +162,185 @@ class BlockManager:
         for block in blocks:
             self.add_block(block)
 
+    def next_for(self, peer, pieces=None):
+        """Pop the next block the peer can serve and mark it as requested by it.
+        Once every remaining block is already requested the manager is in endgame mode,
+        and blocks requested from other peers are handed out again as duplicates.
+        When a deadline piece is set, blocks close to it are picked first
+
+        Args:
+            peer: the peer object that is about to request a block
+            pieces: an optional collection of piece indexes the block must belong to
+
+        Returns:
+            a block to be downloaded from the peer, None if the peer has nothing to offer
+        """
+
+        if self.deadline is not None:
+            block = self._next_streaming(peer, pieces)
+            if block is not None:
+                return block
+
+        for i, block in enumerate(self._blocks):
+            if block.index in peer.available_pieces and (pieces is None or block.index in pieces):
+                del self._blocks[i]
+                self._requested[(block.index, block.begin)] = (block, [peer])
+                return block
+
+        if self._blocks:
+            return None
+
+        for block, peers in self._requested.values():
+            if peer not in peers and block.index in peer.available_pieces:
+                peers.append(peer)
+                return block
+
+        return None
+
+    def next_span_for(self, peer, size, pieces=None):
+        """Pop a run of pending blocks that are contiguous in the torrent content, starting with the block
+        next_for() picks, and mark them as requested by the peer. Used by sources that fetch byte ranges
+
+        Args:
+            peer: the source object that is about to request the blocks
+            size: maximal number of bytes in the run
+            pieces: an optional collection of piece indexes the blocks must belong to
+
+        Returns:
+            a list of blocks, empty if the source has nothing to offer
+        """
+
+        block = self.next_for(peer, pieces)
+        if block is None:
+            return []
+
+        span = [block]
+        total = block.length
+        positions = {(pending.index, pending.begin): i for i, pending in enumerate(self._blocks)}
+        taken = set()
+
+        while total < size:
+            last = span[-1]
+            if last.begin + last.length < self.piece_length:
+                key = (last.index, last.begin + last.length)
+            else:
+                key = (last.index + 1, 0)
+
+            i = positions.get(key)
+            if i is None:
+                break
+
+            pending = self._blocks[i]
+            if (pending.index not in peer.available_pieces or (pieces is not None and pending.index not in pieces) or
+                    total + pending.length > size):
+                break
+
+            taken.add(i)
+            self._requested[key] = (pending, [peer])
+            span.append(pending)
+            total += pending.length
+
+        if taken:
+            self._blocks[:] = [pending for i, pending in enumerate(self._blocks) if i not in taken]
+
+        return span
+
+    def _next_streaming(self, peer, pieces=None):
+        """Pick a block for streaming: the earliest pending block within STREAM_WINDOW pieces of the deadline
+        piece, else a block of the first URGENT_PIECES pieces that is already requested from other peers
+
+        Args:
+            peer: the peer object that is about to request a block
+            pieces: an optional collection of piece indexes the block must belong to
+
+        Returns:
+            a block to be downloaded from the peer, None if the peer has no block in the window
+        """
+
+        deadline = self.deadline
+        best = None
+
+        for i, block in enumerate(self._blocks):
+            if (deadline <= block.index < deadline + BlockManager.STREAM_WINDOW and block.index in peer.available_pieces
+                    and (pieces is None or block.index in pieces)):
+                if best is None or (block.index, block.begin) < (self._blocks[best].index, self._blocks[best].begin):
+                    best = i
+
+        if best is not None:
+            block = self._blocks.pop(best)
+            self._requested[(block.index, block.begin)] = (block, [peer])
+            return block
+
+        for block, peers in self._requested.values():
+            if (deadline <= block.index < deadline + BlockManager.URGENT_PIECES and peer not in peers and
+                    len(peers) < BlockManager.MAX_URGENT_REQUESTS and block.index in peer.available_pieces):
+                peers.append(peer)
+                return block
+
+        return None
+
+    def complete(self, block, peer):
+        """Mark a requested block as downloaded
+
+        Args:
+            block: the downloaded block
+            peer: the peer that delivered the block
+
+        Returns:
+            a list of the other peers the block is still requested from,
+            None if the block was already delivered by another peer
+        """
+
+        requested = self._requested.pop((block.index, block.begin), None)
+        if requested is None:
+            return None
+
+        return [other for other in requested[1] if other is not peer]
+
+    def release(self, block, peer):
+        """Drop a failed request and put the block back to be downloaded if no other peer is fetching it
+
+        Args:
+            block: the block that wasn't downloaded
+            peer: the peer the block was requested from
+
+        Returns:
+            None
+        """
+
+        requested = self._requested.get((block.index, block.begin))
+        if requested is None:
+            return
+
+        if peer in requested[1]:
+            requested[1].remove(peer)
+
+        if not requested[1]:
+            del self._requested[(block.index, block.begin)]
+            self.add_block(requested[0])
+
+    def release_all(self):
+        """Put every requested block back to be downloaded, used when a download is stopped
+
+        Returns:
+            None
+        """
+
+        for block, _ in list(self._requested.values()):
+            self.add_block(block)
+
+        self._requested.clear()
+
+    @property
+    def in_endgame(self):
+        """True if every remaining block is already requested from some peer"""
+        return not self._blocks and bool(self._requested)
+
     def empty(self):
         """Check if block pool is empty
 
         Returns:
-            True if any blocks are left, else False
+            True if no blocks of wanted pieces are left to be downloaded or waiting for a peer, else False
         """
 
-        return self._blocks == []
+        return self._blocks == [] and not self._requested
@@ -0,0 +1,93 @@
+import asyncio
+
+
+class BufferPool:
+    BUDGET = 128 * 2 ** 20
+
+    def __init__(self, budget=BUDGET):
+        """Initialize a pool of reusable piece buffers shared by the torrents of a session. A buffer holds a piece
+        from its first block until it is written to disk, so the buffers in use cover the partial pieces, the
+        pieces being hashed and the disk queue. Released buffers are kept for reuse as long as the buffers in use
+        and the free ones fit in the budget
+
+        Args:
+            budget: bytes of piece buffers above which no new piece is started
+        """
+
+        self.budget = budget
+        self.in_use = 0
+
+        self._free = {}
+        self._free_bytes = 0
+        self._waiters = []
+
+    @property
+    def full(self):
+        """True if the buffers in use reached the budget"""
+        return self.in_use >= self.budget
+
+    def acquire(self, size):
+        """Take a buffer of a given size, reusing a released one if possible. Never refuses,
+        callers check full before starting a new piece
+
+        Args:
+            size: the buffer size in bytes
+
+        Returns:
+            a bytearray of the given size, its content is undefined
+        """
+
+        free = self._free.get(size)
+        if free:
+            buffer = free.pop()
+            self._free_bytes -= size
+        else:
+            buffer = bytearray(size)
+
+        self.in_use += size
+        return buffer
+
+    def release(self, buffer):
+        """Give a buffer back to the pool and wake the downloads waiting for memory
+
+        Args:
+            buffer: a bytearray returned by acquire()
+
+        Returns:
+            None
+        """
+
+        self.in_use -= len(buffer)
+
+        if self.in_use + self._free_bytes + len(buffer) <= self.budget:
+            self._free.setdefault(len(buffer), []).append(buffer)
+            self._free_bytes += len(buffer)
+
+        if not self.full:
+            for waiter in self._waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._waiters = []
+
+    async def wait(self, timeout=None):
+        """Wait until the buffers in use are under the budget
+
+        Args:
+            timeout: optional timeout in seconds
+
+        Returns:
+            True if there is room for a new piece, False on timeout
+        """
+
+        if not self.full:
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
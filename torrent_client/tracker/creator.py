@@ -0,0 +1,220 @@
+from bencode.encode import bencode
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+import bisect
+import mmap
+import time
+import os
+
+# bounds and target of the automatic piece length
+MIN_PIECE_LENGTH = 2 ** 15
+MAX_PIECE_LENGTH = 2 ** 24
+TARGET_PIECES = 1500
+
+# bytes hashed by a single pool task
+BATCH_BYTES = 2 ** 26
+
+CREATED_BY = b"torrent_client"
+
+
+def piece_length_for(size):
+    """Pick a piece length for a content size: the power of two giving about TARGET_PIECES pieces,
+    within MIN_PIECE_LENGTH and MAX_PIECE_LENGTH
+
+    Args:
+        size: total content size in bytes
+
+    Returns:
+        the piece length in bytes
+    """
+
+    piece_length = MIN_PIECE_LENGTH
+    while piece_length < MAX_PIECE_LENGTH and size / piece_length > TARGET_PIECES:
+        piece_length *= 2
+
+    return piece_length
+
+
+def collect_files(path):
+    """List the files of a torrent created from a file or a directory. Directories are walked in sorted order
+
+    Args:
+        path: a file or directory path
+
+    Returns:
+        a list of (file path, list of path components relative to the torrent root, length) tuples
+    """
+
+    if os.path.isfile(path):
+        return [(path, [os.path.basename(path)], os.path.getsize(path))]
+
+    if not os.path.isdir(path):
+        raise Exception(f"{path} is neither a file nor a directory")
+
+    files = []
+    for root, directories, names in os.walk(path):
+        directories.sort()
+
+        for name in sorted(names):
+            file_path = os.path.join(root, name)
+            if os.path.isfile(file_path):
+                relative = os.path.relpath(file_path, path).split(os.sep)
+                files.append((file_path, relative, os.path.getsize(file_path)))
+
+    if not files:
+        raise Exception(f"{path} has no files")
+
+    return files
+
+
+def hash_pieces(files, piece_length, workers=None):
+    """Hash the pieces of the content formed by files laid back to back. Batches of pieces are hashed on a thread
+    pool, hashlib releases the GIL so the threads use every core. A batch maps the files it covers into memory
+    and closes them once hashed, so the open files and the mapped address space stay bounded
+
+    Args:
+        files: a list of (path, length) tuples in torrent order
+        piece_length: the piece length
+        workers: number of hashing threads, the number of CPUs by default
+
+    Returns:
+        the concatenated 20-byte SHA1 digests of the pieces
+    """
+
+    # the files holding data and their offsets in the content
+    mapped = []
+    starts = []
+    total = 0
+
+    for path, length in files:
+        if length:
+            mapped.append((path, length))
+            starts.append(total)
+        total += length
+
+    batch = max(1, BATCH_BYTES // piece_length)
+    count = -(-total // piece_length)
+
+    def hash_batch(first):
+        low = bisect.bisect_right(starts, first * piece_length) - 1
+        high = bisect.bisect_left(starts, min((first + batch) * piece_length, total))
+        maps = []
+        views = {}
+
+        try:
+            for i in range(low, high):
+                path, length = mapped[i]
+                with open(path, "rb") as f:
+                    maps.append(mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ))
+                views[i] = memoryview(maps[-1])
+
+            digests = []
+
+            for index in range(first, min(first + batch, count)):
+                offset = index * piece_length
+                end = min(offset + piece_length, total)
+                piece = sha1()
+
+                i = bisect.bisect_right(starts, offset) - 1
+                while offset < end:
+                    view = views[i]
+                    position = offset - starts[i]
+                    size = min(end - offset, len(view) - position)
+
+                    piece.update(view[position:position + size])
+                    offset += size
+                    i += 1
+
+                digests.append(piece.digest())
+
+            return b"".join(digests)
+        finally:
+            for view in views.values():
+                view.release()
+            for m in maps:
+                m.close()
+
+    with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+        return b"".join(executor.map(hash_batch, range(0, count, batch)))
+
+
+def create_torrent(path, announce, piece_length=None, url_list=(), comment=None, private=False, workers=None):
+    """Create the torrent dict of a file or a directory
+
+    Args:
+        path: a file or directory path
+        announce: the tracker announce url
+        piece_length: the piece length, picked by piece_length_for() if not given
+        url_list: web seed urls (BEP 19)
+        comment: an optional comment
+        private: mark the torrent private, so clients only use the tracker to find peers
+        workers: number of hashing threads, the number of CPUs by default
+
+    Returns:
+        a torrent dict ready to be bencoded, its keys in sorted order
+    """
+
+    files = collect_files(path)
+    size = sum(length for _, _, length in files)
+
+    piece_length = piece_length or piece_length_for(size)
+    if piece_length % 2 ** 14 != 0:
+        raise Exception("the piece length must be a multiple of 16 KiB")
+
+    info = {
+        b"name": os.path.basename(os.path.normpath(path)).encode(),
+        b"piece length": piece_length,
+        b"pieces": hash_pieces([(file_path, length) for file_path, _, length in files], piece_length, workers),
+    }
+
+    if os.path.isdir(path):
+        info[b"files"] = [{b"length": length, b"path": [p.encode() for p in relative]}
+                          for _, relative, length in files]
+    else:
+        info[b"length"] = size
+
+    if private:
+        info[b"private"] = 1
+
+    torrent_dict = {b"announce": announce.encode(), b"info": info,
+                    b"created by": CREATED_BY, b"creation date": int(time.time())}
+
+    if url_list:
+        torrent_dict[b"url-list"] = [url.encode() for url in url_list]
+    if comment:
+        torrent_dict[b"comment"] = comment.encode()
+
+    return _sort_keys(torrent_dict)
+
+
+def write_torrent(torrent_dict, path):
+    """Save a torrent dict as a *.torrent file, with the dictionary keys in sorted order as the specification requires
+
+    Args:
+        torrent_dict: the torrent dict
+        path: the *.torrent file path
+
+    Returns:
+        None
+    """
+
+    with open(path, "wb") as f:
+        f.write(bencode(_sort_keys(torrent_dict)))
+
+
+def _sort_keys(value):
+    """Order the keys of every dictionary within a value as raw strings
+
+    Args:
+        value: a bencodable python value
+
+    Returns:
+        the value with its dictionaries rebuilt in sorted key order
+    """
+
+    if isinstance(value, dict):
+        return {key: _sort_keys(value[key]) for key in sorted(value)}
+    elif isinstance(value, list):
+        return [_sort_keys(item) for item in value]
+
+    return value
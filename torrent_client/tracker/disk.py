@@ -0,0 +1,542 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+import asyncio
+import time
+import os
+
+# largest number of buffers handed to a single pwritev call
+IOV_MAX = 1024
+
+# serializes seek and write on platforms without pwrite and pread
+_SEEK_LOCK = threading.Lock()
+
+# file allocation modes
+ALLOCATE_NONE = "none"
+ALLOCATE_SPARSE = "sparse"
+ALLOCATE_FULL = "full"
+ALLOCATION_MODES = (ALLOCATE_NONE, ALLOCATE_SPARSE, ALLOCATE_FULL)
+
+ZERO_CHUNK = 2 ** 20
+
+
+class DiskPool:
+    WORKERS = 2
+    BUDGET = 64 * 2 ** 20
+    FLUSH_INTERVAL = 0.05
+    COALESCE_BYTES = 4 * 2 ** 20
+
+    def __init__(self, workers=WORKERS, budget=BUDGET, flush_interval=FLUSH_INTERVAL, fsync_interval=None):
+        """Initialize a pool of disk I/O threads shared by the torrents of a session
+
+        Args:
+            workers: number of I/O threads
+            budget: bytes queued or being written above which downloads wait for the disk
+            flush_interval: seconds queued writes are held so contiguous ones can be merged
+            fsync_interval: seconds between fsync calls of a file being written, 0 to fsync after
+                every write and None to fsync only when a torrent completes
+        """
+
+        self.workers = workers
+        self.budget = budget
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.backlog = 0
+
+        self._executor = None
+        self._waiters = []
+
+    def run(self, func, *args, size=0):
+        """Run a blocking I/O function on a pool thread
+
+        Args:
+            func: the function to be run
+            *args: the function arguments
+            size: bytes the call writes, counted in the backlog until it returns
+
+        Returns:
+            an asyncio future of the function result
+        """
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="disk")
+
+        self.backlog += size
+        fut = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+        if size:
+            fut.add_done_callback(lambda _: self._written(size))
+
+        return fut
+
+    def _written(self, size):
+        """Take finished bytes off the backlog and wake the downloads waiting for the disk
+
+        Args:
+            size: bytes written
+
+        Returns:
+            None
+        """
+
+        self.backlog -= size
+
+        if self.backlog <= self.budget:
+            for waiter in self._waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._waiters = []
+
+    def reserve(self, size):
+        """Count bytes that are queued but not yet handed to a thread in the backlog
+
+        Args:
+            size: number of bytes
+
+        Returns:
+            None
+        """
+
+        self.backlog += size
+
+    def release(self, size):
+        """Take bytes counted by reserve() off the backlog again
+
+        Args:
+            size: number of bytes
+
+        Returns:
+            None
+        """
+
+        self._written(size)
+
+    async def drain(self):
+        """Wait while the backlog is over the byte budget, so a slow disk throttles the download
+
+        Returns:
+            None
+        """
+
+        while self.backlog > self.budget:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def shutdown(self):
+        """Stop the I/O threads once they are idle
+
+        Returns:
+            None
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+class TorrentFiles:
+    def __init__(self, files, pool):
+        """Initialize the files of a torrent, written through a disk pool
+
+        Args:
+            files: a list of (path, length) tuples in torrent order
+            pool: the DiskPool doing the I/O
+        """
+
+        self.files = files
+        self.wanted = [True] * len(files)
+        self._pool = pool
+
+        self._fds = None
+        self._opened = False
+        self._queue = []
+        self._queued = 0
+        self._flush_handle = None
+        self._pending = set()
+        self._error = None
+
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._last_sync = time.monotonic()
+
+    def open(self):
+        """Create the directories and open every wanted file for writing, keeping existing content
+
+        Returns:
+            None
+        """
+
+        if self._opened:
+            return
+
+        if self._fds is None:
+            self._fds = [None] * len(self.files)
+
+        for i, (path, _) in enumerate(self.files):
+            if not self.wanted[i] or self._fds[i] is not None:
+                continue
+
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._fds[i] = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+
+        self._opened = True
+
+    def set_wanted(self, wanted):
+        """Choose the files that are created and written. Writes to the other files are dropped, even if they
+        were opened or allocated while wanted, so pieces shared with a wanted file only land in the wanted file
+
+        Args:
+            wanted: a list of booleans, one per file
+
+        Returns:
+            None
+        """
+
+        self.wanted = list(wanted)
+        self._opened = False
+
+    async def allocate(self, mode):
+        """Create the files and size them up front on a pool thread
+
+        Args:
+            mode: ALLOCATE_SPARSE to extend the files without writing, ALLOCATE_FULL to reserve their
+                blocks on disk or ALLOCATE_NONE to create them only when the first piece is written
+
+        Returns:
+            None
+        """
+
+        if mode not in ALLOCATION_MODES:
+            raise Exception(f"unknown allocation mode {mode}")
+
+        if mode == ALLOCATE_NONE:
+            return
+
+        self.open()
+        await self._pool.run(self._allocate, mode)
+
+    def _allocate(self, mode):
+        """Size every file on a pool thread, keeping existing content
+
+        Args:
+            mode: ALLOCATE_SPARSE or ALLOCATE_FULL
+
+        Returns:
+            None
+        """
+
+        for fd, wanted, (_, length) in zip(self._fds, self.wanted, self.files):
+            if fd is None or not wanted:
+                continue
+
+            size = os.fstat(fd).st_size
+
+            if mode == ALLOCATE_FULL and hasattr(os, "posix_fallocate") and length:
+                os.posix_fallocate(fd, 0, length)
+            elif mode == ALLOCATE_FULL:
+                for position in range(size, length, ZERO_CHUNK):
+                    _write_at(fd, [bytes(min(ZERO_CHUNK, length - position))], position)
+            elif size < length:
+                os.ftruncate(fd, length)
+
+    def write(self, offset, data, on_written=None):
+        """Queue data to be written at an offset of the torrent content. Queued writes are merged
+        into contiguous runs and handed to the pool after flush_interval or once COALESCE_BYTES are queued
+
+        Args:
+            offset: the offset in the torrent content
+            data: bytes to be written
+            on_written: optional callback called on the loop once the data is written
+
+        Returns:
+            None
+        """
+
+        if self._error is not None:
+            raise self._error
+
+        self.open()
+
+        self._queue.append((offset, data, on_written))
+        self._queued += len(data)
+        self._pool.reserve(len(data))
+
+        if self._queued >= DiskPool.COALESCE_BYTES:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self._pool.flush_interval, self.flush)
+
+    def flush(self):
+        """Hand the queued writes to the pool, merged into contiguous runs
+
+        Returns:
+            None
+        """
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._queue:
+            return
+
+        queue, queued = sorted(self._queue, key=lambda item: item[0]), self._queued
+        self._queue, self._queued = [], 0
+
+        runs = []
+        for offset, data, on_written in queue:
+            if not (runs and runs[-1][0] + runs[-1][1] == offset and len(runs[-1][2]) < IOV_MAX):
+                runs.append([offset, 0, [], []])
+
+            runs[-1][1] += len(data)
+            runs[-1][2].append(data)
+            if on_written is not None:
+                runs[-1][3].append(on_written)
+
+        for offset, size, buffers, callbacks in runs:
+            fut = self._pool.run(self._write_run, offset, buffers, size=size)
+            self._pending.add(fut)
+            fut.add_done_callback(functools.partial(self._written, callbacks))
+
+        self._pool.release(queued)
+
+    def _written(self, callbacks, fut):
+        """Call the callbacks of a written run, or keep the first write error so the next call reports it
+
+        Args:
+            callbacks: the on_written callbacks of the run
+            fut: the finished write future
+
+        Returns:
+            None
+        """
+
+        self._pending.discard(fut)
+
+        if fut.cancelled():
+            return
+
+        if fut.exception() is not None:
+            if self._error is None:
+                self._error = fut.exception()
+            return
+
+        for callback in callbacks:
+            callback()
+
+    async def close(self):
+        """Write everything queued, fsync and close the files
+
+        Returns:
+            None
+        """
+
+        self.flush()
+
+        if self._pending:
+            await asyncio.wait(set(self._pending))
+
+        if self._fds is not None:
+            fds, self._fds = self._fds, None
+            self._opened = False
+            await self._pool.run(self._sync_and_close, fds)
+
+        if self._error is not None:
+            raise self._error
+
+    async def read(self, offset, length):
+        """Read a range of the torrent content from the opened files on a pool thread
+
+        Args:
+            offset: the offset in the torrent content
+            length: the range length
+
+        Returns:
+            the bytes read, None if a file of the range isn't open
+        """
+
+        fds = self._fds
+        if fds is None or any(fds[i] is None for i, _, _ in self.ranges(offset, length)):
+            return None
+
+        return await self._pool.run(self._read_range, fds, offset, length)
+
+    def _read_range(self, fds, offset, length):
+        """Read a range of the torrent content on a pool thread
+
+        Args:
+            fds: the file descriptors of the torrent files
+            offset: the offset in the torrent content
+            length: the range length
+
+        Returns:
+            the bytes read
+        """
+
+        return b"".join(read_at(fds[i], size, position) for i, position, size in self.ranges(offset, length))
+
+    def ranges(self, offset, length):
+        """Split a range of the torrent content along the file boundaries
+
+        Args:
+            offset: the offset in the torrent content
+            length: the range length
+
+        Returns:
+            a list of (file index, file offset, length) tuples
+        """
+
+        ranges = []
+        file_start = 0
+        end = offset + length
+
+        for i, (_, file_length) in enumerate(self.files):
+            file_end = file_start + file_length
+
+            if offset < file_end and end > file_start and file_length:
+                start = max(offset, file_start)
+                ranges.append((i, start - file_start, min(end, file_end) - start))
+
+            file_start = file_end
+
+        if end > file_start or offset < 0:
+            raise Exception("range out of the torrent content")
+
+        return ranges
+
+    def _segments(self, offset, buffers):
+        """Split buffers written back to back at a torrent offset along the file boundaries
+
+        Args:
+            offset: the offset in the torrent content
+            buffers: a list of bytes objects
+
+        Returns:
+            a list of (file index, file offset, list of memoryviews) tuples
+        """
+
+        views = [memoryview(buffer) for buffer in buffers]
+        segments = []
+
+        for i, position, length in self.ranges(offset, sum(len(view) for view in views)):
+            chunk = []
+
+            while length:
+                view = views.pop(0)
+                if len(view) > length:
+                    views.insert(0, view[length:])
+                    view = view[:length]
+
+                chunk.append(view)
+                length -= len(view)
+
+            segments.append((i, position, chunk))
+
+        return segments
+
+    def _write_run(self, offset, buffers):
+        """Write a contiguous run on a pool thread
+
+        Args:
+            offset: the offset in the torrent content
+            buffers: a list of bytes objects written back to back
+
+        Returns:
+            None
+        """
+
+        for i, position, chunk in self._segments(offset, buffers):
+            if self._fds[i] is None or not self.wanted[i]:
+                continue
+
+            _write_at(self._fds[i], chunk, position)
+
+            with self._lock:
+                self._dirty.add(i)
+
+        interval = self._pool.fsync_interval
+        if interval is None:
+            return
+
+        with self._lock:
+            if time.monotonic() - self._last_sync < interval:
+                return
+
+            dirty, self._dirty = self._dirty, set()
+            self._last_sync = time.monotonic()
+
+        for i in dirty:
+            os.fsync(self._fds[i])
+
+    def _sync_and_close(self, fds):
+        """fsync and close file descriptors on a pool thread
+
+        Args:
+            fds: the file descriptors
+
+        Returns:
+            None
+        """
+
+        for fd in fds:
+            if fd is not None:
+                os.fsync(fd)
+                os.close(fd)
+
+
+def _write_at(fd, buffers, position):
+    """Write buffers at a file position with pwritev, falling back to pwrite or seek and write
+
+    Args:
+        fd: a file descriptor
+        buffers: a list of bytes-like objects
+        position: the file position
+
+    Returns:
+        None
+    """
+
+    if hasattr(os, "pwritev"):
+        written = os.pwritev(fd, buffers, position)
+        total = sum(len(buffer) for buffer in buffers)
+        if written == total:
+            return
+
+        buffers, position = [b"".join(buffers)[written:]], position + written
+
+    data = memoryview(b"".join(buffers))
+
+    while data:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, data, position)
+        else:
+            with _SEEK_LOCK:
+                os.lseek(fd, position, os.SEEK_SET)
+                written = os.write(fd, data)
+
+        data = data[written:]
+        position += written
+
+
+def read_at(fd, length, position):
+    """Read from a file position with pread, falling back to seek and read
+
+    Args:
+        fd: a file descriptor
+        length: number of bytes
+        position: the file position
+
+    Returns:
+        the bytes read
+    """
+
+    if hasattr(os, "pread"):
+        return os.pread(fd, length, position)
+
+    with _SEEK_LOCK:
+        os.lseek(fd, position, os.SEEK_SET)
+        return os.read(fd, length)
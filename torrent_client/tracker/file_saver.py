@@ -1,33 +1,173 @@
-from .blocks import Block
-import math
+from .blocks import Block, PRIORITY_SKIP
+from .disk import DiskPool, TorrentFiles, ALLOCATE_SPARSE
+from .buffers import BufferPool
 from hashlib import sha1
 from .torrent import SingleFileTorrent, MultiFileTorrent
+import functools
+import threading
+import asyncio
+import time
 import os
 
 
 class FileSaver:
-    def __init__(self, torrent, progress_bar):
+    def __init__(self, torrent, stats, download_dir=".", disk_pool=None, allocation=ALLOCATE_SPARSE,
+                 buffer_pool=None, on_written=None):
         """Initialize a file saver class instance
 
         Args:
             torrent: a torrent object that represents the metainfo file
-            progress_bar: a gui progress bar to be updated as blocks are downloaded
+            stats: a TorrentStats object whose byte counters are updated as blocks are downloaded
+            download_dir: the directory the torrent files are saved in
+            disk_pool: an optional DiskPool shared by several torrents, a private one is used if not given
+            allocation: the file allocation mode, one of the disk.ALLOCATE_* modes
+            buffer_pool: an optional BufferPool shared by several torrents, a private one is used if not given
+            on_written: an optional callback taking the index of every piece written to disk whole,
+                so it can be uploaded
         """
 
         self._torrent = torrent
-        self._progress_bar = progress_bar
-        self._downloaded = []
-        self._blocks = []
+        self._download_dir = download_dir
+        self._stats = stats
+        self._stats.total_bytes = torrent.length
+
+        self._owns_pool = disk_pool is None
+        self._pool = disk_pool or DiskPool()
+        self._files = TorrentFiles(self._file_layout(), self._pool)
+        self._allocation = allocation
+        self._allocated = False
+        self._buffers = buffer_pool or BufferPool()
+        self._on_written = on_written
+
+        self._pieces = {}
+        self._hashing = {}
+        self._failed = []
+        self._partial = set()
+        self.verified = set()
+        self.written = set()
+        self._written_changed = threading.Condition()
+
+    def _file_layout(self):
+        """The paths and lengths of the torrent files
 
-        for offset in range(0, torrent.length, Block.BLOCK_SIZE):
-            block = Block(offset // torrent.piece_length,
-                          offset % torrent.piece_length,
-                          Block.BLOCK_SIZE if offset + Block.BLOCK_SIZE < torrent.length else torrent.length - offset)
+        Returns:
+            a list of (path, length) tuples in torrent order
+        """
+
+        if isinstance(self._torrent, SingleFileTorrent):
+            return [(os.path.join(self._download_dir, self._torrent.file_name), self._torrent.length)]
+        elif isinstance(self._torrent, MultiFileTorrent):
+            return [(os.path.join(self._download_dir, self._torrent.file_name, *[p.decode() for p in file[b'path']]),
+                     file[b"length"]) for file in self._torrent.files]
+        else:
+            raise TypeError("torrent object must be SingleFileTorrent or MultiFileTorrent")
+
+    def piece_size(self, index):
+        """The size of a piece, only the last piece may be shorter than the piece length
+
+        Args:
+            index: the piece index
+
+        Returns:
+            the piece size in bytes
+        """
+
+        return min(self._torrent.piece_length, self._torrent.length - index * self._torrent.piece_length)
+
+    def _piece_range(self, index):
+        """The range of a piece in the torrent content
+
+        Args:
+            index: the piece index
+
+        Returns:
+            an (offset, length) tuple
+        """
+
+        return index * self._torrent.piece_length, self.piece_size(index)
+
+    def set_priorities(self, priorities, wanted):
+        """Apply new piece priorities and choose the files written to disk. Pieces that were
+        written while a file they share was skipped are forgotten once that file is wanted again
+
+        Args:
+            priorities: a list of PRIORITY_* values, one per piece
+            wanted: a list of booleans, one per file
+
+        Returns:
+            a list of blocks to be downloaded again
+        """
+
+        self._files.set_wanted(wanted)
+        self._allocated = False
+        self._stats.total_bytes = sum(self.piece_size(i) for i, priority in enumerate(priorities)
+                                      if priority != PRIORITY_SKIP)
 
-            self._blocks.append(block)
+        blocks = []
+        for index in sorted(self._partial):
+            if all(wanted[i] for i, _, _ in self._files.ranges(*self._piece_range(index))):
+                self._partial.discard(index)
+                self.verified.discard(index)
+                with self._written_changed:
+                    self.written.discard(index)
 
-    def append(self, block):
-        """Append a downloaded block to the downloaded pool and update the gui progress bar
+                size = self.piece_size(index)
+                self._stats.downloaded_bytes -= size
+                blocks.extend(Block(index, begin, min(Block.BLOCK_SIZE, size - begin))
+                              for begin in range(0, size, Block.BLOCK_SIZE))
+
+        return blocks
+
+    @property
+    def started(self):
+        """The indexes of the pieces being assembled, they hold a buffer from their first request until verified"""
+        return self._pieces.keys()
+
+    @property
+    def memory_full(self):
+        """True if the piece buffers reached the memory budget, so no new piece should be started"""
+        return self._buffers.full
+
+    async def wait_for_memory(self, timeout=None):
+        """Wait until a new piece can be started
+
+        Args:
+            timeout: optional timeout in seconds
+
+        Returns:
+            True if the piece buffers are under the memory budget, False on timeout
+        """
+
+        return await self._buffers.wait(timeout)
+
+    def start(self, index):
+        """Take a buffer for a piece about to be requested, unless it has one
+
+        Args:
+            index: the piece index
+
+        Returns:
+            None
+        """
+
+        if index not in self._pieces and index not in self._hashing and index not in self.verified:
+            self._pieces[index] = (self._buffers.acquire(self.piece_size(index)), {})
+
+    def release_unused(self):
+        """Give back the buffers of started pieces that didn't receive any block yet
+
+        Returns:
+            None
+        """
+
+        for index in [index for index, (_, blocks) in self._pieces.items() if not blocks]:
+            buffer, _ = self._pieces.pop(index)
+            self._buffers.release(buffer)
+
+    async def append(self, block):
+        """Copy a downloaded block into the buffer of its piece and count its bytes. Once its piece is complete
+        the piece is hashed on a disk pool thread, then queued to be written to disk or its blocks are kept for
+        get_failed_blocks(). The call returns once the piece is settled, even if the caller is cancelled meanwhile
 
         Args:
             block: a downloaded block to be appended
@@ -36,89 +176,207 @@ class FileSaver:
             None
         """
 
-        self._downloaded.append(block)
-        self._progress_bar["value"] = int((len(self._downloaded) / len(self._blocks)) * 100)
+        if block.index in self.verified or block.index in self._hashing:
+            return
+
+        self.start(block.index)
+        buffer, blocks = self._pieces[block.index]
+        if block.begin in blocks:
+            return
+
+        size = len(block.block)
+        if block.begin + size > len(buffer):
+            raise Exception(f"block at {block.begin} of piece {block.index} overruns the piece by "
+                            f"{block.begin + size - len(buffer)} bytes")
+
+        buffer[block.begin:block.begin + size] = block.block
+        blocks[block.begin] = size
+        self._stats.downloaded_bytes += size
 
-    def save(self):
-        """Save the complete torrent and update the progress bar to 100%
+        if sum(blocks.values()) == len(buffer):
+            await asyncio.shield(self._verify(block.index))
+
+    def _verify(self, index):
+        """Hash a complete piece on a disk pool thread
+
+        Args:
+            index: the piece index
+
+        Returns:
+            an asyncio future done once the piece is settled by _hashed()
+        """
+
+        buffer, blocks = self._pieces.pop(index)
+
+        fut = self._pool.run(_hash, buffer)
+        self._hashing[index] = fut
+        fut.add_done_callback(functools.partial(self._hashed, index, buffer, blocks))
+
+        return fut
+
+    def _hashed(self, index, buffer, blocks, fut):
+        """Queue a piece whose hash matched to be written, or fail its blocks
+
+        Args:
+            index: the piece index
+            buffer: the piece buffer
+            blocks: a dict mapping the block offsets of the piece to their lengths
+            fut: the finished hash future
 
         Returns:
             None
         """
 
-        if isinstance(self._torrent, SingleFileTorrent):
-            self._save_singlefile()
-        elif isinstance(self._torrent, MultiFileTorrent):
-            self._save_multifile()
+        del self._hashing[index]
+
+        digest, seconds = fut.result()
+        valid = digest == self._torrent.piece_hashes[index]
+        self._stats.hash_seconds += seconds
+        self._stats.hashed_bytes += len(buffer)
+
+        if valid:
+            self._stats.pieces_verified += 1
+            self.verified.add(index)
+            if not all(self._files.wanted[i] for i, _, _ in self._files.ranges(*self._piece_range(index))):
+                self._partial.add(index)
+            self._files.write(index * self._torrent.piece_length, buffer, lambda: self._written(index, buffer))
         else:
-            raise TypeError("torrent object must be SingleFileTorrent or MultiFileTorrent")
+            self._stats.pieces_failed += 1
+            self._buffers.release(buffer)
+            self._stats.downloaded_bytes -= len(buffer)
+            self._failed.extend(Block(index, begin, blocks[begin]) for begin in sorted(blocks))
 
-        self._progress_bar["value"] = 100
+    def _written(self, index, buffer):
+        """Mark a verified piece as written to disk, give its buffer back, wake the readers waiting for it
+        and report it to on_written if it is on disk whole
 
-    def _save_multifile(self):
-        """Save a multi file torrent
+        Args:
+            index: the piece index
+            buffer: the piece buffer
 
         Returns:
             None
         """
 
-        data = b""
-        for block in self._blocks:
-            data += [down for down in self._downloaded if (down.index == block.index and down.begin == block.begin)][0].block
+        self._buffers.release(buffer)
+
+        with self._written_changed:
+            self.written.add(index)
+            self._written_changed.notify_all()
+
+        if self._on_written is not None and index not in self._partial:
+            self._on_written(index)
+
+    @property
+    def uploadable(self):
+        """The indexes of the pieces written to disk whole, the ones sharing a skipped file are only partly written"""
+        return self.written - self._partial
 
-        for file in self._torrent.files:
-            path = f"{self._torrent.file_name}/{'/'.join([p.decode() for p in file[b'path']])}"
+    async def read(self, index, begin, length):
+        """Read a block of a piece written to disk whole, to be uploaded
 
-            dirs = os.path.dirname(path)
-            if dirs:
-                os.makedirs(dirs, exist_ok=True)
+        Args:
+            index: the piece index
+            begin: the block offset in the piece
+            length: the block length
+
+        Returns:
+            the block bytes, None if the piece isn't on disk or the block is out of the piece
+        """
 
-            with open(path, "wb") as f:
-                f.write(data[:file[b"length"]])
+        if index not in self.written or index in self._partial or begin < 0 or begin + length > self.piece_size(index):
+            return None
 
-            data = data[file[b"length"]:]
+        return await self._files.read(index * self._torrent.piece_length + begin, length)
 
-    def _save_singlefile(self):
-        """Save a single file torrent
+    def wait_for_piece(self, index, timeout=None):
+        """Block the calling thread until a piece is verified and written to disk. Must not be called on the loop
+
+        Args:
+            index: the piece index
+            timeout: optional timeout in seconds
+
+        Returns:
+            True if the piece is on disk, False on timeout
+        """
+
+        with self._written_changed:
+            return self._written_changed.wait_for(lambda: index in self.written, timeout)
+
+    @property
+    def files(self):
+        """The TorrentFiles object the pieces are written to"""
+        return self._files
+
+    async def allocate(self):
+        """Create and size the torrent files according to the allocation mode, once
 
         Returns:
             None
         """
 
-        data = b""
-        for block in self._blocks:
-            data += [down for down in self._downloaded if (down.index == block.index and down.begin == block.begin)][0].block
+        if not self._allocated:
+            await self._files.allocate(self._allocation)
+            self._allocated = True
 
-        with open(self._torrent.file_name, "wb") as f:
-            f.write(data)
+    async def drain(self):
+        """Wait while the disk pool has more bytes queued than its budget
 
-    def get_failed_blocks(self):
-        """Validate block hashes, remove failed ones from the downloaded pool and return them
+        Returns:
+            None
+        """
+
+        await self._pool.drain()
+
+    async def wait_for_hashes(self):
+        """Wait until the complete pieces being hashed are verified or failed
 
         Returns:
-            a list of blocks whose hashes aren't valid
+            None
         """
 
-        pieces = [[] for _ in range(math.ceil(self._torrent.length / self._torrent.piece_length))]
-        for block in self._downloaded:
-            pieces[block.index].append(block)
+        if self._hashing:
+            await asyncio.wait(set(self._hashing.values()))
 
-        [lst.sort(key=lambda b: b.begin) for lst in pieces]
+    async def save(self):
+        """Wait for the pieces being hashed, write the remaining pieces, fsync and close the files
+        and mark the stats as completed
 
-        ret = []
+        Returns:
+            None
+        """
 
-        for i, blocks in enumerate(pieces):
-            data = b""
-            data += b"".join([block.block for block in blocks])
+        await self.wait_for_hashes()
+        await self._files.close()
 
-            if sha1(data).digest() != self._torrent.piece_hashes[i] and (
-                len(data) == self._torrent.piece_length or
-                (len(data) == self._torrent.length - i * self._torrent.piece_length and
-                i + 1 == self._torrent.length // self._torrent.piece_length)):
+        if self._owns_pool:
+            self._pool.shutdown()
 
-                ret.extend(blocks)
+        self._stats.completed = True
+
+    def get_failed_blocks(self):
+        """Return the blocks of the pieces whose hashes weren't valid since the last call,
+        they were removed from the downloaded pool
 
-        [self._downloaded.remove(block) for piece in ret for block in piece]
-        ret = [Block(block.index, block.begin, len(block.block)) for piece in ret for block in piece]
+        Returns:
+            a list of blocks whose hashes aren't valid
+        """
+
+        ret, self._failed = self._failed, []
         return ret
 
+
+def _hash(buffer):
+    """Hash a piece buffer on a pool thread, sha1 releases the GIL for large buffers
+
+    Args:
+        buffer: the piece buffer
+
+    Returns:
+        a (SHA1 digest, seconds taken) tuple
+    """
+
+    started = time.perf_counter()
+    digest = sha1(buffer).digest()
+
+    return digest, time.perf_counter() - started
@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+
+class ConnectionLimit:
+    def __init__(self, maximum):
+        """Initialize a limit on the number of open peer connections, shared by the torrents of a session
+
+        Args:
+            maximum: maximal number of connections
+        """
+
+        self.maximum = maximum
+        self.in_use = 0
+
+    def try_acquire(self):
+        """Take a connection slot if one is free
+
+        Returns:
+            True if a slot was taken, else False
+        """
+
+        if self.in_use >= self.maximum:
+            return False
+
+        self.in_use += 1
+        return True
+
+    def release(self):
+        """Give back a connection slot
+
+        Returns:
+            None
+        """
+
+        self.in_use = max(0, self.in_use - 1)
+
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=None, parent=None):
+        """Initialize a bandwidth limit. Buckets form a hierarchy, such as session -> torrent -> peer,
+        and bytes taken from a bucket are taken from each of its ancestors too
+
+        Args:
+            rate: bytes per second, None for unlimited, must be positive otherwise
+            burst: maximal bytes saved up while idle, one second worth of rate by default
+            parent: optional parent bucket
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.parent = parent
+
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._chain = [self] + (parent._chain if parent is not None else [])
+
+    @property
+    def rate(self):
+        """Bytes per second, None for unlimited"""
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        if rate is not None and not rate > 0:
+            raise Exception(f"rate limit must be positive, got {rate}")
+
+        self._rate = rate
+
+    @property
+    def limited(self):
+        """True if this bucket or one of its ancestors has a rate"""
+        return any(bucket.rate is not None for bucket in self._chain)
+
+    def reserve(self, n):
+        """Take bytes from this bucket and its ancestors, going into debt when there aren't enough tokens
+
+        Args:
+            n: number of bytes
+
+        Returns:
+            seconds to wait before the bytes may be transferred
+        """
+
+        now = time.monotonic()
+        delay = 0.0
+
+        for bucket in self._chain:
+            if bucket.rate is None:
+                continue
+
+            delay = max(delay, bucket._take(n, now))
+
+        return delay
+
+    def _take(self, n, now):
+        """Refill by the elapsed time and take bytes from this bucket only
+
+        Args:
+            n: number of bytes
+            now: the current monotonic time
+
+        Returns:
+            seconds until the bucket is out of debt
+        """
+
+        burst = self.burst if self.burst is not None else self.rate
+        self._tokens = min(burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= n
+
+        return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    async def consume(self, n):
+        """Wait until bytes may be transferred within every limit of the hierarchy
+
+        Args:
+            n: number of bytes
+
+        Returns:
+            None
+        """
+
+        for bucket in self._chain:
+            if bucket.rate is not None:
+                break
+        else:
+            return
+
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,182 @@
+from bencode.decode import bdecode
+from peer.extension import METADATA_PIECE_SIZE
+from .torrent import AbstractTorrent
+from hashlib import sha1
+from collections import Counter
+import urllib.parse
+import base64
+import math
+import asyncio
+
+
+class MagnetLink:
+    def __init__(self, info_hash, trackers, display_name=None):
+        """Initialize a magnet link standing in for the torrent until its metadata is downloaded
+
+        Args:
+            info_hash: 20-byte SHA1 hash of the info dictionary
+            trackers: a list of tracker announce urls
+            display_name: optional name suggested by the link
+        """
+
+        self.info_hash = info_hash
+        self.trackers = trackers
+        self.display_name = display_name
+        self.peer_id = AbstractTorrent.gen_peer_id()
+
+    @property
+    def announce_url(self):
+        """The first tracker url, None for a trackerless link"""
+        return self.trackers[0] if self.trackers else None
+
+    @property
+    def file_name(self):
+        """The suggested name, or the hex info hash if the link has none"""
+        return self.display_name or self.info_hash.hex()
+
+    @property
+    def request_params(self):
+        """Get the tracker request parameters, the amount left is unknown before the metadata arrives
+
+        Returns:
+            a dict representing the tracker request params
+        """
+
+        params = dict()
+
+        params["info_hash"] = self.info_hash
+        params["peer_id"] = self.peer_id
+        params["left"] = "0"
+        params["compact"] = "1"
+        params["port"] = str(AbstractTorrent.PORT)
+        params["uploaded"] = "0"
+        params["downloaded"] = "0"
+        params["event"] = "started"
+
+        return params
+
+    @classmethod
+    def parse(cls, uri):
+        """Parse a magnet uri
+
+        Args:
+            uri: a magnet uri of the form magnet:?xt=urn:btih:<info hash>&tr=<tracker>&dn=<name>
+
+        Returns:
+            a magnet link instance
+        """
+
+        parsed = urllib.parse.urlparse(uri)
+        if parsed.scheme != "magnet":
+            raise ValueError(f"not a magnet uri: {uri}")
+
+        query = urllib.parse.parse_qs(parsed.query)
+
+        info_hash = None
+        for xt in query.get("xt", []):
+            if xt.lower().startswith("urn:btih:"):
+                info_hash = cls._parse_info_hash(xt[len("urn:btih:"):])
+                break
+
+        if info_hash is None:
+            raise ValueError(f"magnet uri has no bittorrent info hash: {uri}")
+
+        display_name = query["dn"][0] if "dn" in query else None
+
+        return cls(info_hash, query.get("tr", []), display_name)
+
+    @staticmethod
+    def _parse_info_hash(value):
+        """Decode a hex or base32 encoded info hash
+
+        Args:
+            value: the info hash part of the exact topic
+
+        Returns:
+            the 20-byte info hash
+        """
+
+        if len(value) == 40:
+            return bytes.fromhex(value)
+        elif len(value) == 32:
+            return base64.b32decode(value.upper())
+
+        raise ValueError(f"invalid info hash: {value}")
+
+
+class MetadataFetcher:
+    MAX_METADATA_SIZE = 2 ** 24
+    ATTEMPTS = 3
+
+    def __init__(self, info_hash):
+        """Initialize a fetcher downloading the info dictionary from peers (BEP 9)
+
+        Args:
+            info_hash: 20-byte SHA1 hash the assembled info dictionary is verified against
+        """
+
+        self._info_hash = info_hash
+
+    async def fetch(self, peers):
+        """Download the metadata pieces from several peers in parallel and verify them
+
+        Args:
+            peers: a list of handshaked peer objects
+
+        Returns:
+            the decoded info dictionary, None if it couldn't be downloaded
+        """
+
+        peers = [peer for peer in peers
+                 if peer.metadata_size and peer.metadata_size <= MetadataFetcher.MAX_METADATA_SIZE]
+        if not peers:
+            return None
+
+        size = Counter(peer.metadata_size for peer in peers).most_common(1)[0][0]
+        peers = [peer for peer in peers if peer.metadata_size == size]
+        count = math.ceil(size / METADATA_PIECE_SIZE)
+
+        for _ in range(MetadataFetcher.ATTEMPTS):
+            pieces = {}
+            pending = list(range(count))
+            active = list(peers)
+
+            while pending and active:
+                results = await asyncio.gather(*[self._fetch_from(peer, size, pending, pieces) for peer in active])
+                active = [peer for peer, ok in zip(active, results) if ok]
+
+            if len(pieces) < count:
+                return None
+
+            data = b"".join(pieces[i] for i in range(count))
+            if sha1(data).digest() == self._info_hash:
+                return bdecode(data)
+
+        return None
+
+    @staticmethod
+    async def _fetch_from(peer, size, pending, pieces):
+        """Fetch pending metadata pieces from a single peer until none are left or the peer fails
+
+        Args:
+            peer: a handshaked peer object
+            size: the metadata size in bytes
+            pending: a shared list of piece indexes left to be fetched
+            pieces: a shared dict of fetched pieces by index
+
+        Returns:
+            True if the peer didn't fail, else False
+        """
+
+        while pending:
+            piece = pending.pop(0)
+            data = await peer.fetch_metadata_piece(piece)
+
+            expected = min(METADATA_PIECE_SIZE, size - piece * METADATA_PIECE_SIZE)
+            if data is None or len(data) != expected:
+                pending.append(piece)
+                return False
+
+            pieces[piece] = data
+
+        return True
@@ -0,0 +1,253 @@
+import contextlib
+import collections
+import asyncio
+import time
+import json
+
+
+class PhaseTimer:
+    def __init__(self, name):
+        """Initialize the accumulated timing of a download phase
+
+        Args:
+            name: the phase name, such as 'recv' or 'hash'
+        """
+
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Record a single run of the phase
+
+        Args:
+            seconds: how long the run took
+
+        Returns:
+            None
+        """
+
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def report(self):
+        """The phase timing as a json serializable dictionary"""
+        return {"count": self.count, "total_s": self.total, "max_s": self.max,
+                "mean_s": self.total / self.count if self.count else 0.0}
+
+
+class Profiler:
+    LAG_INTERVAL = 0.05
+    LAG_SAMPLES = 4096
+    TRACEMALLOC_TOP = 25
+
+    def __init__(self, dump_path=None, dump_interval=10, cprofile=False, tracemalloc_frames=0):
+        """Initialize an opt-in profiler of the downloads running on one event loop
+
+        Args:
+            dump_path: optional json file the report is written to periodically and on stop.
+                the cProfile stats are saved next to it with a '.prof' suffix
+            dump_interval: seconds between periodic dumps
+            cprofile: run cProfile on the event loop thread
+            tracemalloc_frames: number of frames tracemalloc keeps per allocation, 0 to disable it
+        """
+
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.phases = {}
+        self.lag_samples = collections.deque(maxlen=Profiler.LAG_SAMPLES)
+        self.max_lag = 0.0
+
+        self._cprofile = None
+        self._tracemalloc_frames = tracemalloc_frames
+        self._started = None
+        self._tasks = []
+
+        if cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+
+    async def start(self):
+        """Start the loop lag monitor, the periodic dump and the optional cProfile and tracemalloc capture.
+        Must be awaited on the loop being profiled
+
+        Returns:
+            None
+        """
+
+        if self._tasks:
+            return
+
+        self._started = time.monotonic()
+        self._tasks.append(asyncio.create_task(self._monitor_lag()))
+        if self.dump_path:
+            self._tasks.append(asyncio.create_task(self._dump_periodically()))
+
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+        if self._tracemalloc_frames:
+            import tracemalloc
+            tracemalloc.start(self._tracemalloc_frames)
+
+    def stop(self):
+        """Stop the monitors and write the final dump. Must be called on the loop being profiled
+
+        Returns:
+            None
+        """
+
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+        if self.dump_path:
+            self.dump()
+
+        if self._tracemalloc_frames:
+            import tracemalloc
+            tracemalloc.stop()
+
+    def phase(self, name):
+        """Time a phase of the download
+
+        Args:
+            name: the phase name
+
+        Returns:
+            a context manager recording how long its body took
+        """
+
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        """Context manager behind phase()"""
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        """Record a phase run measured by the caller
+
+        Args:
+            name: the phase name
+            seconds: how long the run took
+
+        Returns:
+            None
+        """
+
+        timer = self.phases.get(name)
+        if timer is None:
+            timer = self.phases[name] = PhaseTimer(name)
+
+        timer.add(seconds)
+
+    async def _monitor_lag(self):
+        """Sleep LAG_INTERVAL at a time and record how late the loop woke us up
+
+        Returns:
+            None
+        """
+
+        while True:
+            expected = time.monotonic() + Profiler.LAG_INTERVAL
+            await asyncio.sleep(Profiler.LAG_INTERVAL)
+
+            lag = max(0.0, time.monotonic() - expected)
+            self.lag_samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    async def _dump_periodically(self):
+        """Write the report every dump_interval seconds
+
+        Returns:
+            None
+        """
+
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            self.dump()
+
+    def report(self):
+        """Build the profiling report
+
+        Returns:
+            a json serializable dictionary
+        """
+
+        lags = sorted(self.lag_samples)
+
+        report = {
+            "elapsed_s": time.monotonic() - self._started if self._started else 0.0,
+            "loop_lag": {
+                "samples": len(lags),
+                "mean_s": sum(lags) / len(lags) if lags else 0.0,
+                "p99_s": lags[int(len(lags) * 0.99)] if lags else 0.0,
+                "max_s": self.max_lag,
+            },
+            "phases": {name: timer.report() for name, timer in sorted(self.phases.items())},
+        }
+
+        if self._tracemalloc_frames:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics("lineno")[:Profiler.TRACEMALLOC_TOP]
+                report["tracemalloc"] = {"current_bytes": current, "peak_bytes": peak,
+                                         "top": [f"{stat.traceback}: {stat.size} bytes in {stat.count} blocks"
+                                                 for stat in top]}
+
+        return report
+
+    def dump(self, path=None):
+        """Write the report and the cProfile stats
+
+        Args:
+            path: the json file path, dump_path by default
+
+        Returns:
+            None
+        """
+
+        path = path or self.dump_path
+
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+        if self._cprofile is not None:
+            # dump_stats() disables the profiler, so it is turned back on while still running
+            self._cprofile.dump_stats(path + ".prof")
+            if self._tasks:
+                self._cprofile.enable()
+
+
+class NullProfiler:
+    """A disabled profiler whose phases cost a single attribute lookup"""
+
+    _NULL_PHASE = contextlib.nullcontext()
+
+    async def start(self):
+        """Do nothing"""
+
+    def stop(self):
+        """Do nothing"""
+
+    def phase(self, name):
+        """A shared context manager that records nothing"""
+        return NullProfiler._NULL_PHASE
+
+    def record(self, name, seconds):
+        """Do nothing"""
+
+
+NULL_PROFILER = NullProfiler()
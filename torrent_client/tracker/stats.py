@@ -0,0 +1,117 @@
+import time
+
+
+class TorrentStats:
+    def __init__(self):
+        """Initialize the counters a download publishes. Each field is a plain attribute written
+        by the session thread only, so readers on other threads can poll them without locking
+        """
+
+        self.total_bytes = 0
+        self.downloaded_bytes = 0
+        self.uploaded_bytes = 0
+        self.peers = 0
+        self.completed = False
+
+        self.pieces_verified = 0
+        self.pieces_failed = 0
+        self.hashed_bytes = 0
+        self.hash_seconds = 0.0
+        self.announce_seconds = None
+
+    @property
+    def progress(self):
+        """Downloaded fraction between 0 and 1"""
+
+        if self.completed:
+            return 1.0
+        if not self.total_bytes:
+            return 0.0
+
+        return min(1.0, self.downloaded_bytes / self.total_bytes)
+
+
+class RateSampler:
+    SMOOTHING = 0.3
+
+    def __init__(self, stats):
+        """Initialize a sampler turning the stats counters into speeds and an ETA, meant to be polled periodically
+
+        Args:
+            stats: a TorrentStats object
+        """
+
+        self._stats = stats
+        self._last_time = None
+        self._last_down = 0
+        self._last_up = 0
+
+        self.down_rate = 0.0
+        self.up_rate = 0.0
+
+    def sample(self):
+        """Read the counters and update the smoothed download and upload speeds
+
+        Returns:
+            None
+        """
+
+        now = time.monotonic()
+        down, up = self._stats.downloaded_bytes, self._stats.uploaded_bytes
+
+        if self._last_time is not None and now > self._last_time:
+            elapsed = now - self._last_time
+            self.down_rate += RateSampler.SMOOTHING * (max(0, down - self._last_down) / elapsed - self.down_rate)
+            self.up_rate += RateSampler.SMOOTHING * (max(0, up - self._last_up) / elapsed - self.up_rate)
+
+        self._last_time, self._last_down, self._last_up = now, down, up
+
+    @property
+    def eta(self):
+        """Estimated seconds left, None if unknown"""
+
+        left = self._stats.total_bytes - self._stats.downloaded_bytes
+        if self._stats.completed or left <= 0:
+            return 0
+        if self.down_rate < 1:
+            return None
+
+        return left / self.down_rate
+
+
+def format_bytes(n):
+    """Format a byte count in human readable units
+
+    Args:
+        n: number of bytes
+
+    Returns:
+        a string such as '1.5 MiB'
+    """
+
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+    return f"{n:.1f} TiB"
+
+
+def format_eta(seconds):
+    """Format an ETA in seconds
+
+    Args:
+        seconds: seconds left or None if unknown
+
+    Returns:
+        a string such as '1:02:03' or '--:--'
+    """
+
+    if seconds is None:
+        return "--:--"
+
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes:02}:{seconds:02}"
@@ -0,0 +1,154 @@
+from .disk import read_at
+import io
+import os
+
+
+class TorrentStream(io.RawIOBase):
+    def __init__(self, file_saver, blocks, piece_length, file_index=None, timeout=None):
+        """Initialize a read-only file object over the torrent content or one of its files.
+        Reads block until the pieces holding the requested bytes are verified and written,
+        and move the download deadline to the read position so those pieces are fetched first
+
+        Args:
+            file_saver: the FileSaver of the torrent
+            blocks: the BlockManager of the torrent
+            piece_length: the torrent piece length
+            file_index: index of the file to read in a multi-file torrent, None for the whole content
+            timeout: optional seconds a read waits for a piece before raising TimeoutError
+        """
+
+        super().__init__()
+
+        self._saver = file_saver
+        self._files = file_saver.files
+        self._blocks = blocks
+        self._piece_length = piece_length
+        self._timeout = timeout
+        self._fds = {}
+
+        lengths = [length for _, length in self._files.files]
+        if file_index is None:
+            self._start, self._size = 0, sum(lengths)
+        else:
+            self._start, self._size = sum(lengths[:file_index]), lengths[file_index]
+
+        self._position = 0
+        self._move_deadline()
+
+    @property
+    def size(self):
+        """The stream size in bytes"""
+        return self._size
+
+    def readable(self):
+        """The stream is readable"""
+        return True
+
+    def seekable(self):
+        """The stream is seekable, seeking moves the download deadline"""
+        return True
+
+    def tell(self):
+        """The read position"""
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move the read position and the download deadline
+
+        Args:
+            offset: the offset relative to whence
+            whence: io.SEEK_SET, io.SEEK_CUR or io.SEEK_END
+
+        Returns:
+            the new read position
+        """
+
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+
+        if offset < 0:
+            raise ValueError("negative seek position")
+
+        self._position = offset
+        self._move_deadline()
+
+        return self._position
+
+    def readinto(self, buffer):
+        """Read the bytes at the read position once they are on disk. Returns as soon as the first
+        piece is available, possibly with fewer bytes than requested
+
+        Args:
+            buffer: a writable bytes-like object
+
+        Returns:
+            the number of bytes read, 0 at the end of the stream
+        """
+
+        length = min(len(buffer), self._size - self._position)
+        if length <= 0:
+            return 0
+
+        offset = self._start + self._position
+        piece = offset // self._piece_length
+
+        if not self._saver.wait_for_piece(piece, self._timeout):
+            raise TimeoutError(f"piece {piece} wasn't downloaded in time")
+
+        end = offset + length
+        while piece * self._piece_length < end and piece in self._saver.written:
+            piece += 1
+        end = min(end, piece * self._piece_length)
+
+        data = b"".join(read_at(self._fd(i), size, position)
+                        for i, position, size in self._files.ranges(offset, end - offset))
+
+        buffer[:len(data)] = data
+        self._position += len(data)
+        self._move_deadline()
+
+        return len(data)
+
+    def _fd(self, i):
+        """A read-only descriptor of a torrent file, opened on first use
+
+        Args:
+            i: the file index
+
+        Returns:
+            the file descriptor
+        """
+
+        if i not in self._fds:
+            self._fds[i] = os.open(self._files.files[i][0], os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+        return self._fds[i]
+
+    def _move_deadline(self):
+        """Point the block manager deadline at the piece under the read position
+
+        Returns:
+            None
+        """
+
+        if self._position < self._size:
+            self._blocks.deadline = (self._start + self._position) // self._piece_length
+        else:
+            self._blocks.deadline = None
+
+    def close(self):
+        """Close the file descriptors and stop prioritizing the stream
+
+        Returns:
+            None
+        """
+
+        if not self.closed:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = {}
+            self._blocks.deadline = None
+
+        super().close()
@@ -1,12 +1,15 @@
-from bencode.decode import bdecode
+from bencode.decode import bdecode, bdecode_dict_value
 from bencode.encode import bencode
 from hashlib import sha1
 import random
 
 
 class AbstractTorrent:
+    PORT = 59696
+
     def __init__(self, bencoded_data):
-        """Initialize a torrent object that represents the metainfo file
+        """Initialize a torrent object that represents the metainfo file.
+        The info hash is taken over the info dictionary bytes as they are in the file
 
         Args:
             bencoded_data: bencoded data. usually the content of a *.torrent file
@@ -17,7 +20,8 @@ class AbstractTorrent:
         self._info = torrent_dict[b'info']
 
         self.announce_url = torrent_dict[b"announce"].decode()
-        self.info_hash = sha1(bencode(self._info)).digest()
+        self.url_list = AbstractTorrent._parse_url_list(torrent_dict.get(b"url-list", []))
+        self.info_hash = sha1(bdecode_dict_value(bencoded_data, b"info")).digest()
         self.peer_id = AbstractTorrent.gen_peer_id()
 
     @property
@@ -39,7 +43,7 @@ class AbstractTorrent:
         params["peer_id"] = self.peer_id
         params["left"] = str(self.length)
         params["compact"] = "1"
-        params["port"] = "59696"
+        params["port"] = str(AbstractTorrent.PORT)
         params["uploaded"] = "0"
         params["downloaded"] = "0"
         params["event"] = "started"
@@ -74,6 +78,22 @@ class AbstractTorrent:
 
         return cls(bencode(torrent_dict))
 
+    @staticmethod
+    def _parse_url_list(url_list):
+        """Parse the web seed urls (BEP 19), given as a single url or a list of urls
+
+        Args:
+            url_list: the bencoded 'url-list' value
+
+        Returns:
+            a list of url strings
+        """
+
+        if isinstance(url_list, bytes):
+            url_list = [url_list]
+
+        return [url.decode() for url in url_list if isinstance(url, bytes) and url]
+
     @staticmethod
     def gen_peer_id():
         """Generate a peer id"""
@@ -1,34 +1,88 @@
-from .torrent import SingleFileTorrent, MultiFileTorrent
+from .torrent import AbstractTorrent, SingleFileTorrent, MultiFileTorrent
 from bencode.decode import bdecode
 from peer.peer import Peer
+from peer.network import PieceMessage, MESSAGE_PIECE
+from peer.window import RequestWindow
+from peer.extension import decode_compact_peers, decode_compact_peers6, normalize_address
 from .file_saver import FileSaver
-from .blocks import BlockManager
-import random
+from .blocks import BlockManager, piece_priorities, PRIORITY_NORMAL, PRIORITY_SKIP
+from .magnet import MagnetLink, MetadataFetcher
+from .stats import TorrentStats
+from .profiler import NULL_PROFILER
+from .limits import TokenBucket
+from .disk import ALLOCATE_SPARSE
+from .stream import TorrentStream
+from .web_seed import WebSeed
+import time
 import asyncio
-import aiohttp
-import yarl
 import urllib.parse
-import ipaddress
-import struct
 
 
 class Tracker:
-    def __init__(self, torrent_dict, progress_bar):
+    MAX_PEERS = 50
+    EVICT_INTERVAL = 30
+    EVICT_FRACTION = 0.1
+    EVICT_RATIO = 0.25
+    MEMORY_WAIT = 1
+    IDLE_WAIT = 1
+
+    def __init__(self, torrent_dict, magnet=None, dht=None, max_peers=MAX_PEERS, connections=None, download_dir=".",
+                 profiler=None, download_limit=None, upload_limit=None, disk_pool=None,
+                 allocation=ALLOCATE_SPARSE, buffer_pool=None, capture=None):
         """Initialize a tracker object
 
         Args:
-            torrent_dict: a torrent dict that represents the *.torrent file
-            progress_bar: a gui progress bar to be updated as the download progresses
+            torrent_dict: a torrent dict that represents the *.torrent file, None if started from a magnet link
+            magnet: a magnet link object whose metadata is downloaded from peers when torrent_dict is None
+            dht: an optional started DHT node used to find peers next to the tracker server
+            max_peers: maximal number of peers connected at once for this torrent
+            connections: an optional ConnectionLimit shared by several torrents
+            download_dir: the directory the torrent files are saved in
+            profiler: an optional started Profiler timing the download phases
+            download_limit: an optional session TokenBucket the torrent download bucket is nested in
+            upload_limit: an optional session TokenBucket the torrent upload bucket is nested in
+            disk_pool: an optional DiskPool shared by several torrents
+            allocation: the file allocation mode, one of the disk.ALLOCATE_* modes
+            buffer_pool: an optional BufferPool holding the pieces of several torrents under one memory budget
+            capture: an optional PeerCapture recording every peer connection
         """
 
-        if b"files" in torrent_dict[b"info"]:
-            self._torrent = MultiFileTorrent.from_dict(torrent_dict)
-        else:
-            self._torrent = SingleFileTorrent.from_dict(torrent_dict)
+        self.stats = TorrentStats()
+        self._magnet = magnet
+        self._dht = dht
+        self._max_peers = max_peers
+        self._connections = connections
+        self._download_dir = download_dir
+        self._profiler = profiler or NULL_PROFILER
+        self._disk_pool = disk_pool
+        self._allocation = allocation
+        self._buffer_pool = buffer_pool
+        self._capture = capture
+        self._torrent = magnet
+        self._blocks = None
+        self._file_saver = None
+        self._file_priorities = {}
+        self._web_seeds = None
+
+        if torrent_dict is not None:
+            self._load_torrent(torrent_dict)
+
+        self.download_limit = TokenBucket(parent=download_limit)
+        self.upload_limit = TokenBucket(parent=upload_limit)
+        self.peer_download_rate = None
+        self.peer_upload_rate = None
+
+        self.time_to_first_handshake = None
+        self.time_to_metadata = None
+        self.time_to_first_piece = None
+        self._started = None
 
-        self._blocks = BlockManager(self._torrent)
-        self._file_saver = FileSaver(self._torrent, progress_bar)
         self._peers = []
+        self._known = set()
+        self._candidates = []
+        self._workers = {}
+        self._contributors = {}
+        self._downloading = False
         self._interval = 0
 
     async def download(self):
@@ -38,44 +92,672 @@ class Tracker:
             None
         """
 
+        self._started = time.monotonic()
+
         if not self._peers and not self._interval:
-            self._peers, self._interval = await self._request_peers()
+            try:
+                addresses, self._interval = await self._request_peers()
+                self.add_peers(addresses)
+            except Exception:
+                if self._dht is None and not (self._file_saver is not None and self._torrent.url_list):
+                    raise
+
+            if self._dht is not None:
+                peers, _ = await self._dht.announce(self._torrent.info_hash, AbstractTorrent.PORT)
+                self.add_peers(peers)
 
         await self._handshake_peers()
 
-        while not self._blocks.empty():
-            scheduled = []
-            tasks = []
-            blocks = []
+        if self._file_saver is None:
+            with self._profiler.phase("metadata"):
+                await self._fetch_metadata()
+            self.time_to_metadata = time.monotonic() - self._started
+
+        await self.allocate()
+
+        if self._web_seeds is None:
+            self._web_seeds = [WebSeed(url, self._torrent, self._file_saver.files,
+                                       TokenBucket(parent=self.download_limit)) for url in self._torrent.url_list]
+
+        self._downloading = True
+        evictor = asyncio.create_task(self._evict_periodically())
+
+        try:
+            while not self._blocks.empty():
+                self._start_workers()
+
+                if not self._workers:
+                    raise Exception(f"no peers or web seeds left to download {self.torrent_name} from")
+
+                done, _ = await asyncio.wait(set(self._workers), return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+
+                if self._blocks.empty():
+                    await self._file_saver.wait_for_hashes()
+                    self._blocks.extend_blocks(self._take_failed_blocks())
+        finally:
+            self._downloading = False
+            evictor.cancel()
+
+            for task in list(self._workers):
+                task.cancel()
+            self._blocks.release_all()
+            self._file_saver.release_unused()
+
+            for seed in self._web_seeds:
+                await seed.close()
+
+        with self._profiler.phase("disk"):
+            await self._file_saver.save()
+
+    async def allocate(self):
+        """Create and size the torrent files, so they exist and running out of space fails right away.
+        Does nothing until the metadata of a magnet link is known
+
+        Returns:
+            None
+        """
+
+        if self._file_saver is not None:
+            await self._file_saver.allocate()
+
+    def stream(self, file_index=None, timeout=None):
+        """Open a blocking file object over the content that downloads the pieces under its read position first
+
+        Args:
+            file_index: index of the file to read in a multi-file torrent, None for the whole content
+            timeout: optional seconds a read waits for a piece before raising TimeoutError
+
+        Returns:
+            a TorrentStream object
+        """
+
+        if self._file_saver is None:
+            raise Exception(f"the metadata of {self.torrent_name} isn't downloaded yet")
+
+        wanted = self._file_saver.files.wanted
+        if not (all(wanted) if file_index is None else wanted[file_index]):
+            raise Exception(f"can't stream skipped files of {self.torrent_name}")
+
+        return TorrentStream(self._file_saver, self._blocks, self._torrent.piece_length, file_index, timeout)
+
+    def set_rate_limits(self, download=None, upload=None):
+        """Set the bandwidth limits of the torrent, they apply within the session limits right away
+
+        Args:
+            download: download limit in bytes per second, None for unlimited
+            upload: upload limit in bytes per second, None for unlimited
+
+        Returns:
+            None
+        """
+
+        self.download_limit.rate = download
+        self.upload_limit.rate = upload
+
+    def set_file_priorities(self, priorities):
+        """Set the priorities of files of a multi-file torrent. Pieces get the highest priority of the files
+        they overlap, skipped files are neither downloaded nor created except for the pieces they share
+        with wanted files. Priorities set before the metadata of a magnet link is known are applied once it is
+
+        Args:
+            priorities: a dict mapping file indexes to blocks.PRIORITY_* values, files not given keep theirs
+
+        Returns:
+            None
+        """
+
+        self._file_priorities.update(priorities)
+
+        if self._file_saver is not None:
+            self._apply_priorities()
+
+    def _apply_priorities(self):
+        """Map the file priorities to piece priorities and hand them to the block manager and the file saver
+
+        Returns:
+            None
+        """
+
+        lengths = [length for _, length in self._file_saver.files.files]
+        for index in self._file_priorities:
+            if not 0 <= index < len(lengths):
+                raise Exception(f"{self.torrent_name} has no file {index}")
+
+        files = [self._file_priorities.get(i, PRIORITY_NORMAL) for i in range(len(lengths))]
+        pieces = piece_priorities(lengths, self._torrent.piece_length, files)
+
+        self._blocks.extend_blocks(self._file_saver.set_priorities(pieces, [p != PRIORITY_SKIP for p in files]))
+        self._blocks.set_priorities(pieces)
+
+    def close(self):
+        """Close every peer connection and forget the peer pool. Downloaded blocks are kept,
+        so a later call to download() requests peers again and resumes
+
+        Returns:
+            None
+        """
+
+        for peer in list(self._peers):
+            self._drop_peer(peer)
+
+        self._known.clear()
+        self._candidates.clear()
+        self._interval = 0
+
+    def _load_torrent(self, torrent_dict):
+        """Create the torrent object and the block and file bookkeeping from the torrent dict
+
+        Args:
+            torrent_dict: a torrent dict that represents the *.torrent file
+
+        Returns:
+            None
+        """
+
+        if b"files" in torrent_dict[b"info"]:
+            self._torrent = MultiFileTorrent.from_dict(torrent_dict)
+        else:
+            self._torrent = SingleFileTorrent.from_dict(torrent_dict)
+
+        if self._magnet is not None:
+            self._torrent.peer_id = self._magnet.peer_id
+
+        self._blocks = BlockManager(self._torrent)
+        self._file_saver = FileSaver(self._torrent, self.stats, self._download_dir, self._disk_pool,
+                                     self._allocation, self._buffer_pool, self._announce_piece)
+
+        if self._file_priorities:
+            self._apply_priorities()
+
+    async def _fetch_metadata(self):
+        """Download the info dictionary of a magnet link from the handshaked peers
+
+        Returns:
+            None
+        """
+
+        info = await MetadataFetcher(self._magnet.info_hash).fetch(self._peers)
+        if info is None:
+            raise Exception(f"couldn't download the metadata of {self._magnet.file_name}")
+
+        announce = self._magnet.announce_url or ""
+        self._load_torrent({b"announce": announce.encode(), b"info": info})
+
+    def add_peers(self, addresses):
+        """Add newly discovered peer addresses to the peer pool.
+        Peers joining mid-download are handshaked and start downloading right away
+
+        Args:
+            addresses: a list of (ip, port) tuples
+
+        Returns:
+            None
+        """
+
+        for address in addresses:
+            address = normalize_address(address)
+            if address in self._known:
+                continue
+            self._known.add(address)
 
-            for block in self._blocks:
-                scheduled_peers = [tup[0] for tup in scheduled]
+            if not self._reserve_slot():
+                self._candidates.append(address)
+                continue
+
+            peer = self._new_peer(address)
+            self._peers.append(peer)
+
+            if self._downloading:
+                self._start_worker(self._join(peer), peer)
+
+    def _new_peer(self, address):
+        """Create a peer object whose bandwidth buckets are nested in the torrent buckets
+
+        Args:
+            address: an (ip, port) tuple
 
-                try:
-                    peer = random.choice([peer for peer in self._peers if
-                            block.index in peer.available_pieces and
-                            peer not in scheduled_peers])
+        Returns:
+            a peer object
+        """
+
+        return Peer(address[0], address[1], self._torrent, on_peers=self.add_peers, profiler=self._profiler,
+                    download_limit=TokenBucket(self.peer_download_rate, parent=self.download_limit),
+                    upload_limit=TokenBucket(self.peer_upload_rate, parent=self.upload_limit), capture=self._capture,
+                    stats=self.stats, read_block=self._read_block)
+
+    async def _read_block(self, index, begin, length):
+        """Read a block requested by a peer from the pieces on disk
+
+        Args:
+            index: the piece index
+            begin: the block offset in the piece
+            length: the block length
+
+        Returns:
+            the block bytes, None if the block can't be uploaded
+        """
 
-                    scheduled.append((peer, block))
-                except IndexError:
-                    blocks.append(block)
+        if self._file_saver is None:
+            return None
 
-            self._blocks.extend_blocks(blocks)
+        return await self._file_saver.read(index, begin, length)
+
+    def _announce_piece(self, index):
+        """Tell every peer about a piece written to disk, so they can request it
+
+        Args:
+            index: the piece index
+
+        Returns:
+            None
+        """
+
+        for peer in self._peers:
+            peer.have(index)
+
+    def _bitfield(self):
+        """The raw bitfield of the pieces that can be uploaded, sent to peers after the handshake
+
+        Returns:
+            the bitfield bytes, empty before the metadata of a magnet link is known
+        """
+
+        if self._file_saver is None:
+            return b""
+
+        bitfield = bytearray((len(self._torrent.piece_hashes) + 7) // 8)
+        for index in self._file_saver.uploadable:
+            bitfield[index >> 3] |= 0x80 >> (index & 7)
+
+        return bytes(bitfield)
+
+    def _reserve_slot(self):
+        """Reserve a connection slot for a new peer within the torrent and the shared connection limits
+
+        Returns:
+            True if a slot was reserved, else False
+        """
+
+        if len(self._peers) >= self._max_peers:
+            return False
+
+        return self._connections is None or self._connections.try_acquire()
+
+    def _drop_peer(self, peer):
+        """Close a peer connection, remove it from the pool and free its connection slot
+
+        Args:
+            peer: a peer object in the pool
+
+        Returns:
+            None
+        """
+
+        if peer not in self._peers:
+            return
+
+        self._peers.remove(peer)
+        peer.close()
+        self._count_peers()
+
+        if self._connections is not None:
+            self._connections.release()
+
+    def _count_peers(self):
+        """Publish the number of handshaked peers to the stats
+
+        Returns:
+            None
+        """
 
-            for tup in scheduled:
-                tasks.append(asyncio.create_task(tup[0].download(tup[1])))
+        self.stats.peers = len([peer for peer in self._peers if peer.handshake_complete])
 
-            results = await asyncio.gather(*tasks)
+    def _fill_from_candidates(self):
+        """Move waiting candidate addresses into the pool while connection slots are free
 
-            for i, downloaded in enumerate(results):
-                if downloaded:
-                    self._file_saver.append(downloaded)
+        Returns:
+            a list of the new peer objects
+        """
+
+        peers = []
+        while self._candidates and self._reserve_slot():
+            peer = self._new_peer(self._candidates.pop(0))
+            self._peers.append(peer)
+            peers.append(peer)
+
+        return peers
+
+    def _start_workers(self):
+        """Start a worker for every handshaked peer and WebSeed.CONNECTIONS workers for every usable web seed
+        that don't have them running. Snubbed peers only get a worker when every peer is snubbed
+
+        Returns:
+            None
+        """
+
+        running = list(self._workers.values())
+
+        peers = [peer for peer in self._peers if peer.handshake_complete]
+        for peer in [peer for peer in peers if not peer.score.snubbed] or peers:
+            if peer not in running:
+                self._start_worker(self._download_from(peer), peer)
+
+        for seed in self._web_seeds:
+            for _ in range(WebSeed.CONNECTIONS - running.count(seed) if seed.usable else 0):
+                self._start_worker(self._download_from_web_seed(seed), seed)
+
+    def _start_worker(self, coro, source):
+        """Run a worker coroutine as a task the download waits for
+
+        Args:
+            coro: the coroutine to be run
+            source: the peer or web seed the worker downloads from
+
+        Returns:
+            None
+        """
+
+        task = asyncio.create_task(coro)
+        self._workers[task] = source
+        task.add_done_callback(self._workers.pop)
+
+    async def _handshake(self, peer):
+        """Handshake a peer, recording how long the first successful handshake took. A peer listed under
+        several addresses, such as an IPv4 and an IPv6 one, keeps the connection whose handshake completed first
+
+        Args:
+            peer: a new peer object
+
+        Returns:
+            None
+        """
+
+        await peer.handshake(self._bitfield())
+
+        if peer.handshake_complete and any(other is not peer and other.handshake_complete and
+                                           other.peer_id == peer.peer_id for other in self._peers):
+            peer.close()
+
+        if peer.handshake_complete and self.time_to_first_handshake is None:
+            self.time_to_first_handshake = time.monotonic() - self._started
+
+        self._count_peers()
+
+    async def _join(self, peer):
+        """Handshake a peer discovered mid-download and start downloading from it
+
+        Args:
+            peer: a new peer object
+
+        Returns:
+            None
+        """
+
+        await self._handshake(peer)
+
+        if not peer.handshake_complete:
+            self._drop_peer(peer)
+
+            for candidate in self._fill_from_candidates():
+                self._start_worker(self._join(candidate), candidate)
+            return
+
+        await self._download_from(peer)
+
+    async def _download_from(self, peer):
+        """Keep downloading blocks from a single peer until every block is downloaded or the peer fails.
+        While the peer has nothing to offer, the worker waits for its messages, such as 'have' or 'unchoke'.
+        A peer whose connection failed is dropped and replaced by a waiting candidate.
+        Up to peer.window.size requests are kept outstanding, the window follows the measured bandwidth-delay
+        product of the peer. In endgame the same block is fetched from several peers, with at most
+        RequestWindow.MIN_SIZE requests per peer, and the rest are cancelled once a copy arrives.
+        The requests of a peer that became snubbed are cancelled and its blocks handed to other peers right away.
+        While the piece buffers are over the memory budget only blocks of started pieces are requested
+
+        Args:
+            peer: a handshaked peer object
+
+        Returns:
+            None
+        """
+
+        pending = {}
+
+        try:
+            while peer.handshake_complete:
+                refused = False
+                while len(pending) < (peer.window.size if not self._blocks.in_endgame else RequestWindow.MIN_SIZE):
+                    block = self._blocks.next_for(peer, self._allowed_pieces())
+                    if block is None:
+                        break
+
+                    self._file_saver.start(block.index)
+
+                    if not await peer.request(block):
+                        self._blocks.release(block, peer)
+                        refused = True
+                        break
+
+                    pending[(block.index, block.begin)] = block
+
+                if not pending:
+                    if self._blocks.empty():
+                        return
+
+                    if self._file_saver.memory_full and not refused:
+                        with self._profiler.phase("memory_wait"):
+                            await self._file_saver.wait_for_memory(Tracker.MEMORY_WAIT)
+                        continue
+
+                    await peer.receive()
+                    continue
+
+                delivered = await peer.receive()
+                arrived = {(piece.index, piece.begin): piece for piece in delivered}
+
+                for key in [key for key in pending if key not in peer.requests]:
+                    block = pending.pop(key)
+                    if key not in arrived:
+                        self._blocks.release(block, peer)
+                        continue
+
+                    others = self._blocks.complete(block, peer)
+                    if others is None:
+                        continue
+
+                    for other in others:
+                        await other.cancel(block)
+
+                    await self._append(arrived[key], peer)
+
+                if peer.score.snubbed:
+                    for block in pending.values():
+                        await peer.cancel(block)
+                        self._blocks.release(block, peer)
+                    pending.clear()
+                    peer.window.backoff()
+
+                if not delivered:
+                    continue
+
+                self._blocks.extend_blocks(self._take_failed_blocks())
+
+                await peer.send_pex([(other.ip, other.port) for other in self._peers if other.handshake_complete])
+
+                with self._profiler.phase("disk_wait"):
+                    await self._file_saver.drain()
+        finally:
+            for block in pending.values():
+                self._blocks.release(block, peer)
+
+            if not peer.handshake_complete:
+                self._drop_peer(peer)
+
+                for candidate in self._fill_from_candidates():
+                    self._start_worker(self._join(candidate), candidate)
+
+    async def _download_from_web_seed(self, seed):
+        """Keep fetching runs of contiguous blocks from a web seed with range requests. The blocks go through
+        the same verification as blocks from peers. While no block is left for the seed the worker checks again
+        every IDLE_WAIT seconds. After a failed request the worker waits RETRY_DELAY seconds and stops, the seed
+        gets a new worker until it failed or sent corrupt pieces MAX_FAILURES times in a row.
+        A seed that answered a range request with the whole file is not retried
+
+        Args:
+            seed: a WebSeed object
+
+        Returns:
+            None
+        """
+
+        while seed.usable:
+            span = self._blocks.next_span_for(seed, WebSeed.SPAN_BYTES, self._allowed_pieces())
+            if not span:
+                if self._blocks.empty():
+                    return
+
+                if self._file_saver.memory_full:
+                    with self._profiler.phase("memory_wait"):
+                        await self._file_saver.wait_for_memory(Tracker.MEMORY_WAIT)
                 else:
-                    self._blocks.add_block(scheduled[i][1])
+                    await asyncio.sleep(Tracker.IDLE_WAIT)
+                continue
+
+            for block in span:
+                self._file_saver.start(block.index)
+
+            try:
+                data = await seed.fetch(span[0].index * self._torrent.piece_length + span[0].begin,
+                                        sum(block.length for block in span))
+            except Exception:
+                for block in span:
+                    self._blocks.release(block, seed)
+
+                seed.failures += 1
+                if seed.usable:
+                    await asyncio.sleep(WebSeed.RETRY_DELAY)
+                return
+
+            position = 0
+
+            for block in span:
+                chunk = data[position:position + block.length]
+                position += block.length
+
+                others = self._blocks.complete(block, seed)
+                if others is None:
+                    continue
+
+                for other in others:
+                    await other.cancel(block)
+
+                await self._append(PieceMessage(block.index, block.begin, chunk, 0, MESSAGE_PIECE), seed)
+
+            failed = self._take_failed_blocks()
+            self._blocks.extend_blocks(failed)
+
+            pieces = {block.index for block in span}
+            seed.failures = seed.failures + 1 if any(block.index in pieces for block in failed) else 0
+
+            with self._profiler.phase("disk_wait"):
+                await self._file_saver.drain()
+
+    def _allowed_pieces(self):
+        """The pieces new requests may belong to, only the started ones once the piece buffers reached
+        the memory budget so the partial pieces finish and free their buffers first
+
+        Returns:
+            a collection of piece indexes, None if any piece may be started
+        """
+
+        return self._file_saver.started if self._file_saver.memory_full else None
+
+    async def _append(self, downloaded, source):
+        """Hand a downloaded block to the file saver, remembering the sources of the pieces being assembled.
+        The time to the first piece is taken when a piece passes its hash check
+
+        Args:
+            downloaded: a 'piece' message
+            source: the peer or web seed that delivered it
+
+        Returns:
+            None
+        """
+
+        self._contributors.setdefault(downloaded.index, set()).add(source)
+
+        with self._profiler.phase("hash"):
+            await self._file_saver.append(downloaded)
+
+        if downloaded.index in self._file_saver.verified:
+            del self._contributors[downloaded.index]
+
+            if self.time_to_first_piece is None:
+                self.time_to_first_piece = time.monotonic() - self._started
+
+    def _take_failed_blocks(self):
+        """Take the blocks of the pieces that failed verification and count a hash failure for every peer
+        that contributed to them
+
+        Returns:
+            a list of blocks to be downloaded again
+        """
+
+        failed = self._file_saver.get_failed_blocks()
+
+        for index in {block.index for block in failed}:
+            for source in self._contributors.pop(index, ()):
+                if isinstance(source, Peer):
+                    source.score.hash_failed()
 
-                self._blocks.extend_blocks(self._file_saver.get_failed_blocks())
+        return failed
 
-        self._file_saver.save()
+    async def _evict_periodically(self):
+        """Score the peers every EVICT_INTERVAL seconds and replace the worst ones with waiting candidates
+
+        Returns:
+            None
+        """
+
+        while True:
+            await asyncio.sleep(Tracker.EVICT_INTERVAL)
+
+            for peer in self._peers:
+                peer.score.sample()
+
+            self._evict()
+
+    def _evict(self):
+        """Drop up to EVICT_FRACTION of the peers in favour of candidates. Only peers scored for at least
+        one interval are evicted, snubbed peers first, then those scoring under EVICT_RATIO of the best peer
+
+        Returns:
+            None
+        """
+
+        if not self._candidates:
+            return
+
+        scored = [peer for peer in self._peers if peer.handshake_complete and
+                  peer.score.age >= Tracker.EVICT_INTERVAL]
+        if not scored:
+            return
+
+        best = max(peer.score.value for peer in scored)
+        worst = sorted((peer for peer in scored if peer.score.snubbed or
+                        peer.score.value < Tracker.EVICT_RATIO * best),
+                       key=lambda peer: (not peer.score.snubbed, peer.score.value))
+
+        count = min(len(self._candidates), max(1, int(len(self._peers) * Tracker.EVICT_FRACTION)))
+        for peer in worst[:count]:
+            self._drop_peer(peer)
+
+        for peer in self._fill_from_candidates():
+            self._start_worker(self._join(peer), peer)
 
     async def _handshake_peers(self):
         """Handshake the peers and update the pool of peers to contain only the ones whose handshake was successful
@@ -84,23 +766,30 @@ class Tracker:
             None
         """
 
-        tasks = []
-        for peer in self._peers:
-            if not peer.handshake_complete:
-                tasks.append(asyncio.create_task(peer.handshake()))
+        while True:
+            pending = [peer for peer in self._peers if not peer.handshake_complete]
+            if not pending:
+                return
 
-        if tasks:
-            await asyncio.gather(*tasks)
+            await asyncio.gather(*[asyncio.create_task(self._handshake(peer)) for peer in pending])
 
-        self._peers = [peer for peer in self._peers if peer.handshake_complete]
+            for peer in pending:
+                if not peer.handshake_complete:
+                    self._drop_peer(peer)
+
+            self._fill_from_candidates()
+            self._count_peers()
 
     async def _request_peers(self):
         """Request peers from the tracker server
 
         Returns:
-            a tuple consisting of (peers list, interval)
+            a tuple consisting of (list of (ip, port) tuples, interval)
         """
 
+        import aiohttp
+        import yarl
+
         peers_list = []
 
         params = {name: urllib.parse.quote(value) if isinstance(value, bytes) else value
@@ -109,27 +798,26 @@ class Tracker:
         url = yarl.URL(self._torrent.announce_url).update_query(params)
         url = urllib.parse.unquote(str(url))
 
+        started = time.monotonic()
+
         async with aiohttp.ClientSession() as session:
             r = await session.get(url)
             content = await r.read()
             peers_dict = bdecode(content)
 
+        self.stats.announce_seconds = time.monotonic() - started
+
         interval = peers_dict[b'interval']
 
-        if isinstance(peers_dict[b'peers'], list):
-            for peer in peers_dict[b'peers']:
-                peers_list.append(Peer(peer[b"ip"].decode(), peer[b"port"], self._torrent))
-        elif isinstance(peers_dict[b'peers'], bytes):
-            bstr = peers_dict[b'peers']
-            while bstr:
-                addr_bytes, port_bytes = (
-                    bstr[:4], bstr[4:6]
-                )
-                ip_addr = str(ipaddress.IPv4Address(addr_bytes))
-                port_bytes = struct.unpack('>H', port_bytes)[0]
-                peers_list.append(Peer(ip_addr, port_bytes, self._torrent))
-
-                bstr = bstr[6:]
+        peers = peers_dict.get(b'peers', b'')
+        if isinstance(peers, list):
+            for peer in peers:
+                peers_list.append(normalize_address((peer[b"ip"].decode(), peer[b"port"])))
+        elif isinstance(peers, bytes):
+            peers_list.extend(decode_compact_peers(peers))
+
+        if isinstance(peers_dict.get(b'peers6'), bytes):
+            peers_list.extend(decode_compact_peers6(peers_dict[b'peers6']))
 
         return peers_list, interval
 
@@ -138,12 +826,12 @@ class Tracker:
         return self._peers
 
     @classmethod
-    def from_path(cls, file_path, progress_bar):
+    def from_path(cls, file_path, **kwargs):
         """Initialize a tracker instance from a given path
 
         Args:
             file_path: the *.torrent file path
-            progress_bar: a gui progress bar to be updated as the download progresses
+            **kwargs: optional tracker arguments such as dht, max_peers, connections and profiler
 
         Returns:
             a tracker instance
@@ -152,9 +840,34 @@ class Tracker:
         with open(file_path, "rb") as f:
             data = f.read()
 
-        return cls(bdecode(data), progress_bar)
+        return cls(bdecode(data), **kwargs)
+
+    @classmethod
+    def from_magnet(cls, uri, **kwargs):
+        """Initialize a tracker instance from a magnet uri, the metadata is downloaded when the download starts
+
+        Args:
+            uri: a magnet uri
+            **kwargs: optional tracker arguments such as dht, max_peers, connections and profiler.
+                a dht node is required for magnet links without trackers
+
+        Returns:
+            a tracker instance
+        """
+
+        return cls(None, magnet=MagnetLink.parse(uri), **kwargs)
+
+    @property
+    def has_metadata(self):
+        """True once the info dictionary is known, always for *.torrent files"""
+        return self._file_saver is not None
 
     @property
     def torrent_name(self):
         """The torrent file name"""
         return self._torrent.file_name
+
+    @property
+    def info_hash(self):
+        """The 20-byte SHA1 hash of the info dictionary"""
+        return self._torrent.info_hash
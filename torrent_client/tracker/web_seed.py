@@ -0,0 +1,124 @@
+from .torrent import MultiFileTorrent
+import urllib.parse
+
+
+class WebSeed:
+    SPAN_BYTES = 2 ** 22
+    CONNECTIONS = 4
+    TIMEOUT = 30
+    RETRY_DELAY = 5
+    MAX_FAILURES = 5
+
+    def __init__(self, url, torrent, files, download_limit=None):
+        """Initialize an HTTP web seed (BEP 19), a source serving the torrent content with range requests
+
+        Args:
+            url: the web seed url from the 'url-list' of the metainfo file
+            torrent: the torrent object the seed serves
+            files: the TorrentFiles object whose layout maps content ranges to files
+            download_limit: an optional TokenBucket the fetched bytes are taken from
+        """
+
+        self.url = url
+        self.available_pieces = set(range(len(torrent.piece_hashes)))
+        self.failures = 0
+        self.ignores_ranges = False
+        self.downloaded_bytes = 0
+
+        self._files = files
+        self._file_urls = WebSeed.file_urls(url, torrent)
+        self._download_limit = download_limit
+        self._session = None
+
+    @staticmethod
+    def file_urls(url, torrent):
+        """Build the url of each torrent file. A multi-file torrent is served under a directory named
+        after the torrent, and a single file url ending with '/' is completed with the file name
+
+        Args:
+            url: the web seed url
+            torrent: the torrent object
+
+        Returns:
+            a list of urls in torrent order
+        """
+
+        if isinstance(torrent, MultiFileTorrent):
+            root = url if url.endswith("/") else url + "/"
+            root += urllib.parse.quote(torrent.file_name) + "/"
+            return [root + "/".join(urllib.parse.quote(p.decode()) for p in file[b"path"]) for file in torrent.files]
+
+        if url.endswith("/"):
+            return [url + urllib.parse.quote(torrent.file_name)]
+
+        return [url]
+
+    @property
+    def usable(self):
+        """False once the seed failed MAX_FAILURES times in a row or answered a range request with the whole file"""
+        return not self.ignores_ranges and self.failures < WebSeed.MAX_FAILURES
+
+    async def fetch(self, offset, length):
+        """Download a range of the torrent content, with one range request per file it spans.
+        A server answering with the whole file instead of the range is not used again
+
+        Args:
+            offset: the offset in the torrent content
+            length: the range length
+
+        Returns:
+            the bytes of the range
+        """
+
+        import aiohttp
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=WebSeed.CONNECTIONS),
+                                                  timeout=aiohttp.ClientTimeout(total=WebSeed.TIMEOUT))
+
+        if self._download_limit is not None:
+            await self._download_limit.consume(length)
+
+        chunks = []
+        for i, position, size in self._files.ranges(offset, length):
+            headers = {"Range": f"bytes={position}-{position + size - 1}"}
+
+            async with self._session.get(self._file_urls[i], headers=headers) as r:
+                if r.status == 206:
+                    data = await r.read()
+                elif r.status == 200:
+                    self.ignores_ranges = True
+                    raise Exception(f"web seed {self.url} ignores range requests")
+                else:
+                    raise Exception(f"web seed {self.url} answered {r.status}")
+
+            if len(data) != size:
+                raise Exception(f"web seed {self.url} sent {len(data)} bytes instead of {size}")
+
+            chunks.append(data)
+
+        self.downloaded_bytes += length
+        return b"".join(chunks)
+
+    async def cancel(self, block):
+        """Range requests aren't cancelled block by block, a duplicate delivered in endgame is dropped
+
+        Args:
+            block: the block delivered by another source
+
+        Returns:
+            None
+        """
+
+        pass
+
+    async def close(self):
+        """Close the pooled HTTP connections
+
+        Returns:
+            None
+        """
+
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()